@@ -1,11 +1,13 @@
 import logging
 from typing import Dict, Any
 
+from flask import request
 from gevent.wsgi import WSGIServer
 from werkzeug.exceptions import NotFound, BadRequest
 
-from tools.flask import EmptyApp
+from tools.flask import EmptyApp, jsonify
 from tools.flask.decorators import validate, json
+from tools.gevent import NoDelayWSGIHandler
 from tools.socket.tcp_client import TcpClientThreading
 
 
@@ -26,12 +28,36 @@ class ControllerRestService(EmptyApp):
         def ping():
             return "Pong"
 
+        @self.route("/transactions", methods=["GET"])
+        @json()
+        def transaction_list():
+            query = {
+                key: request.args[key] for key in ("state", "since", "until", "after", "limit") if key in request.args
+            }
+            header, js = self.client.call("list_transactions", query).values
+            if header == "400":
+                raise BadRequest(js["error"])
+            elif header != "200":
+                raise Exception(header, js)
+            else:
+                return js
+
         @self.route("/transactions", methods=["POST"])
         @validate(self.schemas["transaction"])
         @json(id_field="ID", hide_id=False)
         def transaction_create(data: Dict[str, Any]):
             header, js = self.client.call("open_transaction", data).values
-            if header != "200" and header != 200:
+            if header == "400":
+                raise BadRequest(js["error"])
+            elif header == "429":
+                response = jsonify(429, {"code": 429, "text": "429 Too Many Requests", "description": js["error"]})
+                response.headers["Retry-After"] = str(js["retry_after"])
+                return response
+            elif header == "503":
+                response = jsonify(503, {"code": 503, "text": "503 Service Unavailable", "description": js["error"]})
+                response.headers["Retry-After"] = str(js["retry_after"])
+                return response
+            elif header != "200" and header != 200:
                 raise Exception(header, js)
             else:
                 return {**js, "OK": True}
@@ -89,7 +115,8 @@ def main(args=None):
     else:
         args, _ = parser.parse_known_args()
 
-    http_server = WSGIServer(('', args.port), ControllerRestService(args.path), log=None if args.no_log else 'default')
+    http_server = WSGIServer(('', args.port), ControllerRestService(args.path), log=None if args.no_log else 'default',
+                             handler_class=NoDelayWSGIHandler)
     http_server.serve_forever()
 
 
@@ -0,0 +1,179 @@
+"""
+Actions of a transaction form a dependency graph. An action in `then` of another one and an action whose `$patterns`
+refer to responses of other actions are sent as soon as those responses are received, independent actions are
+sent in parallel.
+
+>>> "$patterns": {
+... 	"url": {"$id": "$RESPONSE/key1._id"},  # "/item/{id}" -> "/item/100500"
+... 	"data": {"$body": "$RESPONSE[b]/key1(name, value)"}  # "{body}" -> {"name": ..., "value": ...}
+... }
+
+`$RESPONSE` is the response of the action this one is `then` of, `$RESPONSE[<_id>]` - of any action.
+Path is dotted (list items by index), `(field, ...)` picks fields of the object (of every item of a list).
+A string which is a single placeholder is replaced by the value itself, otherwise values are formatted into it.
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Set
+
+PATTERN_FIELDS = ("url", "data", "headers")
+
+Renderer = Callable[[Dict[str, Any]], Any]  # responses by action id -> value
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class Reference:
+    """Compiled `$RESPONSE[<_id>]/path(fields)` expression"""
+    __slots__ = ("action", "path", "fields")
+    _re = re.compile(r"^\$RESPONSE(?:\[(?P<action>[^\]]+)\])?(?:/(?P<path>[^(]*))?(?:\((?P<fields>[^)]*)\))?$")
+
+    def __init__(self, expression: str, then_of: Optional[str]):
+        """
+
+        :param expression:
+        :param then_of: id of action which `then` this action is
+        """
+        match = self._re.match(expression.strip())
+        if match is None:
+            raise TemplateError(f"Invalid pattern: {expression}")
+        self.action: str = match["action"] or then_of
+        if self.action is None:
+            raise TemplateError(f"{expression}: $RESPONSE without action id is allowed in `then` only")
+        path = (match["path"] or "").strip()
+        self.path = [int(key) if key.isdigit() else key for key in path.split(".")] if path else []
+        self.fields = [field.strip() for field in match["fields"].split(",")] if match["fields"] else None
+
+    def resolve(self, responses: Dict[str, Any]) -> Any:
+        try:
+            value = responses[self.action]
+            for key in self.path:
+                value = value[key]
+            if self.fields is not None:
+                value = [self._pick(item) for item in value] if isinstance(value, list) else self._pick(value)
+        except (KeyError, IndexError, TypeError):
+            raise TemplateError(f"{self} is not found in response")
+        return value
+
+    def _pick(self, value: dict) -> dict:
+        return {field: value[field] for field in self.fields}
+
+    def __repr__(self):
+        return f"<Reference {self.action}/{'.'.join(map(str, self.path))}{self.fields or ''}>"
+
+
+class Template:
+    """Field value (any JSON) with `{name}` placeholders of `$name` patterns in strings, compiled once"""
+
+    def __init__(self, value: Any, patterns: Dict[str, Reference]):
+        self.patterns = patterns
+        self._placeholder = re.compile(r"\{(" + "|".join(re.escape(name[1:]) for name in patterns) + r")\}")
+        self.render: Renderer = self._compile(value)
+
+    def _compile(self, value: Any) -> Renderer:
+        if isinstance(value, dict):
+            items = [(key, self._compile(item)) for key, item in value.items()]
+            return lambda responses: {key: render(responses) for key, render in items}
+        if isinstance(value, list):
+            renders = [self._compile(item) for item in value]
+            return lambda responses: [render(responses) for render in renders]
+        if not isinstance(value, str):
+            return lambda responses: value
+
+        parts = self._placeholder.split(value)  # literals at even indices, placeholder names at odd ones
+        if len(parts) == 1:
+            return lambda responses: value
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            return self.patterns["$" + parts[1]].resolve
+        literals = parts[0::2]
+        references = [self.patterns["$" + name] for name in parts[1::2]]
+
+        def render(responses):
+            values = (_format(reference.resolve(responses)) for reference in references)
+            return literals[0] + "".join(text + literal for text, literal in zip(values, literals[1:]))
+
+        return render
+
+
+def _format(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class Action:
+    """Node of actions graph"""
+
+    def __init__(self, data: dict, then_of: Optional[str] = None):
+        """
+
+        :param data: action (see Transaction)
+        :param then_of: id of action which `then` this action is
+        """
+        self.id: str = data["_id"]
+        self.data = data
+        self.requires: Set[str] = {then_of} if then_of is not None else set()
+        self.templates: Dict[str, Template] = {}
+        for field, patterns in (data.get("$patterns") or {}).items():
+            if field not in PATTERN_FIELDS:
+                raise TemplateError(f"Action {self.id}: patterns of {field} are not supported")
+            if not patterns:
+                continue
+            for name in patterns:
+                if not re.match(r"^\$[a-zA-Z_]+$", name):
+                    raise TemplateError(f"Action {self.id}: invalid pattern name {name}")
+            references = {name: Reference(expression, then_of) for name, expression in patterns.items()}
+            self.templates[field] = Template(data.get(field), references)
+            self.requires |= {reference.action for reference in references.values()}
+
+    def render(self, responses: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :param responses: responses of required actions by id
+        :return: fields with patterns
+        :raise TemplateError: if referenced value is not found
+        """
+        return {field: template.render(responses) for field, template in self.templates.items()}
+
+    def __repr__(self):
+        return f"<Action {self.id} after {sorted(self.requires)}>"
+
+
+def plan(actions: List[dict]) -> List[Action]:
+    """
+    Unroll `then` chains and check the graph
+
+    :return: all actions of transaction
+    :raise TemplateError: duplicated _id, reference to unknown action, cycle of references
+    """
+    nodes: Dict[str, Action] = {}
+    stack = [(data, None) for data in reversed(actions)]
+    while stack:
+        data, then_of = stack.pop()
+        node = Action(data, then_of)
+        if node.id in nodes:
+            raise TemplateError(f"Duplicated action _id: {node.id}")
+        nodes[node.id] = node
+        if data.get("then"):
+            stack.append((data["then"], node.id))
+
+    for node in nodes.values():
+        unknown = node.requires - nodes.keys()
+        if unknown:
+            raise TemplateError(f"Action {node.id} refers to unknown actions: {', '.join(sorted(unknown))}")
+
+    # Kahn's algorithm: actions which are left unresolved are in a cycle
+    waiting = {node.id: len(node.requires) for node in nodes.values()}
+    dependents: Dict[str, List[str]] = {}
+    for node in nodes.values():
+        for _id in node.requires:
+            dependents.setdefault(_id, []).append(node.id)
+    ready = [_id for _id, count in waiting.items() if not count]
+    while ready:
+        for _id in dependents.get(ready.pop(), ()):
+            waiting[_id] -= 1
+            if not waiting[_id]:
+                ready.append(_id)
+    cycle = sorted(_id for _id, count in waiting.items() if count)
+    if cycle:
+        raise TemplateError(f"Actions depend on each other: {', '.join(cycle)}")
+    return list(nodes.values())
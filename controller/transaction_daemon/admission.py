@@ -0,0 +1,156 @@
+import math
+from collections import deque
+from typing import Dict, Any, Iterable, Optional, Set, Deque
+
+from gevent.event import AsyncResult
+
+from tools import Seconds
+from tools.timers import wheel, Timer
+
+
+class Overloaded(Exception):
+    """Transaction is rejected by admission control"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after  # s, estimated time until the queue drains
+
+
+class _Ticket:
+    """Transaction waiting for admission"""
+    __slots__ = ("services", "result", "timer")
+
+    def __init__(self, services: Set[str], result: AsyncResult):
+        self.services = services
+        self.result = result
+        self.timer: Timer = None
+
+
+class AdmissionController:
+    """
+    Caps of active transactions (`max_active`) and of active transactions using one participant service
+    (`max_per_service`), None - no cap. Transaction which doesn't fit waits in the queue of `queue_size` transactions
+    (up to its timeout); when the queue is full it is rejected at once, so overload ends in fast rejections
+    instead of mass timeouts.
+
+    Queued transactions are admitted in order of arrival, but a transaction which waits for a busy service doesn't
+    hold back transactions to other services.
+    """
+    queue_size = 1000
+    duration: Seconds = 1.  # initial estimate of transaction duration (for Retry-After)
+    alpha = 0.1  # weight of the last transaction in duration estimate
+
+    def __init__(self, max_active: int = None, max_per_service: int = None, queue_size: int = None):
+        """
+
+        :param max_active: max number of running transactions
+        :param max_per_service: max number of running transactions using the same participant service
+        :param queue_size: max number of transactions waiting for admission (0 - reject at once)
+        """
+        self.max_active = max_active
+        self.max_per_service = max_per_service
+        self.queue_size = queue_size if queue_size is not None else self.__class__.queue_size
+        self.active = 0
+        self.services: Dict[str, int] = {}  # number of running transactions by service url
+        self._queue: Deque[_Ticket] = deque()
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    def enter(self, services: Iterable[str], timeout: Seconds) -> Optional[AsyncResult]:
+        """
+        Take slots of transaction
+
+        :param services: urls of participant services of transaction
+        :param timeout: max time in the queue
+        :return: None if transaction may start now, otherwise AsyncResult which is set when it is admitted
+            (or gets Overloaded exception when it waited for `timeout`)
+        :raise Overloaded: if the queue is full
+        """
+        services = set(services)
+        if self._fits(services):  # queued transactions don't fit, otherwise they would be admitted
+            self._take(services)
+            return None
+        if len(self._queue) >= self.queue_size:
+            self.counters["rejected"] += 1
+            raise Overloaded("Too many transactions", self.retry_after)
+
+        ticket = _Ticket(services, AsyncResult())
+        ticket.timer = wheel.call_later(timeout, self._expire, ticket)
+        self._queue.append(ticket)
+        self.counters["queued"] += 1
+        return ticket.result
+
+    def leave(self, services: Iterable[str], duration: Seconds):
+        """
+        Release slots of finished transaction and admit queued ones
+
+        :param duration: time the transaction took
+        """
+        self.active -= 1
+        for service in set(services):
+            self.services[service] -= 1
+            if not self.services[service]:
+                del self.services[service]
+        self.duration += self.alpha * (duration - self.duration)
+        self._admit()
+
+    def cancel(self, result: AsyncResult):
+        """Remove queued transaction (`result` of enter) from the queue, it won't be admitted"""
+        for ticket in self._queue:
+            if ticket.result is result:
+                ticket.timer.cancel()
+                self._queue.remove(ticket)
+                return
+
+    def _fits(self, services: Set[str]) -> bool:
+        if self.max_active is not None and self.active >= self.max_active:
+            return False
+        if self.max_per_service is not None:
+            return all(self.services.get(service, 0) < self.max_per_service for service in services)
+        return True
+
+    def _take(self, services: Set[str]):
+        self.active += 1
+        for service in services:
+            self.services[service] = self.services.get(service, 0) + 1
+        self.counters["admitted"] += 1
+
+    def _admit(self):
+        if not self._queue:
+            return
+        waiting = deque()
+        while self._queue:
+            ticket = self._queue.popleft()
+            if self.max_active is not None and self.active >= self.max_active:
+                waiting.append(ticket)
+                waiting.extend(self._queue)
+                self._queue.clear()
+            elif self._fits(ticket.services):
+                ticket.timer.cancel()
+                self._take(ticket.services)
+                ticket.result.set(True)  # EMIT(admitted)
+            else:
+                waiting.append(ticket)
+        self._queue = waiting
+
+    def _expire(self, ticket: _Ticket):
+        self._queue.remove(ticket)
+        self.counters["timeouts"] += 1
+        ticket.result.set_exception(Overloaded("Transaction waited for admission too long", self.retry_after))
+
+    @property
+    def retry_after(self) -> int:
+        """Seconds until the queue drains (estimate)"""
+        capacity = self.max_active or self.max_per_service or 1
+        return max(1, math.ceil(self.duration * (len(self._queue) + 1) / capacity))
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active, "queue": len(self._queue), "retry_after": self.retry_after, **self.counters
+        }
+
+    def close(self):
+        for ticket in self._queue:
+            ticket.timer.cancel()
+            ticket.result.set_exception(Overloaded("Coordinator is stopped", self.retry_after))
+        self._queue.clear()
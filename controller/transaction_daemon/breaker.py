@@ -0,0 +1,145 @@
+import math
+import time
+from typing import Dict, Any, Iterable, Callable
+
+from tools import Seconds
+from tools.gevent import g_async
+from tools.timers import wheel, Timer
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitOpen(Exception):
+    """Transaction is rejected because its participant service is considered down"""
+
+    def __init__(self, message: str, service: str, retry_after: int):
+        super().__init__(message)
+        self.service = service
+        self.retry_after = retry_after  # s, until the next probe of the service
+
+
+class _Circuit:
+    """Breaker state of one service"""
+    __slots__ = ("state", "failures", "reset_timeout", "opened_at", "timer")
+
+    def __init__(self, reset_timeout: Seconds):
+        self.state = CLOSED
+        self.failures = 0  # in a row
+        self.reset_timeout = reset_timeout  # doubles on every failed probe
+        self.opened_at = 0.
+        self.timer: Timer = None
+
+
+class CircuitBreakers:
+    """
+    Circuit breaker of every participant service, fed by outcomes of requests to it (prepare, ping, commit).
+    `failures` failed requests in a row (connection error, timeout, HTTP 5xx) open the circuit: transactions which use
+    the service are rejected at once, its children which aren't opened yet fail without waiting for timeouts.
+
+    Open circuit is half-open after `reset_timeout`: the service is probed in background (`probe(service) -> bool`)
+    while transactions are still rejected. Successful probe closes the circuit, failed one opens it again
+    for twice as long (up to `max_reset_timeout`).
+    """
+    reset_timeout: Seconds = 1.
+    max_reset_timeout: Seconds = 60.
+
+    def __init__(self, probe: Callable[[str], bool], failures: int = None, reset_timeout: Seconds = None,
+                 max_reset_timeout: Seconds = None, on_open: Callable[[str], Any] = None):
+        """
+
+        :param probe: liveness check of service (url) -> True if it is up (called in a greenlet)
+        :param failures: number of failed requests in a row which opens the circuit (None - breakers are off)
+        :param reset_timeout: time the circuit stays open before the first probe
+        :param max_reset_timeout: max time between probes of a service which is down
+        :param on_open: called with service url when its circuit opens
+        """
+        self.probe = probe
+        self.failures = failures
+        self.reset_timeout = reset_timeout if reset_timeout is not None else self.__class__.reset_timeout
+        self.max_reset_timeout = max_reset_timeout if max_reset_timeout is not None \
+            else self.__class__.max_reset_timeout
+        self.on_open = on_open
+        self._circuits: Dict[str, _Circuit] = {}
+        self.counters = {"opened": 0, "closed": 0, "probes": 0, "rejected": 0}
+
+    def success(self, service: str):
+        """Request to the service succeeded"""
+        circuit = self._circuits.get(service)
+        if circuit is not None and circuit.state == CLOSED:
+            del self._circuits[service]
+
+    def failure(self, service: str):
+        """Request to the service failed"""
+        if self.failures is None:
+            return
+        circuit = self._circuits.get(service)
+        if circuit is None:
+            circuit = self._circuits[service] = _Circuit(self.reset_timeout)
+        if circuit.state != CLOSED:
+            return
+        circuit.failures += 1
+        if circuit.failures >= self.failures:
+            self._open(service, circuit)
+            if self.on_open:
+                self.on_open(service)
+
+    def is_open(self, service: str) -> bool:
+        circuit = self._circuits.get(service)
+        return circuit is not None and circuit.state != CLOSED
+
+    def check(self, services: Iterable[str]):
+        """
+        :raise CircuitOpen: if circuit of any service is open
+        """
+        for service in services:
+            if self.is_open(service):
+                self.counters["rejected"] += 1
+                raise CircuitOpen(f"Service {service} is unavailable", service, self.retry_after(service))
+
+    def retry_after(self, service: str) -> int:
+        """Seconds until the next probe of the service"""
+        circuit = self._circuits[service]
+        if circuit.state == HALF_OPEN:
+            return 1
+        return max(1, math.ceil(circuit.opened_at + circuit.reset_timeout - time.monotonic()))
+
+    def _open(self, service: str, circuit: _Circuit):
+        circuit.state = OPEN
+        circuit.opened_at = time.monotonic()
+        circuit.timer = wheel.call_later(circuit.reset_timeout, self._half_open, service, circuit)
+        self.counters["opened"] += 1
+
+    def _half_open(self, service: str, circuit: _Circuit):
+        circuit.state = HALF_OPEN
+        circuit.timer = None
+        self._probe(service, circuit)  # THREAD:1
+
+    @g_async
+    def _probe(self, service: str, circuit: _Circuit):
+        self.counters["probes"] += 1
+        try:
+            alive = self.probe(service)  # BLOCK, timeout
+        except Exception:
+            alive = False
+        if self._circuits.get(service) is not circuit:  # closed by close()
+            return
+        if alive:
+            del self._circuits[service]
+            self.counters["closed"] += 1
+        else:
+            circuit.reset_timeout = min(2 * circuit.reset_timeout, self.max_reset_timeout)
+            self._open(service, circuit)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.failures is not None,
+            "open": {service: circuit.state for service, circuit in self._circuits.items() if circuit.state != CLOSED},
+            **self.counters
+        }
+
+    def close(self):
+        for circuit in self._circuits.values():
+            if circuit.timer:
+                circuit.timer.cancel()
+        self._circuits.clear()
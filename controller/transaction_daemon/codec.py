@@ -0,0 +1,95 @@
+"""
+Compact binary encoding of transaction status (see Transaction.status):
+
+    byte    format: PLAIN | ZLIB (body is compressed)
+    body:
+        byte    global status (EStatus value)
+        varint  number of childes
+        childes:
+            varint  id length, id (utf-8)
+            byte    status (EStatus value)
+            varint  service_response length (0 - null), service_response (compact JSON)
+
+Statuses stored by older versions are JSON; decode_status accepts them too.
+"""
+import json
+import zlib
+from typing import Dict, Any, Union, Tuple
+
+from tools.transactions import EStatus
+
+PLAIN = 1
+ZLIB = 2
+compress_threshold = 256  # bytes of body, smaller statuses are not worth compressing
+
+_json_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+
+def _write_varint(buf: bytearray, n: int):
+    while n >= 0x80:
+        buf.append(n & 0x7F | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode_status(status: Dict[str, Any], threshold: int = None) -> bytes:
+    """
+    >>> encode_status({"global": "DONE", "a": {"status": "DONE", "service_response": None}})
+    b'\\x01\\x05\\x01\\x01a\\x05\\x00'
+
+    :param status: Transaction.status
+    :param threshold: compress body with zlib if it is larger than this number of bytes
+    """
+    threshold = threshold if threshold is not None else compress_threshold
+    buf = bytearray((EStatus[status["global"]].value,))
+    _write_varint(buf, len(status) - 1)
+    for key, ch in status.items():
+        if key == "global":
+            continue
+        key = key.encode("utf-8")
+        _write_varint(buf, len(key))
+        buf += key
+        buf.append(EStatus[ch["status"]].value)
+        if ch["service_response"] is None:
+            buf.append(0)
+        else:
+            response = _json_encoder.encode(ch["service_response"]).encode("utf-8")
+            _write_varint(buf, len(response))
+            buf += response
+
+    if len(buf) > threshold:
+        compressed = zlib.compress(bytes(buf))
+        if len(compressed) < len(buf):
+            return bytes((ZLIB,)) + compressed
+    return bytes((PLAIN,)) + bytes(buf)
+
+
+def decode_status(data: Union[bytes, str]) -> Dict[str, Any]:
+    """Decode status encoded by encode_status (or JSON stored by older versions)"""
+    if isinstance(data, str) or data[0] not in (PLAIN, ZLIB):
+        return json.loads(data)
+    body = zlib.decompress(data[1:]) if data[0] == ZLIB else memoryview(data)[1:]
+
+    status = {"global": EStatus(body[0]).name}
+    n, pos = _read_varint(body, 1)
+    for _ in range(n):
+        length, pos = _read_varint(body, pos)
+        key = bytes(body[pos:pos + length]).decode("utf-8")
+        pos += length
+        ch_status = EStatus(body[pos]).name
+        length, pos = _read_varint(body, pos + 1)
+        response = json.loads(bytes(body[pos:pos + length])) if length else None
+        pos += length
+        status[key] = {"status": ch_status, "service_response": response}
+    return status
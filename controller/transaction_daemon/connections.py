@@ -0,0 +1,288 @@
+import queue
+import time
+from collections import deque
+from typing import Dict, Any, List, Set
+
+import urllib3
+from gevent import sleep, getcurrent, Greenlet
+from gevent.event import Event
+from gevent.lock import BoundedSemaphore
+from urllib3.connection import HTTPConnection
+
+from tools import Seconds
+from tools.gevent import g_async
+
+# Outbound request lanes (lower goes first)
+DECISION = 0  # phase 2 (commit / rollback / finish) and control traffic: releases locks on participants
+PREPARE = 1  # phase 1: new work
+LANES = ("decision", "prepare")
+
+
+class PriorityLanes:
+    """
+    Limit of concurrent requests to one service. When all slots are busy requests wait in lanes;
+    released slot is given to the first request of the highest priority non-empty lane.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.active = 0
+        self._waiters: List[deque] = [deque() for _ in LANES]
+        self.counters = {f"queued_{lane}": 0 for lane in LANES}
+
+    def acquire(self, lane: int):
+        if self.active < self.size and not any(self._waiters):
+            self.active += 1
+            return
+        self.counters[f"queued_{LANES[lane]}"] += 1
+        event = Event()
+        self._waiters[lane].append(event)
+        try:
+            event.wait()  # BLOCK, until slot is released
+        except BaseException:
+            if event.ready():
+                self.release()  # slot was given to killed greenlet
+            else:
+                self._waiters[lane].remove(event)
+            raise
+
+    def release(self):
+        for waiters in self._waiters:
+            if waiters:
+                waiters.popleft().set()  # EMIT(slot), hand over the slot
+                return
+        self.active -= 1
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters)
+
+
+class _CountedConnection(HTTPConnection):
+    """HTTP connection which reports opened and closed sockets to ConnectionPoolManager"""
+    pool: 'HTTPConnectionPoolWithLock' = None
+    last_used = 0.
+    _counted = False
+
+    def connect(self):
+        manager = self.pool.manager if self.pool else None
+        if manager:
+            manager._acquire_socket()  # BLOCK, until total number of sockets is under limit
+        try:
+            super().connect()
+        except BaseException:  # also GreenletExit of cancelled request
+            if manager:
+                manager._release_socket()
+            raise
+        self._counted = bool(manager)
+        if manager:
+            manager.counters["new_connections"] += 1
+
+    def close(self):
+        counted, self._counted = self._counted, False
+        super().close()
+        if counted:
+            self.pool.manager._release_socket()
+
+
+class HTTPConnectionPoolWithLock(urllib3.HTTPConnectionPool):
+    """
+    Connection pool of one participant service. `lock` is the number of transactions using it.
+    Concurrent requests are limited by `max_requests` (`maxsize` by default), waiting requests are served by priority
+    (`request(..., priority=DECISION | PREPARE)`, see PriorityLanes).
+    """
+    ConnectionCls = _CountedConnection
+
+    def __init__(self, host, manager: 'ConnectionPoolManager' = None, max_requests: int = None, **conn_kw):
+        super().__init__(host, **conn_kw)
+        self.lock = 0
+        self.manager = manager
+        self.last_used = time.monotonic()
+        self.lanes = PriorityLanes(max_requests if max_requests is not None else conn_kw.get("maxsize", 1))
+        self._holders: Set[Greenlet] = set()  # greenlets holding a lane slot (urlopen is reentered on retries)
+
+    def acquire(self):
+        self.lock += 1
+
+    def release(self):
+        if self.lock:
+            self.lock -= 1
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.pool = self
+        return conn
+
+    def _put_conn(self, conn):
+        self.last_used = time.monotonic()
+        if conn is not None:
+            conn.last_used = self.last_used
+            if self.manager and self.manager._waiting:
+                conn.close()  # give the socket to request waiting for it, instead of keeping it idle
+        super()._put_conn(conn)
+
+    def urlopen(self, *args, priority: int = PREPARE, **kwargs):
+        if self.manager:
+            self.manager.counters["requests"] += 1
+        current = getcurrent()
+        if current in self._holders:
+            return super().urlopen(*args, **kwargs)
+        self.lanes.acquire(priority)  # BLOCK, until request slot is free
+        self._holders.add(current)
+        try:
+            return super().urlopen(*args, **kwargs)
+        finally:
+            self._holders.discard(current)
+            self.lanes.release()
+
+    def evict(self, ttl: Seconds, limit: int = None) -> int:
+        """
+        Close connections which are idle for more than `ttl` seconds (oldest first)
+
+        :return: number of closed connections
+        """
+        now = time.monotonic()
+        conns = []
+        while True:
+            try:
+                conns.append(self.pool.get(block=False))
+            except (queue.Empty, AttributeError):  # AttributeError - pool is closed
+                break
+
+        closed = 0
+        for i in reversed(range(len(conns))):  # LIFO queue, the oldest connection is the last one
+            conn = conns[i]
+            if conn is None or not conn.sock or now - conn.last_used <= ttl:
+                continue
+            if limit is not None and closed >= limit:
+                break
+            conn.close()
+            closed += 1
+        for conn in reversed(conns):
+            self.pool.put(conn, block=False)
+        return closed
+
+
+class ConnectionPoolManager:
+    """
+    Connection pools keyed by host:port shared by all transactions.
+    With keep-alive pools outlive transactions, so a burst of transactions to the same participants
+    reuses open connections. Connections idle for more than `idle_ttl` are closed by background thread;
+    total number of open sockets is limited by `max_sockets` (idle connections are closed to make room,
+    otherwise request waits for a free socket).
+
+    Concurrent requests to one host are limited by `max_requests`, the rest wait in priority lanes,
+    so phase 2 requests overtake queued phase 1 ones (see PriorityLanes).
+    """
+    idle_ttl: Seconds = 60
+    max_sockets = 1000
+    pool_size = 1000  # max connections per host
+    max_requests = 32  # max concurrent requests per host
+
+    def __init__(self, idle_ttl: Seconds = None, max_sockets: int = None, keep_alive=True, headers: dict = None,
+                 max_requests: int = None):
+        """
+
+        :param idle_ttl: close connections idle for more than this number of seconds
+        :param max_sockets: max number of open sockets in all pools
+        :param keep_alive: keep pools and their connections when no transaction uses them
+        :param headers: default headers of all requests
+        :param max_requests: max number of concurrent requests to one host (waiting ones are served by priority)
+        """
+        self.idle_ttl = idle_ttl if idle_ttl is not None else self.__class__.idle_ttl
+        self.max_sockets = max_sockets if max_sockets is not None else self.__class__.max_sockets
+        self.keep_alive = keep_alive
+        self.max_requests = max_requests if max_requests is not None else self.__class__.max_requests
+        self.headers = headers or {}
+        self._pools: Dict[str, HTTPConnectionPoolWithLock] = {}
+        self._sockets = BoundedSemaphore(self.max_sockets)
+        self._waiting = 0
+        self.counters = {"hits": 0, "misses": 0, "requests": 0, "new_connections": 0, "evicted": 0}
+        self._thread = self._evictor() if keep_alive else None  # THREAD:1, loop
+
+    def connect(self, host: str, port: int) -> HTTPConnectionPoolWithLock:
+        key = host + ':' + str(port)
+        pool = self._pools.get(key)
+        if pool is None:
+            self.counters["misses"] += 1
+            pool = self._pools[key] = HTTPConnectionPoolWithLock(
+                host, manager=self, port=port, block=True, maxsize=self.pool_size, headers=self.headers,
+                max_requests=self.max_requests
+            )
+        else:
+            self.counters["hits"] += 1
+        pool.acquire()
+        return pool
+
+    def disconnect(self, host: str, port: int):
+        key = host + ':' + str(port)
+        pool = self._pools.get(key)
+        if pool:
+            pool.release()
+            if pool.lock == 0 and not self.keep_alive:
+                pool.close()
+                del self._pools[key]
+
+    def evict(self) -> int:
+        """
+        Close connections idle for more than idle_ttl and drop unused pools without connections
+
+        :return: number of closed connections
+        """
+        closed = 0
+        now = time.monotonic()
+        for key, pool in list(self._pools.items()):
+            closed += pool.evict(self.idle_ttl)
+            if pool.lock == 0 and now - pool.last_used > self.idle_ttl:
+                pool.close()
+                del self._pools[key]
+        self.counters["evicted"] += closed
+        return closed
+
+    @g_async
+    def _evictor(self):
+        while True:
+            sleep(max(self.idle_ttl / 2, 0.1))  # BLOCK, interval
+            self.evict()
+
+    def _acquire_socket(self):
+        if self._sockets.locked():
+            for pool in sorted(self._pools.values(), key=lambda p: p.last_used):
+                if pool.evict(0, limit=1):  # close the oldest idle connection
+                    self.counters["evicted"] += 1
+                    break
+        self._waiting += 1
+        try:
+            self._sockets.acquire()  # BLOCK, until socket is closed
+        finally:
+            self._waiting -= 1
+
+    def _release_socket(self):
+        self._sockets.release()
+
+    @property
+    def sockets(self) -> int:
+        """Number of open sockets"""
+        return self.max_sockets - self._sockets.counter
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        lanes = {f"queued_{lane}": 0 for lane in LANES}
+        for pool in self._pools.values():
+            for key, value in pool.lanes.counters.items():
+                lanes[key] += value
+        return {
+            "pools": len(self._pools),
+            "sockets": self.sockets,
+            "reused": self.counters["requests"] - self.counters["new_connections"],
+            "waiting": sum(pool.lanes.queued for pool in self._pools.values()),
+            **self.counters,
+            **lanes
+        }
+
+    def close(self):
+        if self._thread:
+            self._thread.kill()
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
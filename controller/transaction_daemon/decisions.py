@@ -0,0 +1,114 @@
+from typing import Dict, Any, List, Tuple, Set
+
+from gevent import joinall
+from gevent.event import AsyncResult
+
+from tools import Seconds
+from tools.gevent import g_async
+from tools.timers import wheel, Timer
+
+DECISIONS = ("commit", "rollback", "finish")
+
+
+class _Queue:
+    """Decisions for one participant service waiting for the batch window to close"""
+
+    def __init__(self):
+        self.pending: List[Tuple[Any, str, AsyncResult]] = []
+        self.timer: Timer = None
+
+
+class DecisionBatcher:
+    """
+    Phase 2 messages (commit / rollback / finish) of all transactions grouped by participant service.
+    Decisions for the same service made within `window` seconds are sent in one request
+    (up to `batch_size` decisions), so a commit storm costs one request per service instead of one per child.
+    Services which don't support batched decisions get one request per decision.
+
+    Child must have `service` (with `url`) and `send_decision(decision) -> bool`.
+    Batches are sent by `send_decisions(childes, decisions) -> List[bool]` of child class (None - not supported).
+    """
+    window: Seconds = 0.005
+    batch_size = 1000
+
+    def __init__(self, window: Seconds = None, batch_size: int = None):
+        """
+
+        :param window: how long decision waits for other decisions to the same service (0 - don't batch)
+        :param batch_size: max number of decisions in one request
+        """
+        self.window = window if window is not None else self.__class__.window
+        self.batch_size = batch_size if batch_size is not None else self.__class__.batch_size
+        self._queues: Dict[str, _Queue] = {}
+        self._unsupported: Set[str] = set()  # services which don't support batched decisions
+        self.counters = {"decisions": 0, "requests": 0, "batches": 0}
+
+    def send(self, ch, decision: str) -> AsyncResult:
+        """
+        :param decision: commit | rollback | finish
+        :return: AsyncResult which is set to True if participant applied decision
+        """
+        assert decision in DECISIONS, decision
+        self.counters["decisions"] += 1
+        result = AsyncResult()
+        if not self.window:
+            self._send_one(ch, decision, result)  # THREAD:1
+            return result
+
+        key = ch.service.url.geturl()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _Queue()
+        queue.pending.append((ch, decision, result))
+        if len(queue.pending) >= self.batch_size:
+            self._flush(key)
+        elif queue.timer is None:
+            queue.timer = wheel.call_later(self.window, self._flush, key)
+        return result
+
+    def _flush(self, key: str):
+        queue = self._queues.pop(key, None)
+        if queue is None:
+            return
+        if queue.timer:
+            queue.timer.cancel()
+        self._send(key, queue.pending)  # THREAD:1
+
+    @g_async
+    def _send(self, key: str, items: List[Tuple[Any, str, AsyncResult]]):
+        try:
+            send_decisions = getattr(type(items[0][0]), "send_decisions", None)
+            if send_decisions and len(items) > 1 and key not in self._unsupported:
+                results = send_decisions([ch for ch, _, _ in items], [d for _, d, _ in items])  # BLOCK, timeout
+                self.counters["requests"] += 1
+                if results is None:
+                    self._unsupported.add(key)
+                else:
+                    self.counters["batches"] += 1
+                    if len(results) == len(items):
+                        for (_, _, result), ok in zip(items, results):
+                            result.set(ok)
+                    return
+            joinall([self._send_one(ch, decision, result) for ch, decision, result in items])  # BLOCK  # THREAD:N
+        finally:
+            # malformed reply or error: decisions are failed, otherwise their waiters would block forever
+            for _, _, result in items:
+                if not result.ready():
+                    result.set(False)
+
+    @g_async
+    def _send_one(self, ch, decision: str, result: AsyncResult):
+        self.counters["requests"] += 1
+        try:
+            result.set(ch.send_decision(decision))  # BLOCK, timeout
+        finally:
+            if not result.ready():
+                result.set(False)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": sum(len(queue.pending) for queue in self._queues.values()), **self.counters}
+
+    def close(self):
+        for key in list(self._queues):
+            self._flush(key)
@@ -0,0 +1,38 @@
+from typing import Callable
+
+from gevent.event import AsyncResult
+from gevent.threadpool import ThreadPool
+
+
+class StorageExecutor:
+    """
+    Run blocking storage calls (sqlite3, file I/O) on a dedicated OS thread.
+    Greenlets wait on the returned AsyncResult, so the hub keeps serving sockets and timers
+    while the disk is busy.
+
+    All calls are executed one by one on the same thread, so a single sqlite3 connection
+    (opened with check_same_thread=False) can be shared by them.
+
+    >>> executor = StorageExecutor()
+    ... db = executor.submit(sqlite3.connect, "db.sqlite", check_same_thread=False).get()
+    ... rows = executor.submit(db.execute, "SELECT * FROM Transactions").get()  # BLOCK (greenlet only)
+    """
+
+    def __init__(self):
+        self._pool = ThreadPool(1)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> AsyncResult:
+        """
+        Schedule fn(*args, **kwargs) on the storage thread
+
+        :return: cooperative future with fn result (or exception)
+        """
+        return self._pool.spawn(fn, *args, **kwargs)
+
+    def __call__(self, fn: Callable, *args, **kwargs):
+        """Shortcut for submit(...).get()"""
+        return self.submit(fn, *args, **kwargs).get()  # BLOCK
+
+    def close(self):
+        self._pool.join()
+        self._pool.kill()
@@ -0,0 +1,144 @@
+import time
+from itertools import chain
+from typing import Dict, Any, Optional, List, Tuple
+
+from gevent import Greenlet
+from gevent import sleep
+from gevent.pool import Pool
+
+from tools import Seconds
+from tools.gevent import g_async
+
+
+class _Service:
+    """Children of all transactions which are prepared by one participant service"""
+
+    def __init__(self, concurrency: int):
+        self.due: Dict[Any, float] = {}  # child => time of next ping (time.monotonic)
+        self.pool = Pool(concurrency)
+        self.round: Optional[Greenlet] = None
+        self.batch = True  # False if service doesn't support batched pings
+
+
+class HeartbeatScheduler:
+    """
+    Liveness checks of prepared children of all transactions. Children are grouped by participant service and
+    checked from single timer: on every tick each service with due children gets one ping round,
+    so number of greenlets grows with number of services instead of number of children.
+    Round pings all due children of service with one request per `batch_size` children if service supports it,
+    otherwise with one request per child.
+
+    Child must have `service` (with `url`), `ping_timeout` (seconds), `ping() -> bool` and `fail` event.
+    Batched pings are sent by `ping_batch(childes) -> List[bool]` of child class (None - not supported).
+    If ping fails child is removed and its `fail` is set.
+    """
+    tick: Seconds = 0.1  # timer resolution
+    margin: Seconds = 0.1  # ping this number of seconds before participant's ping timeout expires
+    concurrency = 10  # max concurrent pings of one service
+    batch_size = 1000  # max children in one batched ping
+
+    def __init__(self, tick: Seconds = None, concurrency: int = None, batch_size: int = None):
+        """
+
+        :param tick: timer interval
+        :param concurrency: max number of concurrent pings of one service
+        :param batch_size: max number of children in one batched ping (0 - don't batch)
+        """
+        self.tick = tick if tick is not None else self.__class__.tick
+        self.concurrency = concurrency if concurrency is not None else self.__class__.concurrency
+        self.batch_size = batch_size if batch_size is not None else self.__class__.batch_size
+        self._services: Dict[str, _Service] = {}
+        self._children: Dict[Any, _Service] = {}
+        self.counters = {"ticks": 0, "rounds": 0, "requests": 0, "pings": 0, "failures": 0}
+        self._thread = self._timer()  # THREAD:1, loop
+
+    def add(self, ch):
+        """Start liveness checks of child (the first ping is sent on the next tick)"""
+        key = ch.service.url.geturl()
+        service = self._services.get(key)
+        if service is None:
+            service = self._services[key] = _Service(self.concurrency)
+        service.due[ch] = time.monotonic()
+        self._children[ch] = service
+
+    def remove(self, ch):
+        service = self._children.pop(ch, None)
+        if service is None:
+            return
+        del service.due[ch]
+        if not service.due and service.round is None:
+            del self._services[ch.service.url.geturl()]
+
+    @g_async
+    def _timer(self):
+        while True:
+            sleep(self.tick)  # BLOCK, tick
+            self.counters["ticks"] += 1
+            now = time.monotonic()
+            for key, service in list(self._services.items()):
+                if service.round is not None:
+                    continue
+                due = [ch for ch, t in service.due.items() if t <= now + self.tick]  # due before the next tick
+                if due:
+                    service.round = self._round(key, service, due)  # THREAD:1
+                elif not service.due:
+                    del self._services[key]
+
+    @g_async
+    def _round(self, key: str, service: _Service, due: list):
+        self.counters["rounds"] += 1
+        start = time.monotonic()
+        try:
+            pinged, rest = self._ping_batch(service, due) if service.batch and self.batch_size else ([], due)
+            # children pinged in one round are rescheduled from its start, so they stay in the same round
+            for ch, alive in chain(pinged, service.pool.imap_unordered(self._ping, rest)):  # BLOCK, ping_timeout
+                if ch not in service.due:
+                    continue  # removed while ping was in progress
+                if alive:
+                    service.due[ch] = start + ch.ping_timeout - self.margin
+                else:
+                    self.counters["failures"] += 1
+                    self.remove(ch)
+                    ch.fail.set()  # EMIT(fail)
+        finally:
+            service.round = None
+            if not service.due and self._services.get(key) is service:
+                del self._services[key]
+
+    def _ping(self, ch):
+        self.counters["requests"] += 1
+        self.counters["pings"] += 1
+        return ch, ch.ping()  # BLOCK, ping_timeout
+
+    def _ping_batch(self, service: _Service, due: list) -> Tuple[List[Tuple[Any, bool]], list]:
+        """
+        :return: (child, alive) pairs, children which have to be pinged one by one
+        """
+        ping_batch = getattr(type(due[0]), "ping_batch", None)
+        if ping_batch is None:
+            service.batch = False
+            return [], due
+        pinged = []
+        for i in range(0, len(due), self.batch_size):
+            chunk = due[i:i + self.batch_size]
+            alive = ping_batch(chunk)  # BLOCK, ping_timeout
+            self.counters["requests"] += 1
+            if alive is None:
+                service.batch = False
+                return pinged, due[i:]
+            self.counters["pings"] += len(chunk)
+            pinged += zip(chunk, alive)
+        return pinged, []
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"services": len(self._services), "children": len(self._children), **self.counters}
+
+    def close(self):
+        self._thread.kill()
+        for service in self._services.values():
+            if service.round is not None:
+                service.round.kill()
+            service.pool.kill()
+        self._services.clear()
+        self._children.clear()
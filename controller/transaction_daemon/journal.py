@@ -0,0 +1,284 @@
+import json
+import os
+import sqlite3
+from abc import ABCMeta, abstractmethod
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, List, Tuple, Any, Optional, Iterable
+
+from gevent.event import AsyncResult, Event
+
+from tools import Seconds
+from tools.gevent import g_async
+from .executor import StorageExecutor
+
+
+class ABatchWriter(metaclass=ABCMeta):
+    """
+    Collect records from many greenlets and write them in groups, so the whole group pays for one fsync.
+
+    Records are flushed every `interval` seconds or as soon as `batch_size` records are queued.
+    Each queued record gets AsyncResult which is set when the record is durable.
+    If `executor` is given the write runs on its thread and new records keep queueing meanwhile.
+    """
+    interval: Seconds = 0.005
+    batch_size = 256
+    errors: Tuple[type, ...] = (Exception,)
+
+    @abstractmethod
+    def __init__(self, interval: Seconds = None, batch_size: int = None, executor: StorageExecutor = None):
+        """
+
+        :param interval: max delay (seconds) before queued records are flushed
+        :param batch_size: flush immediately when this number of records is queued
+        :param executor: run writes on the storage thread instead of the gevent hub
+        """
+        self.interval = interval if interval is not None else self.__class__.interval
+        self.batch_size = batch_size if batch_size is not None else self.__class__.batch_size
+        self.executor = executor
+
+        self._records: List[Tuple[Any, AsyncResult]] = []
+        self._wakeup = Event()
+        self.stats = {"records": 0, "flushes": 0}
+        self._thread = self._writer()  # THREAD:1, loop
+
+    def _put(self, record) -> AsyncResult:
+        result = AsyncResult()
+        self._records.append((record, result))
+        if len(self._records) >= self.batch_size:
+            self._wakeup.set()  # EMIT(wakeup)
+        return result
+
+    @g_async
+    def _writer(self):
+        while True:
+            self._wakeup.wait(self.interval)  # BLOCK, interval
+            self._wakeup.clear()
+            if self._records:
+                self.flush()
+
+    def flush(self):
+        """Write all queued records in one group"""
+        records, self._records = self._records, []
+        if not records:
+            return
+
+        try:
+            if self.executor:
+                errors = self.executor(self._commit, [r for r, _ in records])  # BLOCK, storage thread
+            else:
+                errors = self._commit([r for r, _ in records])
+        except self.errors as e:
+            errors = [e] * len(records)
+        errors = errors or [None] * len(records)
+        written = errors.count(None)
+        if written:
+            self.stats["records"] += written
+            self.stats["flushes"] += 1
+        for (_, result), error in zip(records, errors):
+            if error is None:
+                result.set(True)
+            else:
+                result.set_exception(error)
+
+    @abstractmethod
+    def _commit(self, records: list) -> Optional[List[Optional[Exception]]]:
+        """
+        Write records and make them durable. Called on the storage thread if executor is set.
+
+        :return: None if all records are written, else error of each record (None - written)
+        :raise: one of `errors` if no record is written
+        """
+        pass
+
+    def close(self):
+        self._thread.kill()
+        self.flush()
+
+
+class GroupCommitJournal(ABatchWriter):
+    """
+    Collect journal records (create/complete/fail) from many transactions and write them
+    to SQLite in a single transaction, so the whole group pays for one commit (fsync).
+
+    >>> journal = GroupCommitJournal(db, queries)
+    ... journal.write("create", (str(tr.id),)).get()  # BLOCK until record is committed
+    """
+    errors = (sqlite3.Error,)
+
+    def __init__(self, db: sqlite3.Connection, queries: Dict[str, str], interval: Seconds = None,
+                 batch_size: int = None, executor: StorageExecutor = None):
+        """
+
+        :param db: SQLite connection
+        :param queries: Dict[record type => SQL]
+        :param interval: max delay (seconds) before queued records are flushed
+        :param batch_size: flush immediately when this number of records is queued
+        :param executor: run SQL on the storage thread instead of the gevent hub
+        """
+        self.db = db
+        self.queries = queries
+        super().__init__(interval, batch_size, executor)
+
+    def write(self, query: str, args: tuple) -> AsyncResult:
+        """
+        Queue record. Records are applied in the same order as they were written.
+
+        :param query: key of SQL in self.queries
+        :param args: SQL arguments
+        :return: AsyncResult which is set to True after commit (or to exception if commit failed)
+        """
+        return self._put((query, args))
+
+    def _commit(self, records: List[Tuple[str, tuple]]) -> Optional[List[Optional[sqlite3.Error]]]:
+        """
+        Group is written in one SQLite transaction. If it fails, records are retried one by one (a transaction each),
+        so only a bad record fails.
+        """
+        cur = self.db.cursor()
+        try:
+            for query, group in groupby(records, key=lambda r: r[0]):
+                cur.executemany(self.queries[query], [args for _, args in group])
+            self.db.commit()
+        except sqlite3.Error:
+            self.db.rollback()
+            if len(records) == 1:
+                raise
+            return [self._commit_one(cur, query, args) for query, args in records]
+        finally:
+            cur.close()
+
+    def _commit_one(self, cur: sqlite3.Cursor, query: str, args: tuple) -> Optional[sqlite3.Error]:
+        try:
+            cur.execute(self.queries[query], args)
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.db.rollback()
+            return e
+        return None
+
+
+class DecisionLog(ABatchWriter):
+    """
+    Append-only coordinator log of 2PC decisions. One JSON record per line:
+
+    * {"e": "prepare", "id": <transaction id>, "ch": <child id>, "url": <service url>, "remote_id": ..., "key": ...}
+    * {"e": "commit", "id": <transaction id>, ["read_only": [<child ids>]]}
+    * {"e": "abort", "id": <transaction id>}
+    * {"e": "end", "id": <transaction id>}
+
+    In presumed abort mode only committed transactions are logged, with one record instead of prepare + commit:
+
+    * {"e": "commit", "id": <transaction id>, "created_at": <unix time>, "childes": [<prepare records>]}
+
+    Recovery writes the same record without "created_at" for transaction whose participants haven't acknowledged
+    commit (they are listed in "childes") and keeps it until they do.
+
+    Participants which voted read-only are released after prepare: commit record lists them in "read_only"
+    (presumed abort commit record leaves them out of "childes"), so they get no messages on recovery.
+
+    Lines are appended sequentially and fsync'ed in batches. A transaction is pending until its "end" record;
+    when the file grows over `max_size` it is rewritten with the records of pending transactions only.
+    """
+    errors = (OSError,)
+    max_size = 2 ** 24  # bytes
+
+    class Pending:
+        """Replayed state of unfinished transaction"""
+
+        def __init__(self, _id: str):
+            self.id = _id
+            self.childes: List[Dict[str, Any]] = []
+            self.decision: Optional[str] = None
+            self.created_at: Optional[float] = None  # set by presumed abort commit record
+
+        def __repr__(self):
+            return f"<DecisionLog.Pending {self.id}: {self.decision}>"
+
+    def __init__(self, path: str, interval: Seconds = None, batch_size: int = None, executor: StorageExecutor = None,
+                 max_size: int = None):
+        """
+
+        :param path: log file
+        :param interval: max delay (seconds) before queued records are fsync'ed
+        :param batch_size: fsync immediately when this number of records is queued
+        :param executor: run file I/O on the storage thread instead of the gevent hub
+        :param max_size: compact the file when it grows over this size (bytes)
+        """
+        self.path = Path(path)
+        self.max_size = max_size if max_size is not None else DecisionLog.max_size
+        self._pending: Dict[str, List[bytes]] = {}
+        self._file = open(str(self.path), "ab")
+        super().__init__(interval, batch_size, executor)
+
+    def write(self, event: str, _id, **data) -> AsyncResult:
+        """
+        Append record
+
+        :param event: prepare | commit | abort | end
+        :param _id: transaction id
+        :return: AsyncResult which is set to True after fsync
+        """
+        line = json.dumps({"e": event, "id": str(_id), **data}).encode("utf-8") + b"\n"
+        return self._put((event, str(_id), line))
+
+    def _commit(self, records: List[Tuple[str, str, bytes]]):
+        self._file.write(b"".join(line for *_, line in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # compaction rewrites durable records only
+        for event, _id, line in records:
+            if event == "end":
+                self._pending.pop(_id, None)
+            else:
+                self._pending.setdefault(_id, []).append(line)
+        if self._file.tell() > self.max_size:
+            self._compact()
+
+    def _compact(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(str(tmp), "wb") as f:
+            f.write(b"".join(line for lines in self._pending.values() for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(str(tmp), str(self.path))
+        self._file = open(str(self.path), "ab")
+
+    def replay(self) -> Dict[str, 'DecisionLog.Pending']:
+        """Read log file and return transactions without "end" record"""
+        pending: Dict[str, DecisionLog.Pending] = {}
+        with open(str(self.path), "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn write at the tail
+                event = record.pop("e")
+                if event == "end":
+                    pending.pop(record["id"], None)
+                    continue
+                tr = pending.setdefault(record["id"], DecisionLog.Pending(record["id"]))
+                if event == "prepare":
+                    tr.childes.append(record)
+                elif tr.decision != "commit":  # commit is final
+                    tr.decision = event
+                    if "childes" in record:
+                        tr.childes += record["childes"]
+                        tr.created_at = record.get("created_at")
+                    if "read_only" in record:
+                        tr.childes = [ch for ch in tr.childes if ch["ch"] not in record["read_only"]]
+        return pending
+
+    def truncate(self, keep: Iterable[str] = ()):
+        """
+        Drop all records (when recovery is done)
+
+        :param keep: ids of transactions whose records written since the log was opened are kept
+        """
+        self._pending = {_id: self._pending[_id] for _id in keep if _id in self._pending}
+        self._compact()
+
+    def close(self):
+        super().close()
+        self._file.close()
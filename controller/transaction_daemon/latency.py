@@ -0,0 +1,184 @@
+from bisect import insort
+from typing import Dict, Any, List
+
+from tools import Seconds
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate in O(1) memory (P² algorithm, Jain & Chlamtac 1985):
+    five markers are moved towards their desired positions and their heights are adjusted
+    by piecewise-parabolic interpolation
+    """
+    __slots__ = ("q", "count", "heights", "positions", "desired", "increments")
+
+    def __init__(self, q: float):
+        """
+        :param q: quantile, 0 < q < 1
+        """
+        self.q = q
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0., 2 * q, 4 * q, 2 + 2 * q, 4.]
+        self.increments = [0., q / 2, q, (1 + q) / 2, 1.]
+
+    def add(self, x: float):
+        self.count += 1
+        h, n = self.heights, self.positions
+        if self.count <= 5:
+            insort(h, x)
+            return
+
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(1, 5) if x < h[i]) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if d >= 1 and n[i + 1] - n[i] > 1 or d <= -1 and n[i - 1] - n[i] < -1:
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not h[i - 1] < height < h[i + 1]:
+                    height = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])  # linear
+                h[i] = height
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        h, n = self.heights, self.positions
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    @property
+    def value(self) -> float:
+        if self.count > 5:
+            return self.heights[2]
+        if not self.heights:
+            return 0.
+        return self.heights[min(len(self.heights) - 1, int(self.q * len(self.heights)))]
+
+
+class LatencyStats:
+    """EWMA and quantile of latency of one phase of one service"""
+    __slots__ = ("count", "ewma", "quantile", "timeouts")
+
+    def __init__(self, q: float):
+        self.count = 0
+        self.ewma = 0.
+        self.quantile = P2Quantile(q)
+        self.timeouts = 0  # in a row
+
+    def add(self, latency: Seconds, alpha: float):
+        self.count += 1
+        self.timeouts = 0
+        self.ewma = latency if self.count == 1 else self.ewma + alpha * (latency - self.ewma)
+        self.quantile.add(latency)
+
+
+class LatencyTracker:
+    """
+    Observed latency of participant services by phase:
+
+    * prepare - requests of phase 1 (open transaction, action)
+    * vote - from action until the participant's vote callback
+    * commit - from commit decision until the participant's done callback
+
+    In adaptive mode timeouts are derived from it: `factor` * quantile of the phase (but not less than `min_timeout`),
+    clamped by the timeout requested by the client. Until the phase has `min_samples` observations
+    the requested timeout is used.
+
+    Timed out requests and callbacks are not observed: hung participants would drag the quantile up to the timeout.
+    Instead `max_timeouts` timeouts of the phase in a row reset its estimate (the service has slowed down),
+    so requested timeouts are used until it is learned again.
+    """
+    alpha = 0.1  # weight of the last observation in EWMA
+    q = 0.99
+    factor = 3.
+    min_samples = 20
+    min_timeout: Seconds = 0.1
+    max_timeouts = 5
+
+    def __init__(self, adaptive=False, q: float = None, factor: float = None, min_samples: int = None,
+                 min_timeout: Seconds = None, max_timeouts: int = None):
+        """
+
+        :param adaptive: derive timeouts from latency (otherwise latency is only collected)
+        :param q: quantile of latency the timeouts are derived from
+        :param factor: timeout = factor * quantile
+        :param min_samples: number of observations of the phase needed to derive its timeout
+        :param min_timeout: lower bound of derived timeouts
+        :param max_timeouts: number of timeouts of the phase in a row which resets its estimate
+        """
+        self.adaptive = adaptive
+        self.q = q if q is not None else self.__class__.q
+        self.factor = factor if factor is not None else self.__class__.factor
+        self.min_samples = min_samples if min_samples is not None else self.__class__.min_samples
+        self.min_timeout = min_timeout if min_timeout is not None else self.__class__.min_timeout
+        self.max_timeouts = max_timeouts if max_timeouts is not None else self.__class__.max_timeouts
+        self._services: Dict[str, Dict[str, LatencyStats]] = {}
+        self.counters = {"observations": 0, "adapted": 0, "timeouts": 0, "resets": 0}
+
+    def observe(self, service: str, phase: str, latency: Seconds):
+        """
+        :param service: service url
+        :param phase: prepare | vote | commit
+        """
+        phases = self._services.get(service)
+        if phases is None:
+            phases = self._services[service] = {}
+        stats = phases.get(phase)
+        if stats is None:
+            stats = phases[phase] = LatencyStats(self.q)
+        stats.add(latency, self.alpha)
+        self.counters["observations"] += 1
+
+    def timed_out(self, service: str, phase: str):
+        """Phase of the service didn't complete within its timeout"""
+        self.counters["timeouts"] += 1
+        stats = self._services.get(service, {}).get(phase)
+        if stats is None:
+            return
+        stats.timeouts += 1
+        if self.adaptive and stats.timeouts >= self.max_timeouts:
+            del self._services[service][phase]
+            self.counters["resets"] += 1
+
+    def timeout(self, service: str, phase: str, requested: Seconds) -> Seconds:
+        """
+        :param requested: timeout requested by client (upper bound)
+        :return: effective timeout
+        """
+        if not self.adaptive:
+            return requested
+        stats = self._services.get(service, {}).get(phase)
+        if stats is None or stats.count < self.min_samples:
+            return requested
+        timeout = max(self.min_timeout, self.factor * stats.quantile.value)
+        if timeout >= requested:
+            return requested
+        self.counters["adapted"] += 1
+        return timeout
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "adaptive": self.adaptive,
+            **self.counters,
+            "services": {
+                service: {
+                    phase: {"count": stats.count, "ewma": stats.ewma, f"p{self.q * 100:g}": stats.quantile.value}
+                    for phase, stats in phases.items()
+                } for service, phases in self._services.items()
+            }
+        }
@@ -1,48 +1,64 @@
-import json
-
 from bson import ObjectId
 
+from controller.transaction_daemon.admission import Overloaded
+from controller.transaction_daemon.breaker import CircuitOpen
 from controller.transaction_daemon.transaction_backend import Transaction, TransactionManager
 from tools import debug_SSE
 from tools.socket.tcp_server import TcpServer
 
 
 class Daemon(TcpServer):
-    def __init__(self, address=("127.0.0.1", 5000), db=None, *args, **kwargs):
+    def __init__(self, address=("127.0.0.1", 5000), db=None, *args, manager_options: dict = None, **kwargs):
+        """
+
+        :param address:
+        :param db: storage URI (sqlite://<path>, memory://, mmap://<path>) or SQLite database path
+        :param manager_options: extra keyword arguments of TransactionManager
+        """
         super().__init__(address, *args, **kwargs)
-        self.transactions = TransactionManager(db)
+        self.transactions = TransactionManager(db, **(manager_options or {}))
 
         @self.method
         def open_transaction(data):
-            tr = self.transactions.create(data)
+            try:
+                tr = self.transactions.create(data)
+            except Overloaded as e:
+                return 429, {"error": str(e), "retry_after": e.retry_after}
+            except CircuitOpen as e:
+                return 503, {"error": str(e), "retry_after": e.retry_after}
+            except ValueError as e:
+                return 400, {"error": str(e)}
             return 200, {"ID": str(tr.id)}
 
         @self.method
         def get_transaction(data):
             trid = ObjectId(data["id"])
-            tr = self.transactions[trid]
-            if not tr:
+            status = self.transactions.status(trid)
+            if status is None:
                 return 404, {str(trid): None}
+            return 200, {str(trid): status}
 
-            if isinstance(tr, Transaction):
-                status = tr.status
-            else:
-                status = tr["status"]
-                if status:
-                    status = json.loads(tr["status"])
-                else:
-                    status = "FAIL" if tr["fail"] else ("COMPLETE" if tr["complete"] else "UNKNOWN")
+        @self.method
+        def list_transactions(data):
+            try:
+                return 200, self.transactions.list_transactions(
+                    **{key: data.get(key) for key in ("state", "since", "until", "after", "limit")}
+                )
+            except ValueError as e:
+                return 400, {"error": str(e)}
 
-            return 200, {str(trid): status}
+        @self.method
+        def get_stats(data):
+            return 200, self.transactions.stats
 
         @self.method
         def set_result(data):
             trid = ObjectId(data['id'])
             tr = self.transactions[trid]
             if not isinstance(tr, Transaction):
-                return 404, {"ID": str(tr.id)}
+                return 404, {"ID": str(trid)}
 
-            tr.childes[data["key"]].result.set(data["response"])
+            tr.childes[data["key"]].vote(data["response"], data.get("read-only", False), data.get("done", False))
             return 200, {"ID": str(tr.id)}
 
         @self.method
@@ -65,8 +81,43 @@ def main(args=None):
     parser = argparse.ArgumentParser(description='Controller API TCP Service')
     parser.add_argument("--no_log", default=False, action="store_true")
     parser.add_argument("--no_sse", default=False, action="store_true")
-    parser.add_argument("--db", default=":memory:", type=str)
+    parser.add_argument("--db", default=":memory:", type=str,
+                        help="storage: SQLite path or URI sqlite://<path>[?shards=N] | memory:// | mmap://<path>")
     parser.add_argument("-p", "--port", default=5600, type=int)
+    parser.add_argument("--journal_interval", default=None, type=int, help="group commit interval (ms)")
+    parser.add_argument("--journal_batch", default=None, type=int, help="group commit max records")
+    parser.add_argument("--log", default=None, type=str, help="decision log path (enables recovery on start)")
+    parser.add_argument("--cache_size", default=None, type=int, help="max number of cached finished statuses")
+    parser.add_argument("--shards", default=1, type=int, help="number of SQLite databases")
+    parser.add_argument("--retention_ttl", default=None, type=int,
+                        help="archive transactions finished more than this number of seconds ago")
+    parser.add_argument("--convert_vacuum", default=False, action="store_true",
+                        help="switch existing SQLite databases to incremental auto-vacuum (rebuilds them on start)")
+    parser.add_argument("--retention_interval", default=None, type=int, help="seconds between retention passes")
+    parser.add_argument("--pool_idle_ttl", default=None, type=int,
+                        help="close connections to participants idle for more than this number of seconds")
+    parser.add_argument("--max_sockets", default=None, type=int, help="max number of connections to participants")
+    parser.add_argument("--max_service_requests", default=None, type=int,
+                        help="max number of concurrent requests to one participant service "
+                             "(waiting commits and rollbacks go before new work)")
+    parser.add_argument("--no_keep_alive", default=False, action="store_true",
+                        help="close connections to participant when no transaction uses it")
+    parser.add_argument("--decision_window", default=None, type=int,
+                        help="batch phase 2 decisions to the same participant made within this interval (ms, 0 - off)")
+    parser.add_argument("--presumed_abort", default=False, action="store_true",
+                        help="log and store only committed transactions, don't wait for abort and finish acks")
+    parser.add_argument("--max_active", default=None, type=int, help="max number of running transactions")
+    parser.add_argument("--max_per_service", default=None, type=int,
+                        help="max number of running transactions using the same participant service")
+    parser.add_argument("--admission_queue", default=None, type=int,
+                        help="max number of transactions waiting for admission (when it is full - HTTP 429)")
+    parser.add_argument("--adaptive_timeouts", default=False, action="store_true",
+                        help="derive timeouts from observed latency of participants (requested ones are upper bounds)")
+    parser.add_argument("--breaker_failures", default=None, type=int,
+                        help="reject transactions using participant service after this number of its failures "
+                             "in a row until it is up again (HTTP 503)")
+    parser.add_argument("--breaker_reset", default=None, type=int,
+                        help="ms before the first liveness check of participant service with open circuit")
 
     if args:
         args, _ = parser.parse_known_args(args)
@@ -77,7 +128,28 @@ def main(args=None):
         _debug_thread = debug_SSE.spawn(("localhost", 9000))
 
     Transaction.set_self_url("http://localhost:5000/api/alpha/transactions")  # TODO: Sent from REST Service
-    daemon: Daemon = Daemon(("127.0.0.1", args.port), args.db)
+    daemon: Daemon = Daemon(("127.0.0.1", args.port), args.db, manager_options={
+        "journal_interval": args.journal_interval / 1000 if args.journal_interval is not None else None,
+        "journal_batch": args.journal_batch,
+        "log": args.log,
+        "cache_size": args.cache_size,
+        "shards": args.shards,
+        "retention_ttl": args.retention_ttl,
+        "retention_interval": args.retention_interval,
+        "convert_vacuum": args.convert_vacuum,
+        "pool_idle_ttl": args.pool_idle_ttl,
+        "max_sockets": args.max_sockets,
+        "keep_alive": not args.no_keep_alive,
+        "max_service_requests": args.max_service_requests,
+        "decision_window": args.decision_window / 1000 if args.decision_window is not None else None,
+        "presumed_abort": args.presumed_abort,
+        "max_active": args.max_active,
+        "max_per_service": args.max_per_service,
+        "admission_queue": args.admission_queue,
+        "adaptive_timeouts": args.adaptive_timeouts,
+        "breaker_failures": args.breaker_failures,
+        "breaker_reset": args.breaker_reset / 1000 if args.breaker_reset is not None else None
+    })
     if args.no_log:
         daemon.logger.disabled = True
 
@@ -0,0 +1,635 @@
+import heapq
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from abc import ABCMeta, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple, Union, Iterable
+from urllib.parse import parse_qs
+
+from gevent import wait, joinall
+from gevent.event import AsyncResult
+
+from tools import Seconds, dict_factory
+from tools.gevent import g_async
+from tools.transactions import EStatus
+from .executor import StorageExecutor
+from .journal import GroupCommitJournal, ABatchWriter
+
+_path = (Path(__file__) / "..").absolute().resolve()
+
+Row = Dict[str, Any]  # {"id": str, "fail": int, "complete": int, "status": bytes, "state": str,
+#                         "created_at": float, "finished_at": float}
+Cursor = Tuple[float, str]  # (created_at, id) of the last listed transaction
+Status = Union[bytes, str]  # encoded status (see codec.py) or JSON stored by older versions
+
+
+def _pack(status: Status) -> bytes:
+    """Compress status for archive"""
+    return zlib.compress(status if isinstance(status, bytes) else status.encode("utf-8"))
+
+
+def _sort_key(row: Row) -> Cursor:
+    return row["created_at"], row["id"]
+
+
+def _select(rows: Iterable[Row], state: Optional[str], since: float, until: float, after: Optional[Cursor],
+            limit: int) -> List[Row]:
+    """AStorage.select over not indexed rows"""
+    after = after or (since, "")
+    rows = [
+        {key: row.get(key) for key in ("id", "state", "created_at", "finished_at")}
+        for row in rows
+        if row.get("created_at") is not None and since <= row["created_at"] < until
+        and (state is None or row["state"] == state) and _sort_key(row) > after
+    ]
+    return heapq.nsmallest(limit, rows, key=_sort_key)
+
+
+def _ready(value=True) -> AsyncResult:
+    result = AsyncResult()
+    result.set(value)
+    return result
+
+
+class AStorage(metaclass=ABCMeta):
+    """
+    Transaction status store of TransactionManager.
+    Writes return AsyncResult which is set when the record is durable, reads block the calling greenlet only.
+    """
+
+    @abstractmethod
+    def create(self, _id: str) -> AsyncResult:
+        """Store new unfinished transaction"""
+        pass
+
+    @abstractmethod
+    def finish(self, _id: str, fail: bool, status: bytes) -> AsyncResult:
+        """Store final status (opaque bytes). Complete is ignored if transaction is already failed."""
+        pass
+
+    def insert(self, _id: str, fail: bool, status: bytes, created_at: Optional[float]) -> AsyncResult:
+        """
+        Store finished transaction which wasn't created (presumed abort mode) in one record
+
+        :param created_at: unix time of transaction start
+        """
+        self.create(_id)
+        return self.finish(_id, fail, status)
+
+    @abstractmethod
+    def commit(self, _id: str, status: bytes, created_at: Optional[float] = None) -> AsyncResult:
+        """
+        Store transaction whose commit isn't acknowledged by all participants yet (COMMIT state).
+        It isn't finished: abandon keeps it, retention doesn't archive it until `finish`.
+
+        :param created_at: unix time of transaction start, if it wasn't stored yet (presumed abort mode)
+        """
+        pass
+
+    @abstractmethod
+    def get(self, _id: str) -> Optional[Row]:
+        pass
+
+    @abstractmethod
+    def ids(self) -> List[str]:
+        """Ids of all stored transactions"""
+        pass
+
+    @abstractmethod
+    def abandon(self):
+        """Mark all unfinished transactions as failed, except committed ones (COMMIT state)"""
+        pass
+
+    @abstractmethod
+    def select(self, state: Optional[str], since: float, until: float, after: Optional[Cursor],
+               limit: int) -> List[Row]:
+        """
+        Transactions created in [since, until) ordered by (created_at, id). Archived transactions are not listed.
+
+        :param state: IN_PROGRESS | COMMIT | DONE | FAIL (None - any)
+        :param after: keyset cursor, only transactions after it are returned
+        :param limit: max number of rows
+        :return: [{"id", "state", "created_at", "finished_at"}]
+        """
+        pass
+
+    def retain(self, ttl: Seconds) -> Optional[Dict[str, Any]]:
+        """
+        Move transactions finished more than `ttl` seconds ago to compressed archive and release free space.
+        Archived transactions are still returned by get and ids.
+
+        :return: {"archived": int, "reclaimed": bytes, "duration": seconds} or None if storage doesn't support it
+        """
+        return None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    def close(self):
+        pass
+
+
+# ================================================================ #
+
+def shard_paths(db: str, shards: int) -> List[str]:
+    """
+    >>> shard_paths("data/tr.sqlite", 2)
+    ['data/tr.0.sqlite', 'data/tr.1.sqlite']
+    """
+    if shards == 1 or db == ":memory:":
+        return [db] * shards
+    path = Path(db)
+    return [str(path.with_name(f"{path.stem}.{i}{path.suffix}")) for i in range(shards)]
+
+
+class SqliteShard:
+    """
+    One SQLite database with its own connection, storage thread and group-commit journal.
+    Shards don't share anything, so their commits (and fsyncs) run in parallel.
+
+    Finished transactions are moved to Archive table (status compressed with zlib) by `retain`.
+    New database uses incremental auto-vacuum, so pages freed by archival are returned to the file system.
+    Existing database is converted to it only on request (`convert_vacuum`, rebuilds the whole file with VACUUM),
+    otherwise archival just deletes rows and freed pages are reused by SQLite.
+    """
+    retention_batch = 1000  # rows archived per SQLite transaction
+
+    def __init__(self, db: str, queries: Dict[str, str], journal_interval: Seconds = None, journal_batch: int = None,
+                 convert_vacuum=False):
+        """
+
+        :param db: SQLite database path
+        :param queries: SQL from sql.json
+        :param journal_interval: group commit interval (seconds)
+        :param journal_batch: group commit max records
+        :param convert_vacuum: switch existing database to incremental auto-vacuum (VACUUM, blocks until done)
+        """
+        self.queries = queries
+        self.convert_vacuum = convert_vacuum
+        self.executor = StorageExecutor()  # all SQL of the shard runs on its storage thread
+        self.db: sqlite3.Connection = self.executor(sqlite3.connect, db, check_same_thread=False)
+        self.executor(self._init)
+        self.journal = GroupCommitJournal(self.db, queries, interval=journal_interval, batch_size=journal_batch,
+                                          executor=self.executor)
+
+    def _init(self):
+        self.db.row_factory = dict_factory
+        cur = self.db.cursor()
+        if cur.execute(self.queries["vacuum_mode"]).fetchone()["auto_vacuum"] != 2:
+            if not cur.execute(self.queries["tables"]).fetchone()["n"]:
+                cur.execute(self.queries["set_vacuum_mode"])  # new database, applied when the first table is created
+            elif self.convert_vacuum:
+                cur.execute(self.queries["set_vacuum_mode"])
+                cur.execute(self.queries["vacuum_full"])  # rebuilds existing database
+        for key, script in self.queries["migrate"].items():
+            table, column = key.split(".")
+            columns = {row["name"] for row in cur.execute(self.queries["columns"], (table,)).fetchall()}
+            if columns and column not in columns:
+                cur.executescript(script)  # add column to database created by older version
+        cur.executescript(self.queries["init"])
+        self.db.commit()
+
+    def _meta(self, key: str, default: str) -> str:
+        self._execute("set_meta", (key, default), commit=True)
+        return self._execute("get_meta", (key,), "one")["value"]
+
+    def meta(self, key: str, default: str) -> str:
+        """
+        :return: value stored in Meta table (`default` is stored if the key isn't set yet)
+        """
+        return self.executor(self._meta, key, default)  # BLOCK, storage thread
+
+    def _execute(self, query: str, args: tuple = (), fetch: str = None, commit=False):
+        cur = self.db.cursor()
+        try:
+            cur.execute(self.queries[query], args)
+            if commit:
+                self.db.commit()
+            if fetch == "one":
+                return cur.fetchone()
+            if fetch == "all":
+                return cur.fetchall()
+        finally:
+            cur.close()
+
+    def write(self, query: str, args: tuple) -> AsyncResult:
+        """Queue record to group-commit journal. See GroupCommitJournal.write"""
+        return self.journal.write(query, args)
+
+    def _get(self, _id: str) -> Optional[Row]:
+        row = self._execute("get", (_id,), "one")
+        if row is None:
+            row = self._execute("get_archived", (_id,), "one")
+            if row is not None:
+                row["status"] = zlib.decompress(row["status"])
+        return row
+
+    def get(self, _id: str) -> Optional[Row]:
+        return self.executor(self._get, _id)  # BLOCK, storage thread
+
+    def ids(self) -> AsyncResult:
+        return self.executor.submit(lambda: [row["id"] for row in self._execute("ids", fetch="all")])
+
+    def abandon(self) -> AsyncResult:
+        """Mark all unfinished transactions as failed"""
+        return self.executor.submit(self._execute, "abandon", commit=True)
+
+    def select(self, state: Optional[str], since: float, until: float, after: Optional[Cursor],
+               limit: int) -> AsyncResult:
+        after_created, after_id = after or (since, "")
+        return self.executor.submit(self._execute, "list_state" if state else "list", {
+            "state": state, "since": since, "until": until, "after": after_created, "after_id": after_id,
+            "limit": limit
+        }, "all")
+
+    def _archive(self, before: float) -> int:
+        cur = self.db.cursor()
+        try:
+            rows = cur.execute(self.queries["expired"], (before, self.retention_batch)).fetchall()
+            cur.executemany(self.queries["archive"], [
+                {**row, "status": _pack(row["status"])} for row in rows
+            ])
+            cur.executemany(self.queries["delete"], [(row["id"],) for row in rows])
+            self.db.commit()
+        except sqlite3.Error:
+            self.db.rollback()
+            raise
+        finally:
+            cur.close()
+        return len(rows)
+
+    def _vacuum(self):
+        cur = self.db.cursor()
+        try:
+            cur.executescript(self.queries["vacuum"])  # execute() frees one page per step, script runs to the end
+        finally:
+            cur.close()
+
+    def retain(self, before: float) -> Dict[str, Any]:
+        """
+        Archive transactions finished before `before` (unix time) and release free pages.
+        Rows are moved in batches, so journal commits are not delayed by the whole pass.
+        """
+        start = time.time()
+        size = self.executor(self._execute, "size", fetch="one")["size"]  # BLOCK, storage thread
+        archived = 0
+        while True:
+            n = self.executor(self._archive, before)  # BLOCK, storage thread
+            archived += n
+            if n < self.retention_batch:
+                break
+        self.executor(self._vacuum)  # BLOCK, storage thread
+        reclaimed = size - self.executor(self._execute, "size", fetch="one")["size"]  # BLOCK, storage thread
+        return {"archived": archived, "reclaimed": reclaimed, "duration": time.time() - start}
+
+    def close(self):
+        self.journal.close()
+        self.executor(self.db.close)
+        self.executor.close()
+
+
+class SqliteStorage(AStorage):
+    """
+    SQLite databases (see sql.json). Transactions are spread across shards by hash of id.
+    Number of shards is stored in the first one: storage refuses to open with another number.
+    """
+
+    def __init__(self, db: str = ":memory:", shards: int = 1, journal_interval: Seconds = None,
+                 journal_batch: int = None, convert_vacuum=False):
+        """
+
+        :param db: SQLite database path (shards are stored next to it as <name>.<n>.<suffix>)
+        :param shards: number of SQLite databases
+        :param journal_interval: group commit interval (seconds)
+        :param journal_batch: group commit max records
+        :param convert_vacuum: switch existing databases to incremental auto-vacuum (see SqliteShard)
+        """
+        with open(str(_path / "sql.json")) as f:
+            self.queries = json.load(f)
+        self.shards = [
+            SqliteShard(path, self.queries, journal_interval=journal_interval, journal_batch=journal_batch,
+                        convert_vacuum=convert_vacuum)
+            for path in shard_paths(db, shards)
+        ]
+        stored = int(self.shards[0].meta("shards", str(shards)))
+        if stored != shards:
+            self.close()
+            raise ValueError(f"Storage {db} has {stored} shards, not {shards}: "
+                             f"transactions are routed by hash of id modulo number of shards")
+
+    def shard(self, _id: str) -> SqliteShard:
+        return self.shards[zlib.crc32(_id.encode("utf-8")) % len(self.shards)]
+
+    def create(self, _id: str) -> AsyncResult:
+        return self.shard(_id).write("create", (_id,))
+
+    def finish(self, _id: str, fail: bool, status: bytes) -> AsyncResult:
+        return self.shard(_id).write("fail" if fail else "complete", (status, _id))
+
+    def insert(self, _id: str, fail: bool, status: bytes, created_at: Optional[float]) -> AsyncResult:
+        state = (EStatus.FAIL if fail else EStatus.DONE).name
+        return self.shard(_id).write("insert", (_id, int(fail), int(not fail), status, state, created_at))
+
+    def commit(self, _id: str, status: bytes, created_at: Optional[float] = None) -> AsyncResult:
+        return self.shard(_id).write("commit", (_id, status, created_at))
+
+    def get(self, _id: str) -> Optional[Row]:
+        return self.shard(_id).get(_id)  # BLOCK, storage thread
+
+    def ids(self) -> List[str]:
+        futures = [shard.ids() for shard in self.shards]
+        return [_id for future in futures for _id in future.get()]  # BLOCK, storage threads
+
+    def abandon(self):
+        wait([shard.abandon() for shard in self.shards])  # BLOCK, storage threads
+
+    def select(self, state: Optional[str], since: float, until: float, after: Optional[Cursor],
+               limit: int) -> List[Row]:
+        futures = [shard.select(state, since, until, after, limit) for shard in self.shards]
+        rows = [row for future in futures for row in future.get()]  # BLOCK, storage threads
+        return heapq.nsmallest(limit, rows, key=_sort_key)  # each shard is sorted, merge first `limit` rows
+
+    def retain(self, ttl: Seconds) -> Dict[str, Any]:
+        start = time.time()
+        threads = [g_async(shard.retain)(start - ttl) for shard in self.shards]
+        joinall(threads, raise_error=True)  # BLOCK, storage threads
+        return {
+            **{key: sum(th.value[key] for th in threads) for key in ("archived", "reclaimed")},
+            "duration": time.time() - start
+        }
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "shards": len(self.shards),
+            **{key: sum(shard.journal.stats[key] for shard in self.shards) for key in ("records", "flushes")}
+        }
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+# ================================================================ #
+
+class MemoryStorage(AStorage):
+    """Plain dict. Nothing is persisted, use it for benchmarks and tests."""
+
+    def __init__(self):
+        self._rows: Dict[str, Row] = {}
+        self._archive: Dict[str, Row] = {}  # status is compressed
+
+    def create(self, _id: str) -> AsyncResult:
+        self._rows[_id] = {"id": _id, "fail": 0, "complete": 0, "status": "", "state": EStatus.IN_PROGRESS.name,
+                           "created_at": time.time(), "finished_at": None}
+        return _ready()
+
+    def finish(self, _id: str, fail: bool, status: bytes) -> AsyncResult:
+        row = self._rows[_id]
+        if fail:
+            row.update(fail=1, state=EStatus.FAIL.name, status=status, finished_at=time.time())
+        elif not row["fail"]:
+            row.update(complete=1, state=EStatus.DONE.name, status=status, finished_at=time.time())
+        return _ready()
+
+    def insert(self, _id: str, fail: bool, status: bytes, created_at: Optional[float]) -> AsyncResult:
+        self._rows[_id] = {"id": _id, "fail": int(fail), "complete": int(not fail), "status": status,
+                           "state": (EStatus.FAIL if fail else EStatus.DONE).name,
+                           "created_at": created_at, "finished_at": time.time()}
+        return _ready()
+
+    def commit(self, _id: str, status: bytes, created_at: Optional[float] = None) -> AsyncResult:
+        row = self._rows.setdefault(_id, {"id": _id, "created_at": created_at or time.time(), "finished_at": None})
+        row.update(fail=0, complete=0, status=status, state=EStatus.COMMIT.name)
+        return _ready()
+
+    def get(self, _id: str) -> Optional[Row]:
+        row = self._rows.get(_id)
+        if row:
+            return dict(row)
+        row = self._archive.get(_id)
+        if row:
+            return {**row, "status": zlib.decompress(row["status"])}
+        return None
+
+    def ids(self) -> List[str]:
+        return list(self._rows) + list(self._archive)
+
+    def abandon(self):
+        for row in self._rows.values():
+            if not row["complete"] and row["state"] != EStatus.COMMIT.name:
+                row.update(fail=1, state=EStatus.FAIL.name, finished_at=row["finished_at"] or time.time())
+
+    def select(self, state: Optional[str], since: float, until: float, after: Optional[Cursor],
+               limit: int) -> List[Row]:
+        return _select(self._rows.values(), state, since, until, after, limit)
+
+    def retain(self, ttl: Seconds) -> Dict[str, Any]:
+        start = time.time()
+        expired = [row for row in self._rows.values() if row["finished_at"] and row["finished_at"] <= start - ttl]
+        reclaimed = 0
+        for row in expired:
+            status = _pack(row["status"])
+            reclaimed += len(row["status"]) - len(status)
+            self._archive[row["id"]] = {**self._rows.pop(row["id"]), "status": status}
+        return {"archived": len(expired), "reclaimed": reclaimed, "duration": time.time() - start}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "records": len(self._rows), "archived": len(self._archive)}
+
+
+# ================================================================ #
+
+class _MmapJournal(ABatchWriter):
+    errors = (OSError, ValueError)
+
+    def __init__(self, storage: 'MmapStorage', interval: Seconds = None, batch_size: int = None):
+        self.storage = storage
+        super().__init__(interval, batch_size, storage.executor)
+
+    def write(self, row: Row) -> AsyncResult:
+        return self._put(row)
+
+    def _commit(self, records: List[Row]):
+        self.storage._append(records)
+
+
+class MmapStorage(AStorage):
+    """
+    Append-only file of status records mapped to memory. Record is <uint32 length><json row>\n<status>,
+    the latest record of transaction wins. In-memory index (id => offset) is rebuilt by scanning the file on open.
+    History (select) is not indexed and scans all records.
+    The file grows by `chunk` bytes; appended records are msync'ed in groups.
+    """
+    chunk = 2 ** 24  # bytes
+    _header = struct.Struct("<I")
+
+    def __init__(self, path: str, journal_interval: Seconds = None, journal_batch: int = None):
+        """
+
+        :param path: data file
+        :param journal_interval: group msync interval (seconds)
+        :param journal_batch: group msync max records
+        """
+        self.path = path
+        self._index: Dict[str, Tuple[int, int]] = {}  # id => (offset, length)
+        self._tail = 0
+        self.executor = StorageExecutor()  # file is read and written on the storage thread only
+        self.executor(self._open)
+        self.journal = _MmapJournal(self, interval=journal_interval, batch_size=journal_batch)
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        self._file = open(self.path, "r+b")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(self.chunk)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+        offset = 0
+        while offset + self._header.size <= len(self._mm):
+            length, = self._header.unpack_from(self._mm, offset)
+            start, end = offset + self._header.size, offset + self._header.size + length
+            if length == 0 or end > len(self._mm):
+                break
+            try:
+                row = self._decode(self._mm[start:end])
+            except ValueError:
+                break  # torn write at the tail
+            self._index[row["id"]] = (start, length)
+            offset = end
+        self._tail = offset
+
+    def _append(self, rows: List[Row]):
+        flush_from = self._tail - self._tail % mmap.PAGESIZE
+        for row in rows:
+            prev = self._read(row["id"])
+            if prev:
+                if row["complete"] and prev["fail"]:
+                    continue  # complete of failed transaction is ignored as in SQLite storage
+                row = {"created_at": prev.get("created_at"), **row}
+            data = self._encode(row)
+            start = self._tail + self._header.size
+            end = start + len(data)
+            if end > len(self._mm):
+                self._mm.close()
+                self._file.truncate((end // self.chunk + 1) * self.chunk)
+                self._mm = mmap.mmap(self._file.fileno(), 0)
+            self._mm[start:end] = data  # data before header, so a torn record is never valid
+            self._header.pack_into(self._mm, self._tail, len(data))
+            self._index[row["id"]] = (start, len(data))
+            self._tail = end
+        self._mm.flush(flush_from, self._tail - flush_from)
+
+    @staticmethod
+    def _encode(row: Row) -> bytes:
+        meta = {key: value for key, value in row.items() if key != "status"}
+        status = row["status"] if isinstance(row["status"], bytes) else row["status"].encode("utf-8")
+        return json.dumps(meta).encode("utf-8") + b"\n" + status
+
+    @staticmethod
+    def _decode(data: bytes) -> Row:
+        meta, sep, status = data.partition(b"\n")
+        row = json.loads(meta)
+        if sep:
+            row["status"] = status
+        return row
+
+    def _read(self, _id: str) -> Optional[Row]:
+        position = self._index.get(_id)
+        if position is None:
+            return None
+        start, length = position
+        return self._decode(self._mm[start:start + length])
+
+    def create(self, _id: str) -> AsyncResult:
+        return self.journal.write({"id": _id, "fail": 0, "complete": 0, "status": b"",
+                                   "state": EStatus.IN_PROGRESS.name, "created_at": time.time()})
+
+    def finish(self, _id: str, fail: bool, status: bytes) -> AsyncResult:
+        return self.journal.write({"id": _id, "fail": int(fail), "complete": int(not fail), "status": status,
+                                   "state": (EStatus.FAIL if fail else EStatus.DONE).name, "finished_at": time.time()})
+
+    def insert(self, _id: str, fail: bool, status: bytes, created_at: Optional[float]) -> AsyncResult:
+        return self.journal.write({"id": _id, "fail": int(fail), "complete": int(not fail), "status": status,
+                                   "state": (EStatus.FAIL if fail else EStatus.DONE).name,
+                                   "created_at": created_at, "finished_at": time.time()})
+
+    def commit(self, _id: str, status: bytes, created_at: Optional[float] = None) -> AsyncResult:
+        return self.journal.write({"id": _id, "fail": 0, "complete": 0, "status": status,
+                                   "state": EStatus.COMMIT.name,
+                                   **({"created_at": created_at} if created_at is not None else {})})
+
+    def get(self, _id: str) -> Optional[Row]:
+        return self.executor(self._read, _id)  # BLOCK, storage thread
+
+    def ids(self) -> List[str]:
+        return self.executor(lambda: list(self._index))  # BLOCK, storage thread
+
+    def _abandon(self):
+        rows = [self._read(_id) for _id in list(self._index)]
+        self._append([
+            {**row, "fail": 1, "state": EStatus.FAIL.name, "finished_at": time.time()}
+            for row in rows if not (row["complete"] or row["fail"] or row["state"] == EStatus.COMMIT.name)
+        ])
+
+    def abandon(self):
+        self.executor(self._abandon)  # BLOCK, storage thread
+
+    def select(self, state: Optional[str], since: float, until: float, after: Optional[Cursor],
+               limit: int) -> List[Row]:
+        return self.executor(lambda: _select(
+            (self._read(_id) for _id in self._index), state, since, until, after, limit
+        ))  # BLOCK, storage thread
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "mmap", "records": len(self._index), "bytes": self._tail, **self.journal.stats}
+
+    def close(self):
+        self.journal.close()
+        self.executor(self._mm.close)
+        self.executor(self._file.close)
+        self.executor.close()
+
+
+# ================================================================ #
+
+def open_storage(uri: str, shards=1, journal_interval: Seconds = None, journal_batch: int = None,
+                 convert_vacuum=False) -> AStorage:
+    """
+    Create storage by URI:
+
+    * sqlite:///abs/path.sqlite, sqlite://rel/path.sqlite?shards=4, sqlite://:memory: or plain path - SqliteStorage
+    * memory:// - MemoryStorage
+    * mmap:///abs/path.bin, mmap://rel/path.bin - MmapStorage
+
+    :param uri:
+    :param shards: default number of SQLite shards
+    :param journal_interval: group commit interval (seconds)
+    :param journal_batch: group commit max records
+    :param convert_vacuum: switch existing SQLite databases to incremental auto-vacuum
+    """
+    scheme, sep, rest = uri.partition("://")
+    if not sep:
+        scheme, rest = "sqlite", uri
+    path, _, query = rest.partition("?")
+    params = {k: v[-1] for k, v in parse_qs(query).items()}
+
+    if scheme == "sqlite":
+        return SqliteStorage(path or ":memory:", shards=int(params.get("shards", shards)),
+                             journal_interval=journal_interval, journal_batch=journal_batch,
+                             convert_vacuum=convert_vacuum)
+    if scheme == "memory":
+        return MemoryStorage()
+    if scheme == "mmap":
+        return MmapStorage(path, journal_interval=journal_interval, journal_batch=journal_batch)
+    raise ValueError(f"Unknown storage: {uri}")
@@ -1,110 +1,496 @@
 import json
-import sqlite3
+import logging
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Union, Set
 from urllib.parse import urlparse, ParseResult
 
 import urllib3
 from bson import ObjectId
-from gevent import Greenlet
 from gevent import joinall
 from gevent import sleep
 from gevent import wait
+from gevent import Greenlet
+from gevent.event import AsyncResult
 
-from tools import debug_SSE, Singleton, MultiDict, dict_factory
+from tools import debug_SSE, Singleton, MultiDict, LRUCache, BloomFilter
 from tools import transform_json_types
 from tools.gevent import g_async, Wait
-from tools.transactions import ATransaction
+from tools.timers import wheel, Timer
+from tools.transactions import ATransaction, EStatus
+from .actions import Action, TemplateError, plan
+from .admission import AdmissionController, Overloaded
+from .breaker import CircuitBreakers, CircuitOpen
+from .codec import encode_status, decode_status
+from .connections import ConnectionPoolManager, HTTPConnectionPoolWithLock, DECISION, PREPARE
+from .decisions import DecisionBatcher
+from .executor import StorageExecutor
+from .heartbeat import HeartbeatScheduler
+from .journal import DecisionLog
+from .latency import LatencyTracker
+from .storage import AStorage, open_storage
 
 _path = (Path(__file__) / "..").absolute().resolve()
 
 
-class HTTPConnectionPoolWithLock(urllib3.HTTPConnectionPool):
-    def __init__(self, host, **conn_kw):
-        super().__init__(host, **conn_kw)
-        self.lock = 0
-
-    def acquire(self):
-        self.lock += 1
-
-    def release(self):
-        if self.lock:
-            self.lock -= 1
-
-
 class TransactionManager(metaclass=Singleton):
     instance: 'TransactionManager' = None
     def_db = ":memory:"
+    def_cache_size = 10000
+    def_filter_capacity = 10 ** 5
+    def_retention_interval = 60  # s
+    def_recovery_retry = 1  # s, first delay of commit retries after recovery (doubles up to max_recovery_retry)
+    max_recovery_retry = 60  # s
+    def_list_limit = 100
+    max_list_limit = 1000
+    probe_timeout = 1  # s, liveness check of service with open circuit
+
+    def __init__(self, db=None, journal_interval=None, journal_batch=None, log=None, cache_size=None,
+                 filter_error_rate=0.01, shards=1, retention_ttl=None, retention_interval=None, pool_idle_ttl=None,
+                 max_sockets=None, keep_alive=True, decision_window=None, presumed_abort=False, max_active=None,
+                 max_per_service=None, admission_queue=None, adaptive_timeouts=False, breaker_failures=None,
+                 breaker_reset=None, convert_vacuum=False, max_service_requests=None):
+        """
 
-    def __init__(self, db=None):
+        :param db: storage URI (see open_storage) or SQLite database path
+        :param shards: number of SQLite databases. Transactions are spread across them by hash of id
+        :param journal_interval: group commit interval (seconds)
+        :param journal_batch: group commit max records
+        :param log: decision log path. If it is set unfinished transactions are recovered from it on start
+        :param cache_size: max number of finished transaction statuses kept in memory
+        :param filter_error_rate: false positive rate of known transactions filter
+        :param retention_ttl: archive transactions finished more than this number of seconds ago (None - keep all)
+        :param retention_interval: seconds between retention passes
+        :param pool_idle_ttl: close connections to participants idle for more than this number of seconds
+        :param max_sockets: max number of open connections to participants
+        :param keep_alive: keep connections to participant when no transaction uses it
+        :param max_service_requests: max number of concurrent requests to one participant service, the rest wait
+            and phase 2 requests go first (see ConnectionPoolManager)
+        :param decision_window: seconds to wait for other phase 2 decisions to the same participant to send them
+            in one request (0 - send every decision separately)
+        :param presumed_abort: presumed abort mode. Transactions are stored when they finish (not when they start),
+            aborts are neither logged nor waited for (storage write, rollback and finish acknowledgments),
+            after restart transactions without commit record are aborted (participants roll back by ping timeout).
+            Unfinished transactions are not listed by list_transactions in this mode.
+        :param max_active: max number of running transactions (None - no limit)
+        :param max_per_service: max number of running transactions using the same participant service
+        :param admission_queue: max number of transactions waiting for admission, when it is full
+            new transactions are rejected (see AdmissionController)
+        :param adaptive_timeouts: derive timeouts of participant requests and callbacks from their observed latency,
+            timeouts of transaction are upper bounds (see LatencyTracker)
+        :param breaker_failures: number of failed requests to participant service in a row after which transactions
+            using it are rejected until it is up again (None - no circuit breakers, see CircuitBreakers)
+        :param breaker_reset: seconds before the first liveness check of service with open circuit
+        :param convert_vacuum: switch existing SQLite databases to incremental auto-vacuum on start (rebuilds them),
+            otherwise only new databases use it
+        """
         TransactionManager.instance = self
+        self.presumed_abort = presumed_abort
         self._transactions: Dict[ObjectId, Transaction] = {}
-        self._connections: Dict[str, HTTPConnectionPoolWithLock] = {}
-        self.db = sqlite3.connect(db if db else self.def_db)
-        with open(str(_path / "sql.json")) as f:
-            self.queries = json.load(f)
-        self.init_db()
-
-    def init_db(self):
-        self.db.row_factory = dict_factory
-        cur = self.db.cursor()
-        cur.executescript(self.queries["init"])
-        self.db.commit()
+        self.status_cache: LRUCache[ObjectId, Union[bytes, str]] = LRUCache(
+            cache_size if cache_size is not None else self.def_cache_size
+        )
+        self.connections = ConnectionPoolManager(
+            idle_ttl=pool_idle_ttl, max_sockets=max_sockets, keep_alive=keep_alive,
+            headers={"Content-Type": "application/json"}, max_requests=max_service_requests
+        )
+        self.heartbeat = HeartbeatScheduler()
+        self.decisions = DecisionBatcher(window=decision_window)
+        self.admission = AdmissionController(max_active, max_per_service, admission_queue)
+        self.latency = LatencyTracker(adaptive=adaptive_timeouts)
+        self.breakers = CircuitBreakers(self.probe, failures=breaker_failures, reset_timeout=breaker_reset,
+                                        on_open=self.on_circuit_open)
+        self.storage: AStorage = open_storage(db if db else self.def_db, shards=shards,
+                                              journal_interval=journal_interval, journal_batch=journal_batch,
+                                              convert_vacuum=convert_vacuum)
+        self.filter_error_rate = filter_error_rate
+        self.known: BloomFilter = None
+        self.filter_stats = {"negatives": 0, "false_positives": 0}
+        self._filter_added: List[str] = None  # ids created while the filter is rebuilt
+        self.rebuild_filter()
+        self.log_executor = StorageExecutor()
+        self.log = DecisionLog(log, interval=journal_interval, batch_size=journal_batch,
+                               executor=self.log_executor) if log else None
+        self.recovering: Dict[str, Greenlet] = {}  # retries of unacknowledged commits by transaction id
+        if self.log:
+            self.recover()
+        self.storage.abandon()  # BLOCK
+        self.retention_stats = {"passes": 0, "archived": 0, "reclaimed": 0, "duration": 0., "last": None}
+        self._retention = self._retention_loop(
+            retention_ttl, retention_interval if retention_interval is not None else self.def_retention_interval
+        ) if retention_ttl is not None else None  # THREAD:1, loop
+
+    @g_async
+    def _retention_loop(self, ttl, interval):
+        while True:
+            sleep(interval)  # BLOCK, interval
+            self.retain(ttl)  # BLOCK, storage threads
+
+    def retain(self, ttl) -> Optional[Dict[str, Any]]:
+        """
+        Archive transactions finished more than `ttl` seconds ago and release free storage space
+
+        :return: retention pass report (see AStorage.retain), None if storage doesn't support retention
+        """
+        report = self.storage.retain(ttl)  # BLOCK, storage threads
+        if report is None:
+            return None
+        self.retention_stats["passes"] += 1
+        for key in ("archived", "reclaimed", "duration"):
+            self.retention_stats[key] += report[key]
+        self.retention_stats["last"] = report
+        logging.info("Retention: archived %d transactions, reclaimed %d bytes in %.3f s",
+                     report["archived"], report["reclaimed"], report["duration"])
+        return report
+
+    def rebuild_filter(self, capacity=0):
+        """Rebuild known transactions filter from DB and active transactions"""
+        self._filter_added = added = []
+        ids = self.storage.ids()  # BLOCK, storage threads
+        ids += added + [str(_id) for _id in self._transactions]
+        known = BloomFilter(max(capacity, 2 * len(ids), self.def_filter_capacity), self.filter_error_rate)
+        for _id in ids:
+            known.add(_id)
+        self.known = known
+        self._filter_added = None
+
+    def recover(self):
+        """
+        Replay decision log after restart. Participants of committed transactions get commit + finish,
+        participants of all other unfinished transactions get rollback. All requests are sent in parallel.
+
+        Commit decision is durable until every participant acknowledges it: transaction with unacknowledged commits
+        is stored unfinished in COMMIT state, its commit record (with those participants only) is written again
+        and kept by truncation, and commit is resent in background (see _retry_commit).
+        """
+        pending = self.log_executor(self.log.replay)
+        threads = {
+            tr.id: [self._recover_child(ch, tr.decision == "commit") for ch in tr.childes]
+            for tr in pending.values()
+        }
+        joinall([th for ths in threads.values() for th in ths])  # BLOCK
+
+        results, retries = [], []
+        for tr in pending.values():
+            commit = tr.decision == "commit"
+            statuses = [
+                th.value if th.successful() else EStatus.COMMIT if commit else EStatus.FAIL for th in threads[tr.id]
+            ]
+            unacknowledged = [ch for ch, ch_status in zip(tr.childes, statuses) if ch_status == EStatus.COMMIT]
+            status = {
+                "global": (EStatus.FAIL if not commit else EStatus.COMMIT if unacknowledged else EStatus.DONE).name,
+                **{ch["ch"]: {
+                    "status": ch_status.name,
+                    "service_response": None
+                } for ch, ch_status in zip(tr.childes, statuses)}
+            }
+            if tr.created_at is not None:  # logged in presumed abort mode, transaction wasn't stored
+                self.known.add(tr.id)
+            if unacknowledged:  # not finished until _retry_commit, so abandon and retention keep it
+                results.append(self.storage.commit(tr.id, encode_status(status), tr.created_at))
+            elif tr.created_at is not None:
+                results.append(self.storage.insert(tr.id, not commit, encode_status(status), tr.created_at))
+            else:
+                results.append(self.storage.finish(tr.id, not commit, encode_status(status)))
+            if unacknowledged:
+                results.append(self.log.write("commit", tr.id, childes=[
+                    {key: ch[key] for key in ("ch", "url", "remote_id", "key")} for ch in unacknowledged
+                ]))
+                retries.append((tr.id, unacknowledged, status))
+        wait(results)  # BLOCK
+        self.log_executor(self.log.truncate, [_id for _id, *_ in retries])
+        for _id, childes, status in retries:
+            self.recovering[_id] = self._retry_commit(_id, childes, status)  # THREAD:N, loop
+
+    @g_async
+    def _retry_commit(self, _id: str, childes: List[dict], status: Dict[str, Any]):
+        """Resend commit to participants which didn't acknowledge it until all of them do"""
+        delay = self.def_recovery_retry
+        while childes:
+            sleep(delay)  # BLOCK, sleep
+            delay = min(2 * delay, self.max_recovery_retry)
+            threads = [self._recover_child(ch, True) for ch in childes]
+            joinall(threads)  # BLOCK
+            acknowledged = [th.successful() and th.value == EStatus.DONE for th in threads]
+            for ch, ok in zip(childes, acknowledged):
+                if ok:
+                    status[ch["ch"]]["status"] = EStatus.DONE.name
+            childes = [ch for ch, ok in zip(childes, acknowledged) if not ok]
+
+        status["global"] = EStatus.DONE.name
+        data = encode_status(status)
+        self.storage.finish(_id, False, data).get()  # BLOCK, group commit
+        self.status_cache[ObjectId(_id)] = data  # replaces cached COMMIT status
+        if self.log:
+            self.log.write("end", _id).get()  # BLOCK, fsync
+        del self.recovering[_id]
+
+    @g_async
+    def _recover_child(self, ch: dict, commit: bool) -> EStatus:
+        """:return: DONE - commit is acknowledged, COMMIT - it isn't, FAIL - rollback is sent"""
+        url = urlparse(ch["url"])
+        session = self.connect(url.hostname, url.port)
+        path = f"{url.path}/transactions/{ch['remote_id']}"
+        headers = {"X-Transaction": ch["key"]}
+        try:
+            if not commit:
+                session.request("DELETE", path, headers=headers, timeout=Transaction.done_timeout,
+                                priority=DECISION)  # BLOCK, timeout
+                return EStatus.FAIL
+            resp: urllib3.HTTPResponse = session.request(
+                "POST", path, headers=headers, timeout=Transaction.done_timeout, priority=DECISION
+            )  # BLOCK, timeout
+            if resp.status != 200:
+                return EStatus.COMMIT
+            try:
+                session.request("PUT", path, headers=headers, timeout=Transaction.done_timeout,
+                                priority=DECISION)  # BLOCK, timeout
+            except urllib3.exceptions.HTTPError:
+                pass  # commit is acknowledged, participant finishes by ping timeout
+            return EStatus.DONE
+        except urllib3.exceptions.HTTPError:
+            return EStatus.COMMIT if commit else EStatus.FAIL
+        finally:
+            self.disconnect(url.hostname, url.port)
+
+    @staticmethod
+    def _log_child(ch: 'ChildTransaction') -> Dict[str, Any]:
+        return {"ch": ch.id, "url": ch.service.url.geturl(), "remote_id": ch.remote_id, "key": ch.key}
+
+    def log_prepare(self, ch: 'ChildTransaction'):
+        if self.log and not (self.presumed_abort or ch.one_phase):
+            ch.parent.logged = True
+            self.log.write("prepare", ch.parent.id, **self._log_child(ch))
+
+    def log_decision(self, tr: 'Transaction', decision: str) -> AsyncResult:
+        """
+        In presumed abort mode aborts are not logged and commit record carries participants instead of
+        prepare records. Participants which voted read-only are left out of recovery.
+        Abort of transaction without prepare records (one-phase commit) is not logged.
+
+        :param decision: commit | abort
+        :return: AsyncResult which is set when decision is durable
+        """
+        read_only = [ch.id for ch in tr.childes.values() if ch.read_only] if decision == "commit" else []
+        if self.log and not self.presumed_abort and (tr.logged or decision == "commit"):
+            tr.logged = True
+            return self.log.write(decision, tr.id, **({"read_only": read_only} if read_only else {}))
+        if self.log and decision == "commit":
+            tr.logged = True
+            return self.log.write(decision, tr.id, created_at=tr.created_at,
+                                  childes=[self._log_child(ch) for ch in tr.childes.values() if not ch.read_only])
+        result = AsyncResult()
+        result.set(True)
+        return result
 
     def create(self, data):
+        """
+        :raise Overloaded: if transaction is rejected by admission control
+        :raise CircuitOpen: if a participant service of transaction is down
+        :raise TemplateError: if actions graph is invalid
+        """
         tr = Transaction(data)
+        try:
+            self.breakers.check(tr.services)
+            admitted = self.admission.enter(tr.services, tr.global_timeout)
+        except (CircuitOpen, Overloaded):
+            tr.release()
+            raise
         self._transactions[tr.id] = tr
+        self.known.add(str(tr.id))
+        if self._filter_added is not None:
+            self._filter_added.append(str(tr.id))
+        elif len(self.known) > self.known.capacity:
+            self.rebuild_filter(2 * self.known.capacity)  # BLOCK, storage thread
 
-        cur = self.db.cursor()
-        cur.execute(self.queries["create"], (str(tr.id),))
-        self.db.commit()
-        cur.close()
+        if not self.presumed_abort:
+            try:
+                self.storage.create(str(tr.id)).get()  # BLOCK, group commit
+            except Exception:
+                del self._transactions[tr.id]
+                if admitted is None:
+                    self.admission.leave(tr.services, time.time() - tr.created_at)
+                else:
+                    self.admission.cancel(admitted)
+                tr.release()
+                raise
 
-        tr.run()
+        if admitted is None:
+            tr.admitted = True
+            tr.run()
+        else:
+            admitted.rawlink(tr.on_admitted)
         return tr
 
     def finish(self, tr: 'Transaction'):
-        cur = self.db.cursor()
-        cur.execute(
-            self.queries["fail" if tr.fail.ready() else "complete"],
-            (json.dumps(tr.status), str(tr.id))
-        )
-        self.db.commit()
-        cur.close()
+        if tr.admitted:
+            self.admission.leave(tr.services, time.time() - tr.created_at)
+        if tr.commit.ready() and not tr.done.ready():
+            self.retry_commit(tr)
+            return
+        status = encode_status(tr.status)
+        fail = tr.fail.ready()
+        if not self.presumed_abort:
+            self.storage.finish(str(tr.id), fail, status).get()  # BLOCK, group commit
+        else:
+            result = self.storage.insert(str(tr.id), fail, status, tr.created_at)
+            if not fail:
+                result.get()  # BLOCK, group commit. Abort is presumed, it isn't waited for
+        if self.log and tr.logged:
+            self.log.write("end", tr.id)
 
+        self.status_cache[tr.id] = status
         del self._transactions[tr.id]
 
-    def connect(self, host: str, port: int):
-        key = host + ':' + str(port)
-        if key not in self._connections:
-            conn = self._connections[key] = HTTPConnectionPoolWithLock(
-                host, port=port, block=True, maxsize=1000,
-                headers={"Content-Type": "application/json"}
-            )
-        else:
-            conn = self._connections[key]
-        conn.acquire()
-        return conn
+    def retry_commit(self, tr: 'Transaction'):
+        """
+        Transaction failed after commit decision (a participant didn't acknowledge commit in time).
+        It is stored unfinished in COMMIT state, its decision log records are kept, and commit is resent
+        to the participants which didn't acknowledge it in background as on recovery (see _retry_commit).
+        """
+        childes = [ch for ch in tr.childes.values() if not (ch.done.ready() or ch.released)]
+        status = tr.status
+        status["global"] = EStatus.COMMIT.name
+        for ch in tr.childes.values():
+            status[ch.id]["status"] = (EStatus.COMMIT if ch in childes else EStatus.DONE).name
+        self.storage.commit(str(tr.id), encode_status(status),
+                            tr.created_at if self.presumed_abort else None).get()  # BLOCK, group commit
+        del self._transactions[tr.id]
+        self.recovering[str(tr.id)] = self._retry_commit(
+            str(tr.id), [self._log_child(ch) for ch in childes], status
+        )  # THREAD:1, loop
+
+    def on_circuit_open(self, service: str):
+        """Fail children of running transactions which aren't opened by the service yet (requests are cancelled)"""
+        for tr in list(self._transactions.values()):
+            if not tr.admitted or tr.commit.ready() or tr.fail.ready():
+                continue
+            for ch in tr.childes.values():
+                if ch.remote_id is None and ch.service.url.geturl() == service:
+                    ch.fail.set()  # EMIT(fail)
+
+    def probe(self, service: str) -> bool:
+        """Liveness check of participant service with open circuit: any response but 5xx to batched ping"""
+        url = urlparse(service)
+        session = self.connect(url.hostname, url.port)
+        try:
+            resp: urllib3.HTTPResponse = session.request(
+                "POST", f"{url.path}/transactions/ping", body=json.dumps({"transactions": []}),
+                timeout=self.probe_timeout, priority=DECISION
+            )  # BLOCK, timeout
+        except urllib3.exceptions.HTTPError:
+            return False
+        finally:
+            self.disconnect(url.hostname, url.port)
+        return resp.status < 500
+
+    def connect(self, host: str, port: int) -> HTTPConnectionPoolWithLock:
+        return self.connections.connect(host, port)
 
     def disconnect(self, host: str, port: int):
-        key = host + ':' + str(port)
-        conn = self._connections.get(key)
-        if conn:
-            conn.release()
-            if conn.lock == 0:
-                conn.close()
-                del self._connections[key]
+        self.connections.disconnect(host, port)
 
     def __getitem__(self, _id: ObjectId):
         if _id in self._transactions:
             return self._transactions[_id]
-        else:
-            cur = self.db.cursor()
-            cur.execute(self.queries["get"], (str(_id),))
-            tr = cur.fetchone()
-            cur.close()
-            return tr
+        elif self.is_known(_id):
+            return self._query(_id)
+
+    def is_known(self, _id: ObjectId) -> bool:
+        """False if transaction was never created (without DB query), True if it may exist"""
+        if str(_id) in self.known:
+            return True
+        self.filter_stats["negatives"] += 1
+        return False
+
+    def _query(self, _id: ObjectId):
+        row = self.storage.get(str(_id))  # BLOCK, storage thread
+        if row is None:
+            self.filter_stats["false_positives"] += 1
+        return row
+
+    def status(self, _id: ObjectId):
+        """
+        Decoded status of transaction. Statuses of finished transactions are served from LRU cache,
+        which keeps them encoded (see codec.py) and decodes on every request.
+
+        :param _id:
+        :return: status dict (or "FAIL" | "COMPLETE" | "UNKNOWN" if it wasn't saved), None if transaction not found
+        """
+        if _id in self._transactions:
+            return self._transactions[_id].status
+
+        status = self.status_cache.get(_id)
+        if status is None:
+            if not self.is_known(_id):
+                return None
+            row = self._query(_id)
+            if not row:
+                return None
+            status = row["status"]
+            if not status:
+                status = "FAIL" if row["fail"] else ("COMPLETE" if row["complete"] else "UNKNOWN")
+            elif isinstance(status, str):
+                status = status.encode("utf-8")  # JSON stored by older versions
+            if row["fail"] or row["complete"]:
+                self.status_cache[_id] = status
+        return decode_status(status) if isinstance(status, bytes) else status
+
+    def list_transactions(self, state=None, since=None, until=None, after=None, limit=None) -> Dict[str, Any]:
+        """
+        Page of transactions created in [since, until) ordered by creation time.
+        Pages are chained by keyset cursor: pass "next" of the previous page as `after`.
+        Arguments may be strings (from query string).
+
+        :param state: IN_PROGRESS | COMMIT | DONE | FAIL (None - any)
+        :param since: unix time (seconds)
+        :param until: unix time (seconds)
+        :param after: cursor
+        :param limit: page size
+        :return: {"transactions": [{"id", "state", "created_at", "finished_at"}], "next": cursor or None}
+        :raise ValueError: if arguments are invalid
+        """
+        if state is not None and state not in (EStatus.IN_PROGRESS.name, EStatus.COMMIT.name, EStatus.DONE.name,
+                                              EStatus.FAIL.name):
+            raise ValueError(f"Invalid state: {state}")
+        since = float(since) if since is not None else 0.
+        until = float(until) if until is not None else float("inf")
+        limit = int(limit) if limit is not None else self.def_list_limit
+        if not 0 < limit <= self.max_list_limit:
+            raise ValueError(f"Limit must be in 1..{self.max_list_limit}")
+        if after is not None:
+            created_at, _, _id = str(after).partition("_")
+            after = (float(created_at), _id)
+
+        rows = self.storage.select(state, since, until, after, limit)  # BLOCK, storage threads
+        return {
+            "transactions": rows,
+            "next": f"{rows[-1]['created_at']!r}_{rows[-1]['id']}" if len(rows) == limit else None
+        }
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._transactions),
+            "storage": self.storage.stats,
+            "retention": self.retention_stats,
+            "connections": self.connections.stats,
+            "heartbeat": self.heartbeat.stats,
+            "decisions": self.decisions.stats,
+            "admission": self.admission.stats,
+            "recovering": len(self.recovering),
+            "latency": self.latency.stats,
+            "breakers": self.breakers.stats,
+            "status_cache": self.status_cache.stats,
+            "known_filter": {
+                **self.known.stats,
+                **self.filter_stats,
+                "observed_false_positive_rate": self.filter_stats["false_positives"] / max(
+                    1, self.filter_stats["false_positives"] + self.filter_stats["negatives"]
+                )
+            }
+        }
 
 
 class Transaction(ATransaction):
@@ -130,38 +516,64 @@ class Transaction(ATransaction):
         ... 			"method": "HTTP method",
         ... 			"data": {},
         ... 			"headers": {},
-        ... 			"then": None  #TODO: Support in future versions
+        ... 			"then": None,  # action which is sent after response of this one
+        ... 			"$patterns": {}  # fields made of responses of other actions (see actions.py)
         ... 		}
         ... 		# ...
         ... 	]
         ... }
 
         :param data:
+        :raise TemplateError: if actions graph is invalid
         """
+        actions = plan(data["actions"])
         super().__init__(ObjectId())
         debug_SSE.event({"event": "init", "t": datetime.now(), "data": data})  # DEBUG init
+        self.created_at = time.time()
         self.global_timeout = data["timeout"] / 1000
-        self.global_timeout_thread: Greenlet = None
+        self.deadline: Timer = None
+        self._aborted = False
+        self._resolving: Greenlet = None
+        self.one_phase = len(actions) == 1  # participant is asked to commit on its own (see ChildTransaction)
+        self.in_doubt = False  # outcome of one-phase commit is unknown (see resolve)
+        self.logged = False  # decision log has records of the transaction
+        self.admitted = False  # holds slots of admission control
         self.childes: Dict[Any, ChildTransaction] = MultiDict(
-            {tr["_id"]: ChildTransaction(self, **tr) for tr in data["actions"]}
+            {action.id: ChildTransaction(self, action=action, **action.data) for action in actions}
         )
 
     @property
     def status(self):
         return {
-            "global": super().status.name,
+            "global": EStatus.IN_DOUBT.name if self.in_doubt else super().status.name,
             **{ch.id: {
                 "status": ch.status.name,
                 "service_response": ch.result.value
             } for ch in self.childes.values()}
         }
 
+    @property
+    def services(self) -> Set[str]:
+        return {ch.service.url.geturl() for ch in self.childes.values()}
+
+    @property
+    def released(self) -> bool:
+        """All participants finished on their own (read-only vote or one-phase commit): there is nothing to decide"""
+        return all(ch.released for ch in self.childes.values())
+
+    @property
+    def undecided(self) -> bool:
+        """A one-phase participant may have committed on its own, abort can't be presumed"""
+        return any(ch.undecided for ch in self.childes.values())
+
     def __repr__(self):
         return "Transaction#{}: {}".format(self.id, super().status)
 
     @g_async
     def _spawn(self):
-        self.global_timeout_thread = self.wait_fail()
+        # time spent in the admission queue counts
+        self.deadline = wheel.call_later(max(0., self.created_at + self.global_timeout - time.time()), self.on_timeout)
+        self.wait_fail()
 
         # Phase 1
 
@@ -176,40 +588,144 @@ class Transaction(ATransaction):
 
         if self.ready_commit.ready():
             debug_SSE.event({"event": "ready_commit", "t": datetime.now()})  # DEBUG ready_commit
+            if not self.released:  # participants already finished, decision isn't logged
+                try:
+                    TransactionManager.instance.log_decision(self, "commit").get()  # BLOCK, fsync
+                except OSError:
+                    self.fail.set()  # EMIT(fail)
+                    return
             self.commit.set()
             debug_SSE.event({"event": "commit", "t": datetime.now()})  # DEBUG commit
             joinall([ch.do_commit() for ch in self.childes.values()])  # BLOCK  # THREAD:N
 
-            # THREAD: 1, blocked
-            done = wait(
-                [ch.done for ch in self.childes.values()], count=len(self.childes), timeout=self.done_timeout
-            )
-            if not self.fail.ready() and len(done) == len(self.childes):
-                self.done.set()  # EMIT(ready_commit)
-                debug_SSE.event({"event": "finish", "t": datetime.now()})  # DEBUG finish
-                joinall([ch.send_finish() for ch in self.childes.values()])
-            else:
-                self.fail.set()
+            # done callbacks are waited in the timer wheel, main thread exits
+            timeout = max(ch.timeout("commit", self.done_timeout) for ch in self.childes.values())
+            Wait([ch.done for ch in self.childes.values()], count=len(self.childes), timeout=timeout,
+                 then=self.on_done, parent=self)
+
+    def on_done(self, done: list):
+        for ch in self.childes.values():
+            if ch.committed_at is not None and not ch.done.ready():
+                ch.timed_out("commit")
+                ch.committed_at = None
+        self.main_thread = self._finish(done)  # THREAD:1
+
+    @g_async
+    def _finish(self, done: list):
+        if not self.fail.ready() and len(done) == len(self.childes):
+            self.done.set()  # EMIT(ready_commit)
+            for ch in self.childes.values():
+                TransactionManager.instance.heartbeat.remove(ch)  # participants stop answering pings on finish
+            debug_SSE.event({"event": "finish", "t": datetime.now()})  # DEBUG finish
+            joinall([ch.send_finish() for ch in self.childes.values()])
             self.clean()
+        else:
+            self.fail.set()  # EMIT(fail)
+
+    def on_admitted(self, result: AsyncResult):  # LISTENER
+        if result.successful():
+            self.admitted = True
+            self.run()
+        else:
+            self.reject(str(result.exception))
 
     @g_async
+    def reject(self, reason):
+        """Fail transaction which waited for admission too long (it wasn't started)"""
+        debug_SSE.event({"event": "fail", "t": datetime.now(), "data": reason})  # DEBUG fail
+        self.fail.set()  # EMIT(fail)
+        self.release()
+        TransactionManager.instance.finish(self)
+
+    def release(self):
+        """Release connection pools of children"""
+        for ch in self.childes.values():
+            url = ch.service.url
+            TransactionManager.instance.disconnect(url.hostname, url.port)
+
     def wait_fail(self):
+        """Abort transaction when any child fails (without greenlet, see Wait)"""
+
         def on_child_fail(e):
             ch = next(filter(lambda ch: ch.fail.ready(), self.childes.values()), None)
             debug_SSE.event(
                 {"event": "fail_child", "t": datetime.now(), "data": ch.id if ch else None})  # DEBUG fail_child
+            self.fail_or_resolve()
+
+        Wait([ch.fail for ch in self.childes.values()], count=1, then=on_child_fail, parent=self)
+        self.fail.rawlink(self.on_fail)
+
+    def on_timeout(self):
+        if not (self.done.ready() or self.fail.ready()):
+            self.fail_or_resolve("global timeout")
+
+    def fail_or_resolve(self, reason=None):
+        """Abort transaction, but resolve outcome of one-phase commit first if the participant may have committed"""
+        if self._resolving is not None:
+            return
+        if self.undecided:
+            self._resolving = self.resolve(reason)  # THREAD:1
+        else:
+            self.abort(reason)
             self.fail.set()  # EMIT(fail)
 
-        w_fail = Wait([ch.fail for ch in self.childes.values()], count=1, timeout=self.global_timeout,
-                      then=on_child_fail, parent=self)
+    @g_async
+    def resolve(self, reason):
+        """
+        One-phase participant commits before it votes, so a timeout or a lost vote doesn't mean it hasn't committed.
+        Its outcome is queried (see ChildTransaction.resolve): transaction is done if the participant has committed,
+        failed if it has rolled back, failed as IN_DOUBT if it didn't answer within done_timeout.
+        """
+        self.main_thread.kill()
+        self.cancel_prepare()
+        deadline = time.monotonic() + self.done_timeout
+        outcomes = [ch.resolve(deadline) for ch in self.childes.values() if ch.undecided]  # BLOCK, done_timeout
+        if all(ch.commit.ready() for ch in self.childes.values()):
+            self.ready_commit.set()
+            self.commit.set()
+            self.done.set()  # EMIT(done)
+            debug_SSE.event({"event": "finish", "t": datetime.now()})  # DEBUG finish
+            self.clean()
+            return
+        self.in_doubt = None in outcomes
+        self.abort(reason)
+        self.fail.set()  # EMIT(fail)
+
+    def on_fail(self, e):
+        if not self.done.ready():
+            self.abort()
 
-        e = wait((self.fail, self.done), count=1, timeout=self.global_timeout)
-        if self.done.ready(): return
+    def abort(self, reason=None):
+        if not self._aborted:
+            self._aborted = True
+            self._abort(reason)  # THREAD:1
+
+    @g_async
+    def _abort(self, reason):
         self.main_thread.kill()
-        self.do_rollback("global timeout" if len(e) == 0 else None)
+        self.cancel_prepare()
+        if self.commit.ready():  # decision is final, nothing is rolled back (see TransactionManager.retry_commit)
+            debug_SSE.event({"event": "fail", "t": datetime.now(), "data": reason})  # DEBUG fail
+            self.clean()
+            return
+        TransactionManager.instance.log_decision(self, "abort")
+        self.do_rollback(reason)
         self.clean()
 
+    def cancel_prepare(self):
+        """
+        Stop phase 1 at once: outstanding requests of children are cancelled (their connections are closed),
+        so no action is sent after the failure. A child whose open request has already reached the participant
+        is left without remote id and gets no rollback: the participant rolls it back by ping timeout
+        """
+        self.threads.kill()  # BLOCK, until greenlets exit
+        for ch in self.childes.values():
+            if ch.deadline:
+                ch.deadline.cancel()
+            TransactionManager.instance.heartbeat.remove(ch)
+
     def do_rollback(self, reason=None):
+        """Roll back opened children in parallel (children without remote transaction are skipped)"""
         debug_SSE.event({"event": "fail", "t": datetime.now(), "data": reason})  # DEBUG fail
         joinall([ch.do_rollback() for ch in self.childes.values()])  # BLOCK  # THREAD:N
         debug_SSE.event({"event": "rollback", "t": datetime.now()})  # DEBUG rollback
@@ -217,10 +733,12 @@ class Transaction(ATransaction):
     @g_async
     def clean(self):
         super(Transaction, self).clean()
-        self.global_timeout_thread.kill()
+        self.deadline.cancel()
         for ch in self.childes.values():
-            url = ch.service.url
-            TransactionManager.instance.disconnect(url.hostname, url.port)
+            if ch.deadline:
+                ch.deadline.cancel()
+            TransactionManager.instance.heartbeat.remove(ch)
+        self.release()
 
         for w in Wait.connections[self]:
             w.kill()
@@ -229,20 +747,30 @@ class Transaction(ATransaction):
 
 
 class ChildTransaction(ATransaction):
+    resolve_retry = 0.1  # s, first delay between outcome queries of one-phase commit (doubles)
+
     class Service:
         def __init__(self, url, timeout):
             self.url: ParseResult = urlparse(url[:-1] if url.endswith("/") else url)
             self.session = TransactionManager.instance.connect(self.url.hostname, self.url.port)
             self.timeout = timeout / 1000
 
+        def record(self, ok: bool):
+            """Feed outcome of request to the service (transport error or HTTP 5xx - failure) to its circuit breaker"""
+            if ok:
+                TransactionManager.instance.breakers.success(self.url.geturl())
+            else:
+                TransactionManager.instance.breakers.failure(self.url.geturl())
+
         def __repr__(self):
             return f"<{self.url.path}>"
 
     def __init__(self, parent: 'Transaction', _id: str, url: str, method: str, data: dict, headers: dict, service: dict,
-                 **kwargs):
+                 action: Action = None, **kwargs):
         super().__init__(_id)
         debug_SSE.event({"event": "init_child", "t": datetime.now(), "data": _id})  # DEBUG init_child
         self.parent = parent
+        self.action = action if action is not None else Action({"_id": _id})
 
         self.url = url
         self.method = method
@@ -253,24 +781,42 @@ class ChildTransaction(ATransaction):
         self.remote_id = None
         self.key = None
         self.ping_timeout = -1
+        self.deadline: Timer = None  # of service response
+        self.sent_at: float = None  # monotonic time the action was acknowledged (vote latency)
+        self.committed_at: float = None  # monotonic time the commit decision was sent (commit latency)
+        self.read_only = False  # vote of participant: it is released after prepare and gets no phase 2 messages
+        self.one_phase = False  # participant of single action transaction commits on its own when work is done
+        self.action_sent = False  # one-phase participant may have committed since then
+        self.resolved = False  # outcome of one-phase commit was queried, the participant gets no rollback
+        self.in_doubt = False  # the query didn't get an answer
 
     @g_async
     def _spawn(self):
+        if TransactionManager.instance.breakers.is_open(self.service.url.geturl()):
+            self.fail.set()  # EMIT(fail)
+            return
+        start = time.monotonic()
         try:
             resp: urllib3.HTTPResponse = self.service.session.request(
                 "POST", self.service.url.path + "/transactions",
                 body=json.dumps({
                     "timeout": self.service.timeout,
-                    "callback-url": f"{self.parent.self_url}/{self.parent.id}"
+                    "callback-url": f"{self.parent.self_url}/{self.parent.id}",
+                    **({"one-phase": True} if self.parent.one_phase else {})
                 }),
-                timeout=self.service.timeout
+                timeout=self.timeout("prepare", self.service.timeout), priority=PREPARE
             )  # BLOCK, timeout
         except urllib3.exceptions.HTTPError as e:
+            if isinstance(e, urllib3.exceptions.TimeoutError):
+                self.timed_out("prepare")
+            self.service.record(False)
             self.fail.set()  # EMIT(fail)
         else:
+            self.service.record(resp.status < 500)
             if resp.status != 200:
                 self.fail.set()  # EMIT(fail)
             else:
+                self.observe("prepare", start)
                 js = json.loads(resp.data)
                 transform_json_types(js, direction=1)
                 # TODO: validate
@@ -284,38 +830,107 @@ class ChildTransaction(ATransaction):
                 self.key = js["transaction-key"]
                 self.parent.childes[self.key] = self
                 self.ping_timeout = js["ping-timeout"] / 1000
+                self.one_phase = js.get("one-phase", False)  # older participants ignore it, 2PC goes on
+                TransactionManager.instance.log_prepare(self)
 
-                self.parent.threads.add(self.do_ping())  # THREAD:1, loop
+                TransactionManager.instance.heartbeat.add(self)
                 self.parent.threads.add(self.wait_response())  # THREAD:1
-                self.parent.threads.add(self.wait_done())  # THREAD:1
+                self.done.rawlink(self.on_done)
 
-    @g_async
-    def do_ping(self):
-        while not (self.parent.done.ready() or self.fail.ready()):
-            debug_SSE.event({"event": "ping_child", "t": datetime.now(), "data": self.id})  # DEBUG ping_child
-            try:
-                start = datetime.now()
-                resp: urllib3.HTTPResponse = self.service.session.request(
-                    "GET", f"{self.service.url.path}/transactions/{self.remote_id}",
-                    headers={
-                        "X-Transaction": self.key
-                    }, timeout=self.ping_timeout
-                )  # BLOCK, timeout
-            except urllib3.exceptions.HTTPError:
-                self.fail.set()  # EMIT(fail)
-            else:
-                if resp.status != 200:
-                    self.fail.set()  # EMIT(fail)
-                else:
-                    js = json.loads(resp.data)
-                    if not js["alive"]:
-                        self.fail.set()
-                    end = datetime.now()
-                    sleep(self.ping_timeout - (end - start).total_seconds() - 0.1)  # BLOCK, sleep
+    @property
+    def status(self) -> EStatus:
+        return EStatus.IN_DOUBT if self.in_doubt else super().status
 
-    @g_async
-    def wait_done(self):  # DEBUG # LISTENER
-        wait([self.done])
+    @property
+    def released(self) -> bool:
+        """Participant finished its transaction on its own and gets no phase 2 messages"""
+        return self.read_only or self.one_phase and self.commit.ready()
+
+    @property
+    def undecided(self) -> bool:
+        """One-phase participant got the action but its done vote wasn't received"""
+        return self.one_phase and self.action_sent and not (self.commit.ready() or self.resolved)
+
+    def vote(self, response: Any, read_only=False, done=False):
+        """
+        Prepare callback of participant
+
+        :param response: result of action
+        :param read_only: participant is released, it gets no phase 2 messages
+        :param done: participant has committed on its own (one-phase commit)
+        """
+        self.read_only = read_only
+        if done and self.one_phase:
+            self.commit.set()  # EMIT(commit)
+        self.result.set(response)  # EMIT(result)
+
+    @property
+    def requires(self) -> List['ChildTransaction']:
+        """Children whose responses are needed before the action is sent"""
+        return [self.parent.childes[_id] for _id in self.action.requires]
+
+    def ping(self) -> bool:
+        """
+        Check that participant's transaction is alive (called by HeartbeatScheduler)
+
+        :return: False if ping failed
+        """
+        debug_SSE.event({"event": "ping_child", "t": datetime.now(), "data": self.id})  # DEBUG ping_child
+        try:
+            resp: urllib3.HTTPResponse = self.service.session.request(
+                "GET", f"{self.service.url.path}/transactions/{self.remote_id}",
+                headers={
+                    "X-Transaction": self.key
+                }, timeout=self.ping_timeout, priority=DECISION
+            )  # BLOCK, timeout
+        except urllib3.exceptions.HTTPError:
+            self.service.record(False)
+            return False
+        self.service.record(resp.status < 500)
+        return resp.status == 200 and json.loads(resp.data)["alive"]
+
+    @staticmethod
+    def ping_batch(childes: List['ChildTransaction']) -> Optional[List[bool]]:
+        """
+        Check transactions of one participant service in one request (POST /transactions/ping)
+
+        :return: alive flags in order of childes, None if service doesn't support batched pings
+        """
+        service = childes[0].service
+        debug_SSE.event({
+            "event": "ping_childes", "t": datetime.now(), "data": [ch.id for ch in childes]
+        })  # DEBUG ping_childes
+        try:
+            resp: urllib3.HTTPResponse = service.session.request(
+                "POST", f"{service.url.path}/transactions/ping",
+                body=json.dumps({"transactions": [{"_id": ch.remote_id, "key": ch.key} for ch in childes]}),
+                timeout=min(ch.ping_timeout for ch in childes), priority=DECISION
+            )  # BLOCK, timeout
+        except urllib3.exceptions.HTTPError:
+            service.record(False)
+            return [False] * len(childes)
+        service.record(resp.status < 500)
+        if resp.status in (400, 404, 405):  # older participants route it to commit of transaction "ping"
+            return None
+        if resp.status != 200:
+            return [False] * len(childes)
+        alive = json.loads(resp.data)["alive"]
+        return [alive.get(ch.remote_id) is True for ch in childes]
+
+    def timeout(self, phase: str, requested: float) -> float:
+        """Effective timeout of phase (prepare | vote | commit) of the service, see LatencyTracker"""
+        return TransactionManager.instance.latency.timeout(self.service.url.geturl(), phase, requested)
+
+    def observe(self, phase: str, start: float):
+        """Record latency of phase which started at `start` (monotonic time)"""
+        TransactionManager.instance.latency.observe(self.service.url.geturl(), phase, time.monotonic() - start)
+
+    def timed_out(self, phase: str):
+        TransactionManager.instance.latency.timed_out(self.service.url.geturl(), phase)
+
+    def on_done(self, e):  # LISTENER
+        if self.committed_at is not None:
+            self.observe("commit", self.committed_at)
         debug_SSE.event({
             "event": "done_child",
             "t": datetime.now(),
@@ -328,6 +943,23 @@ class ChildTransaction(ATransaction):
             "event": "prepare_commit_child", "t": datetime.now(),
             "data": self.id
         })  # DEBUG prepare_commit_child
+        if self.action.requires:
+            wait([ch.ready_commit for ch in self.requires])  # BLOCK, killed on abort
+        if self.parent.fail.ready():  # aborted while the child was opened, don't start the work
+            return
+        if TransactionManager.instance.breakers.is_open(self.service.url.geturl()):
+            self.fail.set()  # EMIT(fail)
+            return
+        if self.action.templates:
+            try:
+                for field, value in self.action.render({ch.id: ch.result.value for ch in self.requires}).items():
+                    setattr(self, field, value)
+            except TemplateError as e:
+                debug_SSE.event({"event": "fail_child", "t": datetime.now(), "data": str(e)})  # DEBUG fail_child
+                self.fail.set()  # EMIT(fail)
+                return
+        start = time.monotonic()
+        self.action_sent = True
         try:
             resp: urllib3.HTTPResponse = self.service.session.request(
                 self.method, self.service.url.path + self.url,
@@ -336,40 +968,54 @@ class ChildTransaction(ATransaction):
                     "Content-Type": "application/json"
                 },
                 body=json.dumps(self.data),
-                timeout=self.service.timeout
+                timeout=self.timeout("prepare", self.service.timeout), priority=PREPARE
             )  # BLOCK, timeout
-        except urllib3.exceptions.HTTPError:
+        except urllib3.exceptions.HTTPError as e:
+            if isinstance(e, urllib3.exceptions.TimeoutError):
+                self.timed_out("prepare")
+            self.service.record(False)
             self.fail.set()  # EMIT(fail)
             return
-        if resp.status != 200:
+        if resp.status != 200:  # error of action is its result, not a failure of the service
+            self.action_sent = False  # the work wasn't done, there is nothing to commit
             self.fail.set()  # EMIT(fail)
             return
+        self.observe("prepare", start)
 
-        wait((self.result, self.fail), count=1, timeout=self.service.timeout)  # BLOCK, timeout
-        if self.result.successful():
-            js = self.result.get()
+        # result callback is waited in the timer wheel
+        self.sent_at = time.monotonic()
+        self.deadline = wheel.call_later(self.timeout("vote", self.service.timeout), self.on_vote_timeout)
+        self.result.rawlink(self.on_result)
+
+    def on_vote_timeout(self):
+        self.timed_out("vote")
+        self.fail.set()  # EMIT(fail)
+
+    def on_result(self, result: AsyncResult):  # LISTENER
+        self.deadline.cancel()
+        self.observe("vote", self.sent_at)  # late votes too, the estimate catches up with slow participants
+        if self.fail.ready():
+            return
+        if result.successful():
+            js = result.get()
             debug_SSE.event({
                 "event": "ready_commit_child", "t": datetime.now(),
                 "data": {"chid": self.id, **js}
             })  # DEBUG ready_commit_child
+            if self.released:
+                TransactionManager.instance.heartbeat.remove(self)
             self.ready_commit.set()  # EMIT(ready_commit)
         else:
             self.fail.set()  # EMIT(fail)
 
     @g_async
     def do_commit(self):
-        try:
-            # BLOCK, timeout
-            resp: urllib3.HTTPResponse = self.service.session.request(
-                "POST", f"{self.service.url.path}/transactions/{self.remote_id}", headers={
-                    "X-Transaction": self.key
-                },
-                timeout=self.parent.done_timeout
-            )
-        except urllib3.exceptions.HTTPError:
-            self.fail.set()  # EMIT(fail)
-            return False
-        if resp.status != 200:
+        if self.released:
+            self.commit.set()
+            self.done.set()
+            return
+        self.committed_at = time.monotonic()
+        if not TransactionManager.instance.decisions.send(self, "commit").get():  # BLOCK, batch window + timeout
             self.fail.set()  # EMIT(fail)
             return False
         debug_SSE.event({
@@ -382,17 +1028,11 @@ class ChildTransaction(ATransaction):
     @g_async
     def do_rollback(self):
         self.fail.set()
-        try:
-            # BLOCK, timeout
-            resp: urllib3.HTTPResponse = self.service.session.request(
-                "DELETE", f"{self.service.url.path}/transactions/{self.remote_id}",
-                headers={
-                    "X-Transaction": self.key
-                },
-                timeout=self.parent.done_timeout
-            )
-        except urllib3.exceptions.HTTPError:
-            pass  # auto rollback by timeout
+        if self.remote_id is not None and not (self.released or self.resolved):  # participant's transaction isn't open
+            # failed rollback is not retried: participant rolls back by ping timeout
+            result = TransactionManager.instance.decisions.send(self, "rollback")
+            if not TransactionManager.instance.presumed_abort:
+                result.get()  # BLOCK, batch window + timeout
         debug_SSE.event({
             "event": "rollback_child",
             "t": datetime.now(),
@@ -401,12 +1041,107 @@ class ChildTransaction(ATransaction):
 
     @g_async
     def send_finish(self):
-        resp: urllib3.HTTPResponse = self.service.session.request(
-            "PUT", f"{self.service.url.path}/transactions/{self.remote_id}",
-            headers={
-                "X-Transaction": self.key
-            },
-            timeout=self.parent.done_timeout
-        )
+        if self.released:
+            return
+        result = TransactionManager.instance.decisions.send(self, "finish")
+        if not TransactionManager.instance.presumed_abort:
+            result.get()  # BLOCK, batch window + timeout
+
+    def resolve(self, deadline: float) -> Optional[bool]:
+        """
+        Query outcome of one-phase commit: rollback is requested, participant which has already committed
+        answers 409 Conflict. Errors are retried until `deadline` (monotonic time), a late done vote ends the query.
 
-# TODO: Check response?
+        :return: True if participant has committed, False if it has rolled back, None if it is unknown (in doubt)
+        """
+        self.resolved = True
+        delay = self.resolve_retry
+        while not self.commit.ready():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                resp: urllib3.HTTPResponse = self.service.session.request(
+                    "DELETE", f"{self.service.url.path}/transactions/{self.remote_id}",
+                    headers={
+                        "X-Transaction": self.key
+                    },
+                    timeout=remaining, priority=DECISION
+                )  # BLOCK, timeout
+            except urllib3.exceptions.HTTPError:
+                self.service.record(False)
+            else:
+                self.service.record(resp.status < 500)
+                if resp.status == 200:
+                    return False
+                if resp.status == 409:
+                    self.commit.set()
+                    break
+                if resp.status < 500:  # participant doesn't know the transaction
+                    break
+            self.commit.wait(min(delay, max(0., deadline - time.monotonic())))  # BLOCK, until late done vote or retry
+            delay *= 2
+        if self.commit.ready():
+            self.fail.clear()
+            self.ready_commit.set()
+            self.done.set()
+            return True
+        self.in_doubt = True
+        return None
+
+    def send_decision(self, decision: str) -> bool:
+        """
+        Send phase 2 decision in its own request (called by DecisionBatcher)
+
+        :param decision: commit | rollback | finish
+        :return: True if participant applied it
+        """
+        method = {"commit": "POST", "rollback": "DELETE", "finish": "PUT"}[decision]
+        try:
+            resp: urllib3.HTTPResponse = self.service.session.request(
+                method, f"{self.service.url.path}/transactions/{self.remote_id}",
+                headers={
+                    "X-Transaction": self.key
+                },
+                timeout=self.parent.done_timeout, priority=DECISION
+            )  # BLOCK, timeout
+        except urllib3.exceptions.HTTPError:
+            self.service.record(False)
+            return False
+        self.service.record(resp.status < 500)
+        return resp.status == 200
+
+    @staticmethod
+    def send_decisions(childes: List['ChildTransaction'], decisions: List[str]) -> Optional[List[bool]]:
+        """
+        Send phase 2 decisions of transactions of one participant service in one request
+        (POST /transactions/decisions)
+
+        :return: flags in order of childes (True - participant applied decision),
+            None if service doesn't support batched decisions
+        """
+        service = childes[0].service
+        try:
+            resp: urllib3.HTTPResponse = service.session.request(
+                "POST", f"{service.url.path}/transactions/decisions",
+                body=json.dumps({"decisions": [
+                    {"_id": ch.remote_id, "key": ch.key, "decision": decision}
+                    for ch, decision in zip(childes, decisions)
+                ]}),
+                timeout=max(ch.parent.done_timeout for ch in childes), priority=DECISION
+            )  # BLOCK, timeout
+        except urllib3.exceptions.HTTPError:
+            service.record(False)
+            return [False] * len(childes)
+        service.record(resp.status < 500)
+        if resp.status in (400, 404, 405):  # older participants route it to commit of transaction "decisions"
+            return None
+        if resp.status != 200:
+            return [False] * len(childes)
+        try:
+            results = json.loads(resp.data)["results"]
+        except (ValueError, KeyError, TypeError):
+            return [False] * len(childes)
+        if not isinstance(results, list) or len(results) != len(childes):
+            return [False] * len(childes)
+        return [ok is True for ok in results]
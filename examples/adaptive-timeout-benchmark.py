@@ -0,0 +1,124 @@
+"""
+Participant votes after lognormal work time, but some actions hang and never vote.
+The client requests a safe 2 s timeout. With static timeouts every hung action holds its transaction for 2 s,
+adaptive timeouts abort it after a multiple of the observed p99 vote latency.
+"""
+import json
+import random
+import statistics
+import time
+from multiprocessing import Process
+
+import gevent
+from bson import ObjectId
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from controller.transaction_daemon.transaction_backend import TransactionManager, Transaction
+from tools.callbacks import CallbackDispatcher
+from tools.gevent import NoDelayWSGIHandler
+
+N = 1000  # transactions of each mode, CONCURRENCY at a time
+CONCURRENCY = 25
+HANG_RATE = 0.05  # share of actions which never vote
+WORK_TIME = 0.02  # s, median of participant's work time
+TIMEOUT = 2000  # ms, requested by client
+PORT = 5750
+CALLBACK_PORT = 5751
+
+
+def participant():
+    transactions = {}
+    callbacks = CallbackDispatcher()
+
+    def work(tr):
+        gevent.sleep(random.lognormvariate(0, 0.5) * WORK_TIME)
+        callbacks.put(tr["url"], {"key": tr["key"], "response": {}})
+
+    def app(environ, start_response):
+        method, path = environ["REQUEST_METHOD"], environ["PATH_INFO"]
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        data = json.loads(environ["wsgi.input"].read(length)) if length else {}
+        body = {}
+        if path == "/api/transactions":
+            _id = str(ObjectId())
+            tr = transactions[_id] = {"key": _id * 2, "url": data["callback-url"]}
+            transactions[tr["key"]] = tr
+            body = {"_id": _id, "transaction-key": tr["key"], "ping-timeout": 5000}
+        elif path == "/api/transactions/ping":
+            body = {"alive": {item["_id"]: True for item in data["transactions"]}}
+        elif path == "/api/transactions/decisions":
+            for item in data["decisions"]:
+                if item["decision"] == "commit":
+                    tr = transactions[item["_id"]]
+                    callbacks.put(tr["url"], {"key": tr["key"], "done": True})
+            body = {"results": [True] * len(data["decisions"])}
+        elif path.startswith("/api/transactions/"):
+            tr = transactions[path.rsplit("/", 1)[1]]
+            if method == "POST":  # commit
+                callbacks.put(tr["url"], {"key": tr["key"], "done": True})
+            elif method == "GET":
+                body = {"alive": True}
+        elif path == "/api/work":
+            tr = transactions[environ["HTTP_X_TRANSACTION"]]
+            if random.random() >= HANG_RATE:
+                gevent.spawn(work, tr)
+        body = json.dumps(body).encode()
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    WSGIServer(("localhost", PORT), app, log=None, handler_class=NoDelayWSGIHandler).serve_forever()
+
+
+def coordinator_callbacks(environ, start_response):
+    """Callback route of controller REST service (set_result / set_done of socket API)"""
+    data = json.loads(environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"])))
+    tr = TransactionManager.instance[ObjectId(environ["PATH_INFO"].rsplit("/", 1)[1])]
+    if isinstance(tr, Transaction):
+        ch = tr.childes[data["key"]]
+        if "response" in data:
+            ch.vote(data["response"])
+        elif data["done"]:
+            ch.done.set()
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+    return [b"{}"]
+
+
+def one(_):
+    start = time.time()
+    tr = TransactionManager.instance.create({"timeout": TIMEOUT * 2, "actions": [{
+        "_id": str(i), "service": {"url": f"http://localhost:{PORT}/api", "timeout": TIMEOUT},
+        "url": "/work", "method": "POST", "data": {}, "headers": {}
+    } for i in range(2)]})
+    gevent.wait([tr.done, tr.fail], count=1)  # BLOCK
+    return tr.done.ready(), time.time() - start
+
+
+def run(name, manager: TransactionManager, adaptive: bool):
+    manager.latency.adaptive = adaptive
+    committed, aborted = [], []
+    start = time.time()
+    for done, latency in Pool(CONCURRENCY).imap_unordered(one, range(N)):  # BLOCK
+        (committed if done else aborted).append(latency)
+    elapsed = time.time() - start
+    expected = N * (1 - (1 - HANG_RATE) ** 2)
+    print(f"{name:18s} | {N / elapsed:5.0f} tr/s | committed {len(committed)} "
+          f"(mean {statistics.mean(committed) * 1000:5.1f} ms), aborted {len(aborted)} of ~{expected:.0f} hung "
+          f"(mean time to abort {statistics.mean(aborted) * 1000:6.1f} ms)")
+
+
+if __name__ == '__main__':
+    server = Process(target=participant, daemon=True)
+    server.start()
+    WSGIServer(("localhost", CALLBACK_PORT), coordinator_callbacks, log=None,
+               handler_class=NoDelayWSGIHandler).start()
+    Transaction.set_self_url(f"http://localhost:{CALLBACK_PORT}/api/transactions")
+    time.sleep(0.5)
+
+    manager = TransactionManager()
+    run("static timeouts", manager, False)  # also collects latency
+    run("adaptive timeouts", manager, True)
+    vote = manager.latency.stats["services"][f"http://localhost:{PORT}/api"]["vote"]
+    print(f"vote latency: ewma {vote['ewma'] * 1000:.1f} ms, p99 {vote['p99'] * 1000:.1f} ms, "
+          f"timeout {manager.latency.timeout(f'http://localhost:{PORT}/api', 'vote', TIMEOUT / 1000) * 1000:.0f} ms")
+    server.terminate()
@@ -0,0 +1,60 @@
+import json
+import time
+from multiprocessing import Process
+
+import gevent
+import requests
+from gevent.pywsgi import WSGIServer
+
+from tools.callbacks import CallbackDispatcher
+from tools.gevent import g_async, NoDelayWSGIHandler
+
+N = 2000  # callbacks
+M = 50  # concurrent transactions
+PORT = 5700
+URL = f"http://localhost:{PORT}/api/alpha/transactions/5a0b3c2e1d41c81a2c0b8e13"
+
+
+def coordinator():
+    """Callback receiver, counts TCP connections (one handshake each)"""
+    connections = set()
+
+    def app(environ, start_response):
+        if environ["REQUEST_METHOD"] == "GET":
+            body = json.dumps({"connections": len(connections)}).encode()
+            connections.clear()
+        else:
+            connections.add((environ["REMOTE_ADDR"], environ["REMOTE_PORT"]))
+            environ["wsgi.input"].read()
+            body = b'{"ID": "5a0b3c2e1d41c81a2c0b8e13"}'
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    WSGIServer(("localhost", PORT), app, log=None, handler_class=NoDelayWSGIHandler).serve_forever()
+
+
+def run(name, put):
+    data = {"key": "0" * 64, "response": {"data": "x"}}
+
+    @g_async
+    def worker(n):
+        for _ in range(n):
+            put(data)
+
+    start = time.time()
+    gevent.joinall([worker(N // M) for _ in range(M)])
+    t = time.time() - start
+    connections = requests.get(URL).json()["connections"]
+    print(f"{name:28s} | {t:.3f} s | {N / t:8.1f} callbacks/s | {connections:5d} TCP handshakes")
+
+
+if __name__ == '__main__':
+    server = Process(target=coordinator, daemon=True)
+    server.start()
+    time.sleep(0.5)
+
+    run("requests.put, close", lambda data: requests.put(URL, headers={"Connection": "close"}, json=data, timeout=5))
+    dispatcher = CallbackDispatcher()
+    run("CallbackDispatcher", lambda data: dispatcher.put(URL, data).join())
+    print("dispatcher stats:", dispatcher.stats)
+    server.terminate()
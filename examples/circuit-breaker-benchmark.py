@@ -0,0 +1,137 @@
+"""
+Every transaction uses two participants, the second one is down: it accepts connections but never answers.
+Without circuit breaker every transaction holds its slot and connections until the request to the dead
+participant times out. With it the service is rejected after a few timeouts, then probed in background
+until it is up again.
+"""
+import json
+import statistics
+import time
+from multiprocessing import Process
+
+import gevent
+from bson import ObjectId
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from controller.transaction_daemon.breaker import CircuitOpen
+from controller.transaction_daemon.transaction_backend import TransactionManager, Transaction
+from tools.callbacks import CallbackDispatcher
+from tools.gevent import NoDelayWSGIHandler
+
+N = 300  # transactions of each mode, CONCURRENCY at a time
+CONCURRENCY = 20
+TIMEOUT = 1000  # ms, requested by client
+FAILURES = 5  # failures in a row which open the circuit
+PORT = 5760  # healthy participant, PORT + 1 - dead one
+CALLBACK_PORT = 5762
+
+
+def participant(port, down):
+    transactions = {}
+    callbacks = CallbackDispatcher()
+    state = {"down": down}
+
+    def app(environ, start_response):
+        method, path = environ["REQUEST_METHOD"], environ["PATH_INFO"]
+        if path == "/heal":
+            state["down"] = False
+        elif state["down"]:
+            gevent.sleep(3600)
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        data = json.loads(environ["wsgi.input"].read(length)) if length else {}
+        body = {}
+        if path == "/api/transactions":
+            _id = str(ObjectId())
+            tr = transactions[_id] = {"key": _id * 2, "url": data["callback-url"]}
+            transactions[tr["key"]] = tr
+            body = {"_id": _id, "transaction-key": tr["key"], "ping-timeout": 5000}
+        elif path == "/api/transactions/ping":
+            body = {"alive": {item["_id"]: True for item in data["transactions"]}}
+        elif path == "/api/transactions/decisions":
+            for item in data["decisions"]:
+                if item["decision"] == "commit":
+                    tr = transactions[item["_id"]]
+                    callbacks.put(tr["url"], {"key": tr["key"], "done": True})
+            body = {"results": [True] * len(data["decisions"])}
+        elif path.startswith("/api/transactions/"):
+            tr = transactions[path.rsplit("/", 1)[1]]
+            if method == "POST":  # commit
+                callbacks.put(tr["url"], {"key": tr["key"], "done": True})
+            elif method == "GET":
+                body = {"alive": True}
+        elif path == "/api/work":
+            tr = transactions[environ["HTTP_X_TRANSACTION"]]
+            callbacks.put(tr["url"], {"key": tr["key"], "response": {}})
+        body = json.dumps(body).encode()
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    WSGIServer(("localhost", port), app, log=None, handler_class=NoDelayWSGIHandler).serve_forever()
+
+
+def coordinator_callbacks(environ, start_response):
+    """Callback route of controller REST service (set_result / set_done of socket API)"""
+    data = json.loads(environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"])))
+    tr = TransactionManager.instance[ObjectId(environ["PATH_INFO"].rsplit("/", 1)[1])]
+    if isinstance(tr, Transaction):
+        ch = tr.childes[data["key"]]
+        if "response" in data:
+            ch.vote(data["response"])
+        elif data["done"]:
+            ch.done.set()
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+    return [b"{}"]
+
+
+def one(_):
+    """:return: outcome (done | fail | rejected), latency"""
+    start = time.time()
+    try:
+        tr = TransactionManager.instance.create({"timeout": TIMEOUT * 5, "actions": [{
+            "_id": str(i), "service": {"url": f"http://localhost:{PORT + i}/api", "timeout": TIMEOUT},
+            "url": "/work", "method": "POST", "data": {}, "headers": {}
+        } for i in range(2)]})
+    except CircuitOpen:
+        return "rejected", time.time() - start
+    gevent.wait([tr.done, tr.fail], count=1)  # BLOCK
+    return "done" if tr.done.ready() else "fail", time.time() - start
+
+
+def run(name, manager: TransactionManager, failures):
+    manager.breakers.failures = failures
+    outcomes = {"done": 0, "fail": 0, "rejected": 0}
+    latencies = []
+    requests = manager.connections.stats["requests"]
+    start = time.time()
+    for outcome, latency in Pool(CONCURRENCY).imap_unordered(one, range(N)):  # BLOCK
+        outcomes[outcome] += 1
+        latencies.append(latency)
+    elapsed = time.time() - start
+    print(f"{name:18s} | {N} transactions in {elapsed:5.2f} s | {outcomes['fail']} aborted, "
+          f"{outcomes['rejected']} rejected | mean time to fail {statistics.mean(latencies) * 1000:6.1f} ms | "
+          f"{manager.connections.stats['requests'] - requests} requests to participants")
+
+
+if __name__ == '__main__':
+    servers = [Process(target=participant, args=(PORT + i, bool(i)), daemon=True) for i in range(2)]
+    for server in servers:
+        server.start()
+    WSGIServer(("localhost", CALLBACK_PORT), coordinator_callbacks, log=None,
+               handler_class=NoDelayWSGIHandler).start()
+    Transaction.set_self_url(f"http://localhost:{CALLBACK_PORT}/api/transactions")
+    time.sleep(0.5)
+
+    manager = TransactionManager(breaker_reset=0.5)
+    run("no circuit breaker", manager, None)
+    run("circuit breaker", manager, FAILURES)
+
+    session = manager.connect("localhost", PORT + 1)
+    session.request("GET", "/heal")
+    healed = time.time()
+    while one(None)[0] != "done":
+        gevent.sleep(0.05)
+    print(f"participant is up: transactions commit again in {(time.time() - healed) * 1000:.0f} ms "
+          f"(breakers: {manager.breakers.stats})")
+    for server in servers:
+        server.terminate()
@@ -0,0 +1,121 @@
+"""
+Participant locks a resource when action starts and releases it on rollback.
+Locks which are not released by the coordinator are held until participant's ping timeout (leaked).
+"""
+import json
+import random
+import statistics
+import time
+from multiprocessing import Process
+
+import gevent
+from bson import ObjectId
+from gevent.pywsgi import WSGIServer
+
+from controller.transaction_daemon.transaction_backend import TransactionManager, Transaction
+from tools.callbacks import CallbackDispatcher
+from tools.gevent import NoDelayWSGIHandler
+
+N = 100  # concurrent transactions, each fails
+CHILDES = 4  # the first one fails its action
+OPEN_TIME = 0.05  # s, max time participant takes to open transaction (uniform)
+WORK_TIME = 0.2  # s, action holds a lock until it votes or is rolled back
+PORT = 5740
+CALLBACK_PORT = 5741
+
+
+def participant():
+    transactions, locks, holds = {}, {}, []
+    callbacks = CallbackDispatcher()
+    stats = {"opened": 0, "actions": 0, "rollbacks": 0}
+
+    def work(tr):
+        gevent.sleep(WORK_TIME)
+        if tr["key"] in locks:
+            callbacks.put(tr["url"], {"key": tr["key"], "response": {}})
+
+    def release(tr):
+        start = locks.pop(tr["key"], None)
+        if start is not None:
+            holds.append(time.monotonic() - start)
+            stats["rollbacks"] += 1
+
+    def app(environ, start_response):
+        method, path = environ["REQUEST_METHOD"], environ["PATH_INFO"]
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        data = json.loads(environ["wsgi.input"].read(length)) if length else {}
+        status, body = "200 OK", {}
+        if path == "/api/transactions":
+            gevent.sleep(random.uniform(0, OPEN_TIME))
+            _id = str(ObjectId())
+            tr = transactions[_id] = transactions[_id * 2] = {"key": _id * 2, "url": data["callback-url"]}
+            stats["opened"] += 1
+            body = {"_id": _id, "transaction-key": tr["key"], "ping-timeout": 5000}
+        elif path == "/api/transactions/ping":
+            body = {"alive": {item["_id"]: True for item in data["transactions"]}}
+        elif path == "/api/transactions/decisions":
+            for item in data["decisions"]:
+                if item["decision"] == "rollback":
+                    release(transactions[item["_id"]])
+            body = {"results": [True] * len(data["decisions"])}
+        elif path.startswith("/api/transactions/"):
+            if method == "DELETE":
+                release(transactions[path.rsplit("/", 1)[1]])
+        elif path == "/api/fail":
+            status = "500 Internal Server Error"
+        elif path == "/api/work":
+            tr = transactions[environ["HTTP_X_TRANSACTION"]]
+            stats["actions"] += 1
+            locks[tr["key"]] = time.monotonic()
+            gevent.spawn(work, tr)
+        else:  # /stats
+            body = {**stats, "leaked": len(locks), "hold": statistics.mean(holds) if holds else 0.}
+            locks.clear()
+            holds.clear()
+            stats.update(opened=0, actions=0, rollbacks=0)
+        body = json.dumps(body).encode()
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    WSGIServer(("localhost", PORT), app, log=None, handler_class=NoDelayWSGIHandler).serve_forever()
+
+
+def coordinator_callbacks(environ, start_response):
+    """Callback route of controller REST service (set_result of socket API)"""
+    data = json.loads(environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"])))
+    tr = TransactionManager.instance[ObjectId(environ["PATH_INFO"].rsplit("/", 1)[1])]
+    if isinstance(tr, Transaction):
+        tr.childes[data["key"]].vote(data["response"])
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+    return [b"{}"]
+
+
+def transaction():
+    return {"timeout": 5000, "actions": [{
+        "_id": str(i), "service": {"url": f"http://localhost:{PORT}/api", "timeout": 5000},
+        "url": "/fail" if i == 0 else "/work", "method": "POST", "data": {}, "headers": {}
+    } for i in range(CHILDES)]}
+
+
+if __name__ == '__main__':
+    server = Process(target=participant, daemon=True)
+    server.start()
+    WSGIServer(("localhost", CALLBACK_PORT), coordinator_callbacks, log=None,
+               handler_class=NoDelayWSGIHandler).start()
+    Transaction.set_self_url(f"http://localhost:{CALLBACK_PORT}/api/transactions")
+    time.sleep(0.5)
+
+    manager = TransactionManager()
+    start = time.time()
+    transactions = [manager.create(transaction()) for _ in range(N)]
+    gevent.wait([tr.fail for tr in transactions])  # BLOCK
+    elapsed = time.time() - start
+    gevent.sleep(WORK_TIME * 2)  # let rollbacks and late actions arrive
+
+    session = manager.connect("localhost", PORT)
+    stats = json.loads(session.request("GET", "/stats").data)
+    print(f"{N} failed transactions of {CHILDES} children in {elapsed * 1000:.0f} ms | "
+          f"participant: {stats['opened']} opened, {stats['actions']} actions, {stats['rollbacks']} rolled back, "
+          f"{stats['leaked']} locks leaked (held until ping timeout), mean lock hold {stats['hold'] * 1000:.1f} ms | "
+          f"{manager.connections.stats['requests'] / N:.1f} requests per transaction")
+    server.terminate()
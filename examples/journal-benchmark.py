@@ -0,0 +1,66 @@
+import json
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import gevent
+from bson import ObjectId
+
+from controller.transaction_daemon.journal import GroupCommitJournal
+from tools.gevent import g_async
+
+N = 2000  # transactions
+M = 100  # concurrent greenlets
+
+with open(str(Path(__file__).parent.parent / "controller" / "transaction_daemon" / "sql.json")) as f:
+    queries = json.load(f)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.executescript(queries["init"])
+    db.commit()
+    return db
+
+
+def run(name, create, finish):
+    ids = [str(ObjectId()) for _ in range(N)]
+
+    @g_async
+    def worker(chunk):
+        for _id in chunk:
+            create(_id)
+            finish(_id)
+
+    start = time.time()
+    gevent.joinall([worker(ids[i::M]) for i in range(M)])
+    t = time.time() - start
+    print(f"{name:20s} | {t:.3f} s | {N / t:8.1f} transactions/s")
+
+
+def per_call_commit(db: sqlite3.Connection):
+    def execute(query, args):
+        cur = db.cursor()
+        cur.execute(queries[query], args)
+        db.commit()
+        cur.close()
+
+    return (
+        lambda _id: execute("create", (_id,)),
+        lambda _id: execute("complete", ("{}", _id))
+    )
+
+
+def group_commit(db: sqlite3.Connection):
+    journal = GroupCommitJournal(db, queries)
+    return (
+        lambda _id: journal.write("create", (_id,)).get(),
+        lambda _id: journal.write("complete", ("{}", _id)).get()
+    )
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        run("per-call commit", *per_call_commit(connect(str(Path(tmp) / "per_call.db"))))
+        run("group commit", *group_commit(connect(str(Path(tmp) / "group.db"))))
@@ -0,0 +1,65 @@
+import json
+import time
+from multiprocessing import Process
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from controller.transaction_daemon.connections import ConnectionPoolManager, DECISION, PREPARE
+from tools.gevent import g_async, NoDelayWSGIHandler
+
+N = 400  # transactions started at once (overload)
+CONCURRENCY = 10  # max concurrent requests to the participant
+PREPARE_TIME = 0.02  # s, participant's work on prepare
+PORT = 5701
+
+
+def participant():
+    """Locks resource on prepare and releases it on commit, reports lock-hold times"""
+    locks, holds = {}, []
+
+    def app(environ, start_response):
+        path = environ["PATH_INFO"]
+        body = b"{}"
+        if path.startswith("/prepare/"):
+            gevent.sleep(PREPARE_TIME)
+            locks[path[9:]] = time.monotonic()
+        elif path.startswith("/commit/"):
+            holds.append(time.monotonic() - locks.pop(path[8:]))
+        else:
+            holds.sort()
+            body = json.dumps({
+                "mean": sum(holds) / len(holds), "p50": holds[len(holds) // 2], "p99": holds[len(holds) * 99 // 100]
+            }).encode()
+            holds.clear()
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    WSGIServer(("localhost", PORT), app, log=None, handler_class=NoDelayWSGIHandler).serve_forever()
+
+
+def run(name, commit_priority):
+    manager = ConnectionPoolManager(max_requests=CONCURRENCY)
+    pool = manager.connect("localhost", PORT)
+
+    @g_async
+    def transaction(i):
+        pool.request("POST", f"/prepare/{i}", priority=PREPARE)
+        pool.request("POST", f"/commit/{i}", priority=commit_priority)
+
+    start = time.time()
+    gevent.joinall([transaction(i) for i in range(N)])
+    elapsed = time.time() - start
+    holds = json.loads(pool.request("GET", "/stats").data)
+    print(f"{name:28s} | {N / elapsed:6.1f} tr/s | lock hold: mean {holds['mean'] * 1000:7.1f} ms, "
+          f"p50 {holds['p50'] * 1000:7.1f} ms, p99 {holds['p99'] * 1000:7.1f} ms")
+    manager.close()
+
+
+if __name__ == '__main__':
+    server = Process(target=participant, daemon=True)
+    server.start()
+    time.sleep(0.5)
+    run("one lane (FIFO)", PREPARE)
+    run("decisions first", DECISION)
+    server.terminate()
@@ -0,0 +1,112 @@
+import json
+import statistics
+import tempfile
+import time
+from multiprocessing import Process
+from pathlib import Path
+
+import gevent
+from bson import ObjectId
+from gevent.pywsgi import WSGIServer
+
+from controller.transaction_daemon.transaction_backend import TransactionManager, Transaction
+from tools.callbacks import CallbackDispatcher
+from tools.gevent import NoDelayWSGIHandler
+
+N = 300  # sequential single action transactions
+PORT = 5720  # participant without one-phase commit support, PORT + 1 - with it
+CALLBACK_PORT = 5730
+
+
+def participant(port, one_phase):
+    """Participant API (see service_example/api.raml) without work: votes as soon as action is received"""
+    transactions = {}
+    callbacks = CallbackDispatcher()
+
+    def app(environ, start_response):
+        method, path = environ["REQUEST_METHOD"], environ["PATH_INFO"]
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        data = json.loads(environ["wsgi.input"].read(length)) if length else {}
+        body = {}
+        if path == "/api/transactions":
+            _id = str(ObjectId())
+            tr = transactions[_id] = {"key": _id * 2, "url": data["callback-url"],
+                                      "one-phase": one_phase and data.get("one-phase", False)}
+            transactions[tr["key"]] = tr
+            body = {"_id": _id, "transaction-key": tr["key"], "ping-timeout": 5000, "one-phase": tr["one-phase"]}
+        elif path == "/api/transactions/ping":
+            body = {"alive": {item["_id"]: True for item in data["transactions"]}}
+        elif path == "/api/transactions/decisions":
+            for item in data["decisions"]:
+                if item["decision"] == "commit":
+                    tr = transactions[item["_id"]]
+                    callbacks.put(tr["url"], {"key": tr["key"], "done": True})
+            body = {"results": [True] * len(data["decisions"])}
+        elif path.startswith("/api/transactions/"):
+            tr = transactions[path.rsplit("/", 1)[1]]
+            if method == "POST":  # commit
+                callbacks.put(tr["url"], {"key": tr["key"], "done": True})
+            elif method == "GET":
+                body = {"alive": True}
+        else:  # action
+            tr = transactions[environ["HTTP_X_TRANSACTION"]]
+            vote = {"key": tr["key"], "response": {"data": path}}
+            if tr["one-phase"]:
+                vote["done"] = True  # committed
+            callbacks.put(tr["url"], vote)
+        body = json.dumps(body).encode()
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    WSGIServer(("localhost", port), app, log=None, handler_class=NoDelayWSGIHandler).serve_forever()
+
+
+def coordinator_callbacks(environ, start_response):
+    """Callback route of controller REST service (set_result / set_done of socket API)"""
+    data = json.loads(environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"])))
+    tr = TransactionManager.instance[ObjectId(environ["PATH_INFO"].rsplit("/", 1)[1])]
+    if isinstance(tr, Transaction):
+        ch = tr.childes[data["key"]]
+        if "response" in data:
+            ch.vote(data["response"], data.get("read-only", False), data.get("done", False))
+        elif data["done"]:
+            ch.done.set()
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+    return [b"{}"]
+
+
+def run(name, manager: TransactionManager, port):
+    requests, records = manager.connections.stats["requests"], manager.log.stats["records"]
+    latencies = []
+    for i in range(N):
+        start = time.time()
+        tr = manager.create({"timeout": 5000, "actions": [{
+            "_id": "a", "service": {"url": f"http://localhost:{port}/api", "timeout": 5000},
+            "url": f"/resource/{i}", "method": "POST", "data": {}, "headers": {}
+        }]})
+        gevent.wait([tr.done, tr.fail], count=1)  # BLOCK
+        assert tr.done.ready(), tr.status
+        latencies.append(time.time() - start)
+    gevent.sleep(0.1)  # let finish requests and log records of the last transaction go
+    latencies.sort()
+    print(f"{name:24s} | latency: mean {statistics.mean(latencies) * 1000:6.2f} ms, "
+          f"p50 {latencies[N // 2] * 1000:6.2f} ms, p99 {latencies[N * 99 // 100] * 1000:6.2f} ms | "
+          f"{(manager.connections.stats['requests'] - requests) / N:.1f} requests, "
+          f"{(manager.log.stats['records'] - records) / N:.1f} log records per transaction")
+
+
+if __name__ == '__main__':
+    servers = [Process(target=participant, args=(PORT + i, bool(i)), daemon=True) for i in range(2)]
+    for server in servers:
+        server.start()
+    WSGIServer(("localhost", CALLBACK_PORT), coordinator_callbacks, log=None,
+               handler_class=NoDelayWSGIHandler).start()
+    Transaction.set_self_url(f"http://localhost:{CALLBACK_PORT}/api/transactions")
+    time.sleep(0.5)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = TransactionManager(log=str(Path(tmp) / "decisions.log"))
+        run("two-phase commit", manager, PORT)
+        run("one-phase commit", manager, PORT + 1)
+    for server in servers:
+        server.terminate()
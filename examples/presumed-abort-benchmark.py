@@ -0,0 +1,79 @@
+"""
+Coordinator side I/O of the 2PC protocol (as in TransactionManager / Transaction) without participants:
+log records and storage rows written per transaction and acknowledgments waited for.
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import gevent
+from bson import ObjectId
+
+from controller.transaction_daemon.journal import DecisionLog
+from controller.transaction_daemon.storage import open_storage
+from tools.gevent import g_async
+
+N = 3000  # transactions
+M = 100  # concurrent transactions
+CHILDES = 3
+COMMIT_RATE = 0.8
+RTT = 0.002  # s, participant round trip (acknowledgment of a phase 2 message)
+STATUS = b"\x01\x05\x00"
+
+
+def standard(storage, log, _id, commit):
+    storage.create(_id).get()
+    for ch in range(CHILDES):
+        log.write("prepare", _id, ch=str(ch), url="http://localhost:5010/api", remote_id=str(ch), key="k")
+    if commit:
+        log.write("commit", _id).get()
+        gevent.sleep(RTT)  # commit acks
+    else:
+        log.write("abort", _id)
+        gevent.sleep(RTT)  # rollback acks
+    gevent.sleep(RTT)  # finish acks
+    storage.finish(_id, not commit, STATUS).get()
+    log.write("end", _id)
+
+
+def presumed_abort(storage, log, _id, commit):
+    if commit:
+        log.write("commit", _id, created_at=time.time(), childes=[
+            {"ch": str(ch), "url": "http://localhost:5010/api", "remote_id": str(ch), "key": "k"}
+            for ch in range(CHILDES)
+        ]).get()
+        gevent.sleep(RTT)  # commit acks
+        storage.insert(_id, False, STATUS, time.time()).get()
+        log.write("end", _id)
+    else:
+        storage.insert(_id, True, STATUS, time.time())
+
+
+def run(name, protocol, tmp: Path):
+    storage = open_storage(f"sqlite://{tmp / (name + '.sqlite')}")
+    log = DecisionLog(str(tmp / (name + ".log")))
+    latencies = []
+
+    @g_async
+    def worker(ids):
+        for i, _id in ids:
+            start = time.time()
+            protocol(storage, log, _id, i % 10 < COMMIT_RATE * 10)
+            latencies.append(time.time() - start)
+
+    ids = list(enumerate(str(ObjectId()) for _ in range(N)))
+    start = time.time()
+    gevent.joinall([worker(ids[i::M]) for i in range(M)])
+    elapsed = time.time() - start
+    log.flush()
+    storage.close()
+    print(f"{name:16s} | {N / elapsed:7.1f} tr/s | latency {sum(latencies) / N * 1000:6.1f} ms | "
+          f"storage {storage.stats['records'] / N:.1f} rows/tr | log {log.stats['records'] / N:.1f} records/tr | "
+          f"fsyncs {storage.stats['flushes'] + log.stats['flushes']}")
+    log.close()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        run("standard", standard, Path(tmp))
+        run("presumed abort", presumed_abort, Path(tmp))
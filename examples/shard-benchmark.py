@@ -0,0 +1,44 @@
+import json
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import gevent
+from bson import ObjectId
+
+from controller.transaction_daemon.storage import SqliteShard, shard_paths
+from tools.gevent import g_async
+
+N = 5000  # transactions
+M = 200  # concurrent greenlets
+
+with open(str(Path(__file__).parent.parent / "controller" / "transaction_daemon" / "sql.json")) as f:
+    queries = json.load(f)
+
+
+def run(n_shards: int, tmp: str):
+    shards = [SqliteShard(path, queries) for path in shard_paths(str(Path(tmp) / f"x{n_shards}.sqlite"), n_shards)]
+    ids = [str(ObjectId()) for _ in range(N)]
+
+    def shard(_id: str) -> SqliteShard:
+        return shards[zlib.crc32(_id.encode("utf-8")) % len(shards)]
+
+    @g_async
+    def worker(chunk):
+        for _id in chunk:
+            shard(_id).write("create", (_id,)).get()
+            shard(_id).write("complete", ("{}", _id)).get()
+
+    start = time.time()
+    gevent.joinall([worker(ids[i::M]) for i in range(M)])
+    t = time.time() - start
+    print(f"{n_shards:2d} shard(s) | {t:.3f} s | {2 * N / t:9.1f} writes/s")
+    for s in shards:
+        s.close()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (1, 2, 4, 8):
+            run(n, tmp)
@@ -0,0 +1,51 @@
+import json
+import time
+
+from bson import ObjectId
+
+from controller.transaction_daemon.codec import encode_status, decode_status
+
+N = 20000  # iterations
+
+
+def response(size: int):
+    return {
+        "id": str(ObjectId()),
+        "user": {"name": "John Smith", "email": "john.smith@example.com", "roles": ["user", "buyer"]},
+        "items": [{"sku": f"SKU-{i:06d}", "qty": i % 5 + 1, "price": 9.99 + i} for i in range(size)],
+        "status": "reserved",
+    }
+
+
+STATUSES = {
+    "small (2 actions, no payload)": {
+        "global": "DONE",
+        **{str(ObjectId()): {"status": "DONE", "service_response": None} for _ in range(2)}
+    },
+    "medium (5 actions, ~250 B payload)": {
+        "global": "DONE",
+        **{str(ObjectId()): {"status": "DONE", "service_response": response(2)} for _ in range(5)}
+    },
+    "large (10 actions, ~2 KB payload)": {
+        "global": "FAIL",
+        **{str(ObjectId()): {"status": "FAIL", "service_response": response(30)} for _ in range(10)}
+    },
+}
+
+
+def bench(fn, arg) -> float:
+    start = time.perf_counter()
+    for _ in range(N):
+        fn(arg)
+    return (time.perf_counter() - start) / N * 10 ** 6
+
+
+if __name__ == '__main__':
+    print(f"{'':36s} | {'json':>7s} {'codec':>7s} | {'json enc':>8s} {'codec enc':>9s} | "
+          f"{'json dec':>8s} {'codec dec':>9s}")
+    for name, status in STATUSES.items():
+        js, data = json.dumps(status), encode_status(status)
+        assert decode_status(data) == status
+        print(f"{name:36s} | {len(js):6d}B {len(data):6d}B | "
+              f"{bench(json.dumps, status):6.1f}us {bench(encode_status, status):7.1f}us | "
+              f"{bench(json.loads, js):6.1f}us {bench(decode_status, data):7.1f}us")
@@ -0,0 +1,51 @@
+import tempfile
+import time
+from pathlib import Path
+
+import gevent
+from bson import ObjectId
+
+from controller.transaction_daemon.storage import AStorage, open_storage
+from tools.gevent import g_async
+
+N = 5000  # transactions
+M = 200  # concurrent greenlets
+STATUS = '{"global": "DONE", "a": {"status": "DONE", "service_response": null}}'
+
+
+def run(uri: str, storage: AStorage):
+    ids = [str(ObjectId()) for _ in range(N)]
+
+    @g_async
+    def writer(chunk):
+        for _id in chunk:
+            storage.create(_id).get()
+            storage.finish(_id, False, STATUS).get()
+
+    @g_async
+    def reader(chunk):
+        for _id in chunk:
+            storage.get(_id)
+
+    start = time.time()
+    gevent.joinall([writer(ids[i::M]) for i in range(M)])
+    t_write = time.time() - start
+
+    start = time.time()
+    gevent.joinall([reader(ids[i::M]) for i in range(M)])
+    t_read = time.time() - start
+
+    print(f"{uri:32s} | {2 * N / t_write:9.1f} writes/s | {N / t_read:9.1f} reads/s")
+    storage.close()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        for uri in (
+                "memory://",
+                "sqlite://:memory:",
+                f"sqlite://{Path(tmp) / 'a.sqlite'}",
+                f"sqlite://{Path(tmp) / 'b.sqlite'}?shards=4",
+                f"mmap://{Path(tmp) / 'c.bin'}",
+        ):
+            run(uri.replace(tmp, "<tmp>"), open_storage(uri))
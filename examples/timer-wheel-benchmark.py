@@ -0,0 +1,52 @@
+import time
+import tracemalloc
+
+import gevent
+from gevent.event import Event
+
+from tools.timers import TimerWheel
+
+N = 20000  # pending timeouts (e.g. 2000 transactions * (1 global + 9 children))
+TIMEOUT = 0.5  # s, most of them are cancelled before expiry
+EXPIRED = 0.1  # part of timeouts which expire
+
+
+def greenlets():
+    events = [Event() for _ in range(N)]
+    threads = [gevent.spawn(gevent.wait, (e,), timeout=TIMEOUT) for e in events]
+    gevent.sleep(0)  # let them park
+    return lambda i: events[i].set(), lambda: gevent.joinall(threads)
+
+
+def wheel():
+    timers_wheel = TimerWheel()
+    timers = [timers_wheel.call_later(TIMEOUT, lambda: None) for _ in range(N)]
+
+    def wait():
+        while len(timers_wheel):
+            gevent.sleep(0.01)
+
+    return lambda i: timers[i].cancel(), wait
+
+
+def run(name, setup):
+    tracemalloc.start()
+    start = time.time()
+    cancel, wait = setup()
+    t_setup = time.time() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.time()
+    for i in range(int(N * (1 - EXPIRED))):
+        cancel(i)
+    gevent.sleep(0)
+    t_cancel = time.time() - start
+    wait()
+    print(f"{name:28s} | setup {t_setup * 1000:7.1f} ms | cancel {t_cancel * 1000:7.1f} ms | "
+          f"{memory / N:7.0f} B per timeout")
+
+
+if __name__ == '__main__':
+    run("greenlet per timeout", greenlets)
+    run("TimerWheel", wheel)
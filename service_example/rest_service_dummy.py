@@ -2,22 +2,22 @@ import time
 from datetime import datetime
 from hashlib import sha256
 from random import randint
-from typing import Any
+from typing import Any, Optional
 from typing import Dict
 
-import requests
 from bson import ObjectId
 from flask import request
 from gevent import Greenlet
 from gevent import sleep, wait
 from gevent.event import Event, AsyncResult
 from gevent.pywsgi import WSGIServer
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import NotFound, Conflict, ServiceUnavailable
 
 from tools import debug_SSE, MultiDict
 from tools.flask import EmptyApp
+from tools.callbacks import CallbackDispatcher
 from tools.flask.decorators import validate, json
-from tools.gevent import g_async
+from tools.gevent import g_async, NoDelayWSGIHandler
 from tools.transactions import ATransaction
 
 
@@ -25,7 +25,8 @@ class TransactionDummy(ATransaction):
     ping_timeout = 5  # sec
     result_timeout = 20  # sec
 
-    def __init__(self, callback_url: str, local_timeout: float, ping_timeout=None, result_timeout=None):
+    def __init__(self, callback_url: str, local_timeout: float, ping_timeout=None, result_timeout=None,
+                 one_phase=False):
         super().__init__(ObjectId())
         self.callback_url = callback_url
         self.local_timeout = local_timeout
@@ -48,6 +49,8 @@ class TransactionDummy(ATransaction):
 
         self._ping = Event()
         self.result = AsyncResult()
+        self.read_only = False  # vote in prepare response: coordinator skips phase 2, transaction is released at once
+        self.one_phase = one_phase  # requested by coordinator: commit as soon as work is done, report it with the vote
         self.ping_timeout_thread_obj = None  # type: Greenlet
         self.result_thread_obj = None  # type: Greenlet
 
@@ -74,7 +77,8 @@ class TransactionDummy(ATransaction):
                 self._ping.clear()  # EMIT(-ping)
                 sleep()
 
-    def do_work(self, resource):
+    def do_work(self, resource, read_only=False):
+        self.read_only = read_only
         self.result_thread_obj = self.result_thread(resource)  # THREAD:1
 
     @g_async
@@ -88,9 +92,14 @@ class TransactionDummy(ATransaction):
                 "key": self.key,
                 "response": {
                     "data": self.result.get()
-                }
+                },
+                "read-only": self.read_only
             }
-            rp = requests.put(self.callback_url, headers={"Connection": "close"}, json=data, timeout=5)
+            if self.one_phase or self.read_only:
+                self.release()
+                if self.one_phase:
+                    data["done"] = True
+            CallbackDispatcher().put(self.callback_url, data, timeout=5)  # THREAD:1, blocks only while callback pool is full
 
     # else:
     # 	raise Exception("error during work")
@@ -116,8 +125,27 @@ class TransactionDummy(ATransaction):
                 "key": self.key,
                 "done": True
             }
-            rp = requests.put(self.callback_url, headers={"Connection": "close"}, json=data)
-            debug_SSE.event({"event": "done", "t": datetime.now(), "data": None})  # DEBUG done
+            CallbackDispatcher().put(self.callback_url, data, timeout=None).rawlink(
+                lambda g: debug_SSE.event({"event": "done", "t": datetime.now(), "data": None})
+            )  # THREAD:1, blocks only while callback pool is full  # DEBUG done
+
+    def release(self):
+        """Finish transaction without commit / finish from the coordinator (read-only vote or one-phase commit)"""
+        self.commit.set()  # EMIT(commit)
+        self.done.set()  # EMIT(done)
+        debug_SSE.event({"event": "release", "t": datetime.now(), "data": None})  # DEBUG release
+
+    def committed(self, timeout: float) -> Optional[bool]:
+        """
+        Outcome of one-phase commit, which starts as soon as the work is done (see release)
+
+        :param timeout: max wait (seconds) for the running commit
+        :return: True - committed, False - commit failed and is rolled back, None - commit is still running
+        """
+        wait((self.commit, self.fail), count=1, timeout=timeout)  # BLOCK, timeout
+        if self.commit.ready():
+            return True
+        return False if self.fail.ready() else None
 
     @g_async
     def do_rollback(self):
@@ -126,6 +154,8 @@ class TransactionDummy(ATransaction):
 
 
 class Application(EmptyApp):
+    COMMIT_T_O = 2  # sec, max wait for running one-phase commit on rollback request
+
     def __init__(self, root_path, app_root, debug=True):
         super().__init__(root_path, app_root, extended_errors=debug, debug=debug)
         self.transactions: Dict[Any, TransactionDummy] = MultiDict()
@@ -134,16 +164,52 @@ class Application(EmptyApp):
         @validate(self.schemas["transaction_post"])
         @json(id_field="_id")
         def transaction_post(data):
-            tr = TransactionDummy(data["callback-url"], data["timeout"] / 1000)
+            tr = TransactionDummy(data["callback-url"], data["timeout"] / 1000, one_phase=data.get("one-phase", False))
             tr.run()  # THREAD:root
             self.transactions[str(tr.id)] = tr
             self.transactions[tr.key] = tr
             return {
                 "_id": str(tr.id),
                 "transaction-key": tr.key,
-                "ping-timeout": tr.ping_timeout * 1000
+                "ping-timeout": tr.ping_timeout * 1000,
+                "one-phase": tr.one_phase
             }
 
+        @self.route("/transactions/ping", methods=["POST"])
+        @validate(self.schemas["transaction_ping"])
+        @json()
+        # PING (many transactions)
+        def transactions_ping(data):
+            alive = {}
+            for item in data["transactions"]:
+                tr = self.transactions.get(item["_id"])
+                alive[item["_id"]] = tr is not None and tr.key == item["key"] and tr.ping()
+            return {"alive": alive}
+
+        @self.route("/transactions/decisions", methods=["POST"])
+        @validate(self.schemas["transaction_decisions"])
+        @json()
+        # COMMIT / ROLLBACK / FINISH (many transactions)
+        def transactions_decisions(data):
+            results = []
+            for item in data["decisions"]:
+                tr = self.transactions.get(item["_id"])
+                if tr is None or tr.key != item["key"]:
+                    results.append(False)
+                    continue
+                if item["decision"] == "commit":
+                    tr.do_commit()
+                elif item["decision"] == "rollback":
+                    if tr.one_phase and tr.ready_commit.ready() and tr.committed(0) is not False:
+                        results.append(False)  # committed on its own or the commit is still running
+                        continue
+                    tr.do_rollback()
+                else:
+                    tr.done.set()
+                    debug_SSE.event({"event": "finish", "t": datetime.now(), "data": None})  # DEBUG finish
+                results.append(True)
+            return {"results": results}
+
         @self.route("/transactions/<trid>", methods=["GET"])
         @json()
         # PING
@@ -185,6 +251,12 @@ class Application(EmptyApp):
             key = request.headers["X-Transaction"]
             if tr is None or tr.key != key:
                 raise NotFound
+            if tr.one_phase and tr.ready_commit.ready():
+                committed = tr.committed(self.COMMIT_T_O)  # BLOCK, COMMIT_T_O
+                if committed:
+                    raise Conflict  # committed on its own, the coordinator takes it as the outcome
+                if committed is None:
+                    raise ServiceUnavailable  # commit is still running, the coordinator retries
             tr.do_rollback()
             return {"OK": tr.fail.ready()}
 
@@ -197,7 +269,7 @@ class Application(EmptyApp):
                 tr = self.transactions.get(key)
                 if tr is None:
                     raise NotFound
-                tr.do_work(any_resource)
+                tr.do_work(any_resource, read_only=request.method == "GET")
 
                 return {
                     "transaction": {
@@ -234,7 +306,7 @@ def main(args=None):
         _debug_thread = debug_SSE.spawn(("localhost", 9010 + args.number))
     http_server = WSGIServer(
         ('localhost', 5010 + args.number), Application(args.path, "/api", debug=args.debug),
-        log=None if args.no_log else 'default'
+        log=None if args.no_log else 'default', handler_class=NoDelayWSGIHandler
     )
     http_server.serve_forever()
 
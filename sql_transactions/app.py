@@ -4,7 +4,7 @@ from typing import Any, Callable, Optional
 from typing import Dict
 
 from flask import request
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import NotFound, Conflict, ServiceUnavailable
 
 from sql_transactions.transactions import RestRouteWrapperTransaction
 from tools import debug_SSE, MultiDict
@@ -14,6 +14,7 @@ from tools.flask.decorators import validate, json
 
 class TransactionApp(EmptyApp):
     PING_T_O = 2  # sec
+    COMMIT_T_O = 2  # sec, max wait for running one-phase commit on rollback request
 
     def __init__(self, root_path, app_root, connection_factory: Callable[[], pyodbc.Connection], debug=True):
         super().__init__(root_path, app_root, extended_errors=debug, debug=debug)
@@ -30,14 +31,51 @@ class TransactionApp(EmptyApp):
                 local_timeout=data["timeout"] / 1000,
                 ping_timeout=self.PING_T_O
             )
+            tr.one_phase = data.get("one-phase", False)
             self.transactions[str(tr.id)] = tr
             self.transactions[tr.key] = tr
             return {
                 "_id": str(tr.id),
                 "transaction-key": tr.key,
-                "ping-timeout": tr.ping_timeout * 1000
+                "ping-timeout": tr.ping_timeout * 1000,
+                "one-phase": tr.one_phase
             }
 
+        @self.route("/transactions/ping", methods=["POST"])
+        @validate(self.schemas["transaction_ping"])
+        @json()
+        # PING (many transactions)
+        def transactions_ping(data):
+            alive = {}
+            for item in data["transactions"]:
+                tr = self.transactions.get(item["_id"])
+                alive[item["_id"]] = tr is not None and tr.key == item["key"] and tr.ping()
+            return {"alive": alive}
+
+        @self.route("/transactions/decisions", methods=["POST"])
+        @validate(self.schemas["transaction_decisions"])
+        @json()
+        # COMMIT / ROLLBACK / FINISH (many transactions)
+        def transactions_decisions(data):
+            results = []
+            for item in data["decisions"]:
+                tr = self.transactions.get(item["_id"])
+                if tr is None or tr.key != item["key"]:
+                    results.append(False)
+                    continue
+                if item["decision"] == "commit":
+                    tr.do_commit()
+                elif item["decision"] == "rollback":
+                    if tr.one_phase and tr.ready_commit.ready() and tr.committed(0) is not False:
+                        results.append(False)  # committed on its own or the commit is still running
+                        continue
+                    tr.do_rollback()
+                else:
+                    tr.done.set()
+                    debug_SSE.event({"event": "finish", "t": datetime.now(), "data": None})  # DEBUG finish
+                results.append(True)
+            return {"results": results}
+
         @self.route("/transactions/<trid>", methods=["GET"])
         @json()
         # PING
@@ -79,6 +117,12 @@ class TransactionApp(EmptyApp):
             key = request.headers["X-Transaction"]
             if tr is None or tr.key != key:
                 raise NotFound
+            if tr.one_phase and tr.ready_commit.ready():
+                committed = tr.committed(self.COMMIT_T_O)  # BLOCK, COMMIT_T_O
+                if committed:
+                    raise Conflict  # committed on its own, the coordinator takes it as the outcome
+                if committed is None:
+                    raise ServiceUnavailable  # commit is still running, the coordinator retries
             tr.do_rollback()
             return {"OK": tr.fail.ready()}
 
@@ -105,6 +149,7 @@ class TransactionApp(EmptyApp):
                 if not transaction:
                     return fn(self, *args, connection=self.connection_factory(), **kwargs)
                 else:
+                    transaction.read_only = request.method == "GET"
                     transaction.wrap(fn, *args, **kwargs)
                     transaction.run()
                     return self._transaction_response(transaction)
@@ -8,6 +8,7 @@ from gevent.pywsgi import WSGIServer
 
 from tools import debug_SSE, dict_factory
 from tools.flask.decorators import validate, json as json_decorator
+from tools.gevent import NoDelayWSGIHandler
 from . import CONNECTIONS
 from .app import TransactionApp
 
@@ -54,7 +55,7 @@ def main(args=None):
             "/api",
             connection_factory=lambda: pyodbc.connect(CONNECTIONS.MYSQL("test")),
             debug=args.debug),
-        log=None if args.no_log else 'default'
+        log=None if args.no_log else 'default', handler_class=NoDelayWSGIHandler
     )
     http_server.serve_forever()
 
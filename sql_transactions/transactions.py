@@ -4,15 +4,15 @@ from datetime import datetime
 from functools import partial
 from hashlib import sha256
 from random import randint
-from typing import List, Set, Callable, Any, Dict, Iterable, Union, Tuple
+from typing import List, Set, Callable, Any, Dict, Iterable, Union, Tuple, Optional
 
-import requests
 from bson import ObjectId
 from gevent import Greenlet, wait, sleep, spawn
 from gevent.event import AsyncResult
 from gevent.event import Event
 
 from tools import debug_SSE, Seconds, dict_factory
+from tools.callbacks import CallbackDispatcher
 from tools.gevent import g_async
 from tools.transactions import ATransaction
 
@@ -92,6 +92,8 @@ class SqlChain(AsyncResult):
 
 class RestTransactionMixin(ATransaction):
     """Wrap ATransaction class to create RestTransaction class"""
+    read_only = False  # vote in prepare response: coordinator skips phase 2, transaction is released at once
+    one_phase = False  # requested by coordinator: commit as soon as work is done and report it with the vote
 
     def __init__(self, _id, callback_url: str, ping_timeout: Seconds, local_timeout: Seconds):
         """
@@ -159,9 +161,36 @@ class RestTransactionMixin(ATransaction):
                 "key": self.key,
                 "response": {
                     "data": self.result.get()
-                }
+                },
+                "read-only": self.read_only
             }
-            rp = requests.put(self.callback_url, headers={"Connection": "close"}, json=data, timeout=5)
+            if self.one_phase or self.read_only:
+                self.release()  # BLOCK
+                if self.one_phase:
+                    data["done"] = True
+            CallbackDispatcher().put(self.callback_url, data, timeout=5)  # THREAD:1, blocks only while callback pool is full
+
+    def release(self):
+        """Finish transaction without commit / finish from the coordinator (read-only vote or one-phase commit)"""
+        try:
+            super().do_commit().get()  # BLOCK
+        except Exception:
+            super().do_rollback().get()  # BLOCK, failed commit is rolled back, so its outcome is known (see committed)
+            raise
+        self.done.set()  # EMIT(done)
+        debug_SSE.event({"event": "release", "t": datetime.now(), "data": None})  # DEBUG release
+
+    def committed(self, timeout: Seconds) -> Optional[bool]:
+        """
+        Outcome of one-phase commit, which starts as soon as the work is done (see release)
+
+        :param timeout: max wait (seconds) for the running commit
+        :return: True - committed, False - commit failed and is rolled back, None - commit is still running
+        """
+        wait((self.commit, self.fail), count=1, timeout=timeout)  # BLOCK, timeout
+        if self.commit.ready():
+            return True
+        return False if self.fail.ready() else None
 
     @g_async
     def do_commit(self):
@@ -173,8 +202,9 @@ class RestTransactionMixin(ATransaction):
                 "key": self.key,
                 "done": True
             }
-            rp = requests.put(self.callback_url, headers={"Connection": "close"}, json=data)
-            debug_SSE.event({"event": "done", "t": datetime.now(), "data": None})  # DEBUG done
+            CallbackDispatcher().put(self.callback_url, data, timeout=None).rawlink(
+                lambda g: debug_SSE.event({"event": "done", "t": datetime.now(), "data": None})
+            )  # THREAD:1, blocks only while callback pool is full  # DEBUG done
 
     @g_async
     def do_rollback(self):
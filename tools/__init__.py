@@ -1,6 +1,8 @@
 import collections
+import hashlib
 import json
 import logging
+import math
 import numbers
 import time
 from base64 import b64encode, b64decode
@@ -356,6 +358,136 @@ class MultiDict(MutableMapping[KT, VT]):
         )))
 
 
+class LRUCache(MutableMapping[KT, VT]):
+    """
+    Bounded dict which drops least recently used items. Counts hits and misses of get().
+
+    >>> cache = LRUCache(2)
+    >>> cache["a"], cache["b"] = 1, 2
+    >>> cache.get("a")
+    1
+    >>> cache["c"] = 3  # drops "b"
+    >>> cache.get("b"), cache.stats
+    (None, {'size': 2, 'max_size': 2, 'hits': 1, 'misses': 1, 'evictions': 1})
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = collections.OrderedDict()  # type: collections.OrderedDict[KT, VT]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: KT, default: VT = None) -> VT:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key: KT) -> VT:
+        value = self._data[key]
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: KT, value: VT):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __delitem__(self, key: KT):
+        del self._data[key]
+
+    def __contains__(self, key: KT) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterable[KT]:
+        return iter(self._data)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def __repr__(self):
+        return "<LRUCache {}/{}>".format(len(self._data), self.max_size)
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set. `item in bloom` is False only if item was never added,
+    True answers are wrong with probability ~error_rate while len(bloom) <= capacity.
+
+    >>> bloom = BloomFilter(1000)
+    >>> bloom.add("a")
+    >>> "a" in bloom, "b" in bloom
+    (True, False)
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+
+        :param capacity: expected number of items
+        :param error_rate: wanted false positive rate at full capacity
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))  # bits
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item) -> Generator[int, None, None]:
+        data = item if isinstance(item, bytes) else str(item).encode("utf-8")
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Estimated probability that `item in bloom` is True for item which was never added"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "bits": self.size,
+            "hashes": self.hashes,
+            "false_positive_rate": self.false_positive_rate
+        }
+
+    def __repr__(self):
+        return "<BloomFilter {}/{}>".format(self.count, self.capacity)
+
+
 class LevelFilter(logging.Filter):
     def __init__(self, param):
         super().__init__()
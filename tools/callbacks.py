@@ -0,0 +1,82 @@
+from typing import Dict, Any, Optional
+from urllib.parse import urlparse
+
+import requests
+from gevent.pool import Pool
+from requests.adapters import HTTPAdapter
+
+from tools import Seconds, Singleton
+
+
+class CallbackDispatcher(metaclass=Singleton):
+    """
+    Participant side client of coordinator callbacks (vote / done).
+    Keeps one keep-alive session per callback host, so callbacks of all transactions reuse the same connections
+    instead of opening a new one per request. Callbacks are sent from a bounded pool of greenlets.
+
+    >>> CallbackDispatcher().put(tr.callback_url, {"key": tr.key, "done": True}).get()
+    """
+    pool_size = 100  # max concurrent callbacks
+    connections = 10  # max keep-alive connections per host
+
+    def __init__(self, pool_size: int = None, connections: int = None):
+        """
+
+        :param pool_size: max number of callbacks sent concurrently (put blocks when all workers are busy)
+        :param connections: max number of keep-alive connections per callback host
+        """
+        self.pool = Pool(pool_size if pool_size is not None else self.pool_size)
+        self.connections = connections if connections is not None else CallbackDispatcher.connections
+        self._sessions: Dict[str, requests.Session] = {}
+        self.counters = {"sent": 0, "errors": 0}
+
+    def session(self, url: str) -> requests.Session:
+        """Session of callback host"""
+        url = urlparse(url)
+        key = f"{url.scheme}://{url.netloc}"
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.connections, pool_block=True)
+            session.mount(key, adapter)
+        return session
+
+    def put(self, url: str, data: Any, timeout: Optional[Seconds] = 5):
+        """
+        Send callback in background
+
+        :param url: callback url
+        :param data: JSON body
+        :param timeout: request timeout
+        :return: Greenlet, its value is requests.Response or None if request failed
+        """
+        return self.pool.spawn(self._send, url, data, timeout)  # BLOCK, while pool is full
+
+    def _send(self, url: str, data: Any, timeout: Optional[Seconds]) -> Optional[requests.Response]:
+        try:
+            rp = self.session(url).put(url, json=data, timeout=timeout)  # BLOCK, timeout
+        except requests.RequestException:
+            self.counters["errors"] += 1
+            return None
+        self.counters["sent"] += 1
+        return rp
+
+    @property
+    def new_connections(self) -> int:
+        """Number of TCP connections opened by all sessions"""
+        count = 0
+        for session in self._sessions.values():
+            for adapter in session.adapters.values():
+                pools = adapter.poolmanager.pools
+                count += sum(pools[key].num_connections for key in pools.keys())
+        return count
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._sessions), "new_connections": self.new_connections, **self.counters}
+
+    def close(self):
+        self.pool.join()
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
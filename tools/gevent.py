@@ -1,12 +1,17 @@
+import socket
 import sys
 from collections import defaultdict
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Iterable
 
 import gevent
 import gevent.event
 import gevent.fileobject
 import gevent.monkey
 import gevent.select
+from gevent.pywsgi import WSGIHandler
+
+from tools import Seconds
+from tools.timers import wheel
 
 gevent.monkey.patch_all()
 sys.stdin = gevent.fileobject.FileObject(sys.stdin)
@@ -25,10 +30,25 @@ def g_async(f: Callable) -> Callable[[], gevent.Greenlet]:
     return wrapper
 
 
+class NoDelayWSGIHandler(WSGIHandler):
+    """
+    pywsgi handler which disables Nagle's algorithm. Response headers and body are sent separately,
+    so on keep-alive connection the body waits for delayed ACK of the client (~40 ms per request) without it.
+
+    >>> WSGIServer(address, app, handler_class=NoDelayWSGIHandler)
+    """
+
+    def handle(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return super().handle()
+
+
 class Wait:
     """
     Object which allow to connect wait() and AsyncResult().
-    After wait conditions was completed .result will contain wait() return value
+    After wait conditions was completed .result will contain wait() return value.
+    It doesn't take a greenlet: objects are linked with rawlink and timeout is registered in the timer wheel,
+    so `then` is called from the hub and must not block.
 
     >>> some_event_1 = gevent.event.Event()
     ... some_event_2 = gevent.event.Event()
@@ -40,22 +60,38 @@ class Wait:
     """
     connections = defaultdict(list)  # type: Dict[object, List[Wait]]
 
-    def __init__(self, *args, then=None, parent=None, **kwargs):
-        self._args = args
-        self._kwargs = kwargs
+    def __init__(self, objects: Iterable, timeout: Seconds = None, count: int = None, then=None, parent=None):
         self.result = gevent.event.AsyncResult()
-        self._thread = self._wait()  # type: gevent.Greenlet
         self._then = then
+        self._objects = list(objects)
+        self._count = len(self._objects) if count is None else min(count, len(self._objects))
+        self._ready = []
+        self._timer = wheel.call_later(timeout, self._done) if timeout is not None else None
 
         if parent:
             Wait.connections[parent].append(self)
+        for obj in self._objects:
+            obj.rawlink(self._on_ready)
+        if not self._count:
+            self._done()
+
+    def _on_ready(self, obj):
+        if self.result.ready():
+            return
+        self._ready.append(obj)
+        if len(self._ready) >= self._count:
+            self._done()
 
-    @g_async
-    def _wait(self):
-        e = gevent.wait(*self._args, **self._kwargs)
+    def _done(self):
+        if self.result.ready():
+            return
+        self.kill()
         if self._then:
-            self._then(e)
-        self.result.set(e)
+            self._then(self._ready)
+        self.result.set(self._ready)
 
     def kill(self):
-        self._thread.kill()
+        if self._timer:
+            self._timer.cancel()
+        for obj in self._objects:
+            obj.unlink(self._on_ready)
@@ -0,0 +1,159 @@
+import logging
+import math
+import time
+from typing import Callable, List, Set, Optional, Dict, Any
+
+import gevent
+
+from tools import Seconds
+
+
+class Timer:
+    """Deadline registered in TimerWheel"""
+    __slots__ = ("wheel", "ticks", "callback", "args", "_slot")
+
+    def __init__(self, wheel: 'TimerWheel', ticks: int, callback: Callable, args: tuple):
+        self.wheel = wheel
+        self.ticks = ticks  # deadline (number of wheel ticks since wheel origin)
+        self.callback = callback
+        self.args = args
+        self._slot: Optional[Set[Timer]] = None
+
+    @property
+    def active(self) -> bool:
+        return self._slot is not None
+
+    def cancel(self):
+        """O(1). Does nothing if timer is already expired or cancelled"""
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+            self.wheel._count -= 1
+
+    def __repr__(self):
+        return f"<Timer {self.callback} at tick {self.ticks}{'' if self.active else ' (inactive)'}>"
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel on monotonic clock. Deadlines are kept in `levels` wheels of `slots` slots,
+    slot of level N covers slots ** N ticks; timers of upper levels are cascaded down when lower wheel wraps around.
+    Adding and cancelling a timer is O(1), all timers are served by one greenlet
+    (instead of one sleeping greenlet per timeout). The greenlet stops while there are no timers.
+
+    Callbacks are called from the wheel greenlet not earlier than the deadline (with `tick` resolution)
+    and must not block: spawn a greenlet if needed.
+
+    >>> timer = wheel.call_later(5, tr.fail.set)
+    ... timer.cancel()
+    """
+    tick: Seconds = 0.01
+    slots = 256
+    levels = 4  # 0.01 s * 256 ** 4 ~ 1.4 years
+
+    def __init__(self, tick: Seconds = None, slots: int = None, levels: int = None):
+        """
+
+        :param tick: resolution
+        :param slots: number of slots of each level
+        :param levels: number of levels (longer deadlines are cascaded from the top level until they fit)
+        """
+        self.tick = tick if tick is not None else self.__class__.tick
+        self.slots = slots if slots is not None else self.__class__.slots
+        self.levels = levels if levels is not None else self.__class__.levels
+        self._wheels: List[List[Set[Timer]]] = [[set() for _ in range(self.slots)] for _ in range(self.levels)]
+        self._origin = time.monotonic()
+        self._current = 0  # last processed tick
+        self._count = 0
+        self._thread: gevent.Greenlet = None
+        self.counters = {"added": 0, "expired": 0, "cascaded": 0}
+
+    def call_later(self, delay: Seconds, callback: Callable, *args) -> Timer:
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_at(self, deadline: float, callback: Callable, *args) -> Timer:
+        """
+        :param deadline: time.monotonic() value
+        """
+        if not self._count:
+            self._current = max(self._current, self._now())  # wheel is empty, skip idle ticks at once
+        timer = Timer(self, max(math.ceil((deadline - self._origin) / self.tick), self._current + 1), callback, args)
+        self._add(timer)
+        self._count += 1
+        self.counters["added"] += 1
+        if self._thread is None:
+            self._thread = gevent.spawn(self._run)  # THREAD:1, loop while there are timers
+        return timer
+
+    def _now(self) -> int:
+        return int((time.monotonic() - self._origin) / self.tick)
+
+    def _add(self, timer: Timer):
+        delta = timer.ticks - self._current
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                ticks = min(timer.ticks, self._current + span * self.slots - 1)  # too far deadline - top level
+                timer._slot = self._wheels[level][ticks // span % self.slots]
+                timer._slot.add(timer)
+                return
+            span *= self.slots
+
+    def _advance(self):
+        self._current += 1
+        t = self._current
+        level = 0
+        while level + 1 < self.levels and t % self.slots ** (level + 1) == 0:
+            level += 1
+        for level in range(level, 0, -1):  # cascade from the top, so lower slots receive timers before cascading
+            slot = self._wheels[level][t // self.slots ** level % self.slots]
+            timers = list(slot)
+            slot.clear()
+            self.counters["cascaded"] += len(timers)
+            for timer in timers:
+                self._add(timer)
+
+        slot = self._wheels[0][t % self.slots]
+        expired = list(slot)
+        slot.clear()
+        for timer in expired:
+            if timer.ticks > t:  # was capped to top level, not due yet
+                self._add(timer)
+                continue
+            timer._slot = None
+            self._count -= 1
+            self.counters["expired"] += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                logging.exception("Timer callback %s failed", timer.callback)
+
+    def _run(self):
+        try:
+            while self._count:
+                gevent.sleep(max(0., self._origin + (self._current + 1) * self.tick - time.monotonic()))  # BLOCK, tick
+                now = self._now()
+                while self._current < now and self._count:
+                    self._advance()
+        finally:
+            self._thread = None
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"timers": self._count, **self.counters}
+
+    def close(self):
+        if self._thread is not None:
+            self._thread.kill()
+        for wheel in self._wheels:
+            for slot in wheel:
+                for timer in slot:
+                    timer._slot = None
+                slot.clear()
+        self._count = 0
+
+
+wheel = TimerWheel()  # shared by all timeouts of the process
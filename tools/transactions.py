@@ -15,6 +15,7 @@ class EStatus(Enum):
     FAIL = 3
     COMMIT = 4
     DONE = 5
+    IN_DOUBT = 6  # participant may have committed on its own (one-phase commit), its outcome is unknown
 
 
 tools.register_type(EStatus, (
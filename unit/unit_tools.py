@@ -1,13 +1,17 @@
 import math
+import time
 from copy import deepcopy
 from typing import List
 from unittest import TestCase
 
 import gevent
 from gevent.event import Event
+from gevent.pywsgi import WSGIServer
 
 import tools
+from tools.callbacks import CallbackDispatcher
 from tools.gevent import g_async, Wait
+from tools.timers import TimerWheel
 
 
 class CoreUtilsTest(TestCase):
@@ -154,6 +158,30 @@ class CoreUtilsTest(TestCase):
         d.remove(y)
         self.assertTrue(d[2] is x and not ('a' in d and 'b' in d))
 
+    def test_lru_cache(self):
+        cache: tools.LRUCache = tools.LRUCache(3)
+        for i in range(5):
+            cache[i] = str(i)
+        self.assertEqual(list(cache), [2, 3, 4])
+        self.assertEqual(cache.get(2), "2")
+        cache[5] = "5"
+        self.assertEqual(list(cache), [4, 2, 5])
+        self.assertIsNone(cache.get(3))
+        self.assertDictEqual(cache.stats, {"size": 3, "max_size": 3, "hits": 1, "misses": 1, "evictions": 3})
+
+    def test_bloom_filter(self):
+        bloom = tools.BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(str(tools.ObjectId()))
+        ids = [str(tools.ObjectId()) for _ in range(1000)]
+        for _id in ids[:500]:
+            bloom.add(_id)
+        self.assertTrue(all(_id in bloom for _id in ids[:500]))
+        false_positives = sum(_id in bloom for _id in ids[500:])
+        self.assertLess(false_positives, 50)
+        self.assertEqual(len(bloom), 1500)
+        self.assertGreater(bloom.false_positive_rate, 0.01)
+
     def test_Singleton(self):
         class A(metaclass=tools.Singleton):
             def __init__(self, x, y):
@@ -218,3 +246,103 @@ class GEventTest(TestCase):
         print(w1.result.get(), w2.result.get())
         self.assertEqual(len(w1.result.get()), 5)
         self.assertTrue(res)
+
+    def test_wait_timeout(self):
+        e = [Event() for _ in range(3)]
+        w = Wait(e, timeout=0.05)
+        e[0].set()
+        self.assertEqual(w.result.get(timeout=1), [e[0]])
+
+
+class TimerWheelTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.wheel = TimerWheel(tick=0.005, slots=8, levels=3)
+
+    def tearDown(self):
+        self.wheel.close()
+        print("=-=")
+
+    def test_expire(self):
+        fired = []
+        start = time.monotonic()
+        # deadlines on all levels (8 ticks, 64 ticks) and beyond the last one (512 ticks = 2.56 s)
+        for delay in (0.3, 0.01, 0.1, 0.02, 0.7, 3.):
+            self.wheel.call_later(delay, lambda d: fired.append((d, time.monotonic() - start)), delay)
+        gevent.sleep(3.2)
+        self.assertEqual([d for d, _ in fired], sorted([0.3, 0.01, 0.1, 0.02, 0.7, 3.]))
+        for delay, t in fired:
+            self.assertGreaterEqual(t, delay)
+            self.assertLess(t, delay + 0.05)
+        self.assertEqual(len(self.wheel), 0)
+        gevent.sleep(0.02)
+        self.assertIsNone(self.wheel._thread)  # no timers - no greenlet
+
+    def test_cancel(self):
+        fired = []
+        timers = [self.wheel.call_later(0.02 * i, fired.append, i) for i in range(10)]
+        for timer in timers[::2]:
+            timer.cancel()
+        timers[0].cancel()
+        self.assertEqual(len(self.wheel), 5)
+        gevent.sleep(0.3)
+        self.assertEqual(fired, [1, 3, 5, 7, 9])
+        self.assertFalse(any(timer.active for timer in timers))
+
+
+class CallbackDispatcherTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.received = []
+        self.active = self.max_active = 0
+        self.server = WSGIServer(("localhost", 0), self.app, log=None)
+        self.server.start()
+        self.url = f"http://localhost:{self.server.server_port}/api/transactions/1"
+        tools.Singleton._instances.pop(CallbackDispatcher, None)
+
+    def tearDown(self):
+        tools.Singleton._instances.pop(CallbackDispatcher, None)
+        self.server.stop()
+        print("=-=")
+
+    def app(self, environ, start_response):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            data = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+            self.received.append((environ["REQUEST_METHOD"], data))
+            if environ["QUERY_STRING"]:
+                gevent.sleep(float(environ["QUERY_STRING"]))
+        finally:
+            self.active -= 1
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+        return [b"{}"]
+
+    def test_sessions(self):
+        callbacks = CallbackDispatcher()
+        for i in range(10):
+            self.assertEqual(callbacks.put(self.url, {"key": "k", "done": True}).get().status_code, 200)
+        self.assertEqual(callbacks.put(self.url.replace("localhost", "127.0.0.1"), {}).get().status_code, 200)
+        self.assertEqual(len(self.received), 11)
+        self.assertEqual(self.received[0], ("PUT", b'{"key": "k", "done": true}'))
+        self.assertEqual(callbacks.stats["sessions"], 2)  # one per host
+        self.assertEqual(callbacks.new_connections, 2)  # sequential callbacks reuse keep-alive connection
+        self.assertEqual(callbacks.stats["sent"], 11)
+        callbacks.close()
+
+    def test_timeout(self):
+        callbacks = CallbackDispatcher()
+        self.assertIsNone(callbacks.put(self.url + "?0.5", {}, timeout=0.05).get())
+        self.assertEqual(callbacks.stats["errors"], 1)
+        self.assertEqual(callbacks.stats["sent"], 0)
+        callbacks.close()
+
+    def test_pool(self):
+        callbacks = CallbackDispatcher(pool_size=2)
+        start = time.monotonic()
+        sent = [callbacks.put(self.url + "?0.1", {}) for _ in range(4)]  # the last two wait for free workers
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        gevent.joinall(sent)
+        self.assertEqual(self.max_active, 2)
+        self.assertTrue(all(g.value.status_code == 200 for g in sent))
+        callbacks.close()
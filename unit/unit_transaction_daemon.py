@@ -0,0 +1,1202 @@
+import json
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+from unittest import TestCase, mock
+
+import gevent
+import gevent.event
+from gevent.event import AsyncResult
+from gevent.pywsgi import WSGIServer
+from bson import ObjectId
+
+from controller.transaction_daemon.actions import plan, TemplateError
+from controller.transaction_daemon.admission import AdmissionController, Overloaded
+from controller.transaction_daemon.breaker import CircuitBreakers, CircuitOpen
+from controller.transaction_daemon.codec import encode_status, decode_status, PLAIN, ZLIB
+from controller.transaction_daemon.connections import ConnectionPoolManager, DECISION, PREPARE
+from controller.transaction_daemon.decisions import DecisionBatcher
+from controller.transaction_daemon.journal import GroupCommitJournal, DecisionLog
+from controller.transaction_daemon.latency import LatencyTracker, P2Quantile
+from controller.transaction_daemon.executor import StorageExecutor
+from controller.transaction_daemon.heartbeat import HeartbeatScheduler
+from controller.transaction_daemon.storage import SqliteShard, shard_paths, open_storage, AStorage, SqliteStorage, \
+    MemoryStorage, MmapStorage
+from controller.transaction_daemon.transaction_backend import TransactionManager, Transaction, ChildTransaction
+from tools import Singleton
+from tools.gevent import g_async
+
+ROOT_PATH = (Path(__file__) / ".." / "..").resolve().absolute()
+
+with open(str(ROOT_PATH / "controller" / "transaction_daemon" / "sql.json")) as f:
+    QUERIES = json.load(f)
+
+
+class JournalTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(QUERIES["init"])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        print("=-=")
+
+    def count(self, sql="SELECT COUNT(*) FROM Transactions"):
+        return self.db.execute(sql).fetchone()[0]
+
+    def test_group_commit(self):
+        journal = GroupCommitJournal(self.db, QUERIES, interval=0.05)
+        ids = [str(ObjectId()) for _ in range(100)]
+
+        @g_async
+        def worker(_id):
+            journal.write("create", (_id,)).get()
+            journal.write("complete", ("{}", _id)).get()
+
+        gevent.joinall([worker(_id) for _id in ids])
+        journal.close()
+        self.assertEqual(self.count("SELECT COUNT(*) FROM Transactions WHERE complete=1"), len(ids))
+        self.assertEqual(journal.stats["records"], 2 * len(ids))
+        self.assertEqual(journal.stats["flushes"], 2)
+
+    def test_batch_size(self):
+        journal = GroupCommitJournal(self.db, QUERIES, interval=10, batch_size=10)
+        results = [journal.write("create", (str(ObjectId()),)) for _ in range(10)]
+        gevent.wait(results, timeout=1)
+        self.assertTrue(all(r.successful() for r in results))
+        self.assertEqual(self.count(), 10)
+        journal.close()
+
+    def test_error(self):
+        journal = GroupCommitJournal(self.db, QUERIES)
+        _id = str(ObjectId())
+        journal.write("create", (_id,)).get()
+        r1 = journal.write("create", (str(ObjectId()),))
+        r2 = journal.write("create", (_id,))  # duplicate primary key
+        r3 = journal.write("complete", ("{}", _id))
+        gevent.wait((r1, r2, r3))
+        self.assertIsInstance(r2.exception, sqlite3.IntegrityError)
+        # group is retried record by record: only the bad one fails
+        self.assertTrue(r1.successful() and r3.successful())
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(self.count("SELECT COUNT(*) FROM Transactions WHERE complete=1"), 1)
+        self.assertEqual(journal.stats["records"], 3)
+        journal.close()
+
+    def test_executor(self):
+        executor = StorageExecutor()
+        db = executor(sqlite3.connect, ":memory:", check_same_thread=False)
+        executor(db.executescript, QUERIES["init"])
+        journal = GroupCommitJournal(db, QUERIES, executor=executor)
+
+        ticks = []
+
+        @g_async
+        def ticker():
+            for _ in range(10):
+                ticks.append(1)
+                gevent.sleep(0.001)
+
+        th = ticker()
+        gevent.joinall([g_async(lambda: journal.write("create", (str(ObjectId()),)).get())() for _ in range(50)])
+        th.join()
+        self.assertEqual(executor(lambda: db.execute("SELECT COUNT(*) FROM Transactions").fetchone()[0]), 50)
+        self.assertEqual(len(ticks), 10)
+        journal.close()
+        executor.close()
+
+
+class DecisionLogTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tmp.name) / "decisions.log")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        print("=-=")
+
+    def test_replay(self):
+        log = DecisionLog(self.path)
+        ids = [str(ObjectId()) for _ in range(4)]
+        for _id in ids:
+            log.write("prepare", _id, ch="a", url="http://localhost:5010/api", remote_id="1", key="k")
+        log.write("commit", ids[0])
+        log.write("abort", ids[1])
+        log.write("commit", ids[2])
+        log.write("abort", ids[2])  # commit is final
+        log.write("end", ids[3]).get()
+        log.close()
+
+        pending = DecisionLog(self.path).replay()
+        self.assertEqual(set(pending), set(ids[:3]))
+        self.assertEqual(pending[ids[0]].decision, "commit")
+        self.assertEqual(pending[ids[1]].decision, "abort")
+        self.assertEqual(pending[ids[2]].decision, "commit")
+        self.assertEqual(pending[ids[0]].childes[0]["remote_id"], "1")
+
+    def test_replay_presumed_abort(self):
+        log = DecisionLog(self.path)
+        committed, finished = str(ObjectId()), str(ObjectId())
+        childes = [{"ch": "a", "url": "http://localhost:5010/api", "remote_id": "1", "key": "k"}]
+        log.write("commit", committed, created_at=1510685742.5, childes=childes)
+        log.write("commit", finished, created_at=1510685742.5, childes=childes)
+        log.write("end", finished).get()
+        log.close()
+
+        pending = DecisionLog(self.path).replay()
+        self.assertEqual(list(pending), [committed])
+        self.assertEqual(pending[committed].decision, "commit")
+        self.assertEqual(pending[committed].childes, childes)
+        self.assertEqual(pending[committed].created_at, 1510685742.5)
+
+    def test_replay_read_only(self):
+        log = DecisionLog(self.path)
+        _id = str(ObjectId())
+        for ch in ("a", "b"):
+            log.write("prepare", _id, ch=ch, url="http://localhost:5010/api", remote_id=ch, key="k")
+        log.write("commit", _id, read_only=["b"]).get()
+        log.close()
+
+        pending = DecisionLog(self.path).replay()
+        self.assertEqual([ch["ch"] for ch in pending[_id].childes], ["a"])
+
+    def test_compact(self):
+        log = DecisionLog(self.path, max_size=1024)
+        kept = str(ObjectId())
+        log.write("prepare", kept, ch="a", url="http://localhost:5010/api", remote_id="1", key="k")
+        for _ in range(100):
+            _id = str(ObjectId())
+            log.write("prepare", _id, ch="a", url="http://localhost:5010/api", remote_id="1", key="k")
+            log.write("end", _id)
+        log.flush()
+        self.assertLess(Path(self.path).stat().st_size, 1024)
+        self.assertEqual(list(log.replay()), [kept])
+
+        log.truncate()
+        self.assertEqual(log.replay(), {})
+        log.close()
+
+    def test_failed_fsync(self):
+        log = DecisionLog(self.path)
+        _id = str(ObjectId())
+        with mock.patch("controller.transaction_daemon.journal.os.fsync", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                log.write("prepare", _id, ch="a", url="http://localhost:5010/api", remote_id="1", key="k").get()
+        self.assertEqual(log._pending, {})  # compaction doesn't keep records which weren't durable
+        log.close()
+
+
+class SqliteShardTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+
+    def tearDown(self):
+        print("=-=")
+
+    def test_shard_paths(self):
+        self.assertEqual(shard_paths("data/tr.sqlite", 1), ["data/tr.sqlite"])
+        self.assertEqual(shard_paths("data/tr.sqlite", 2), ["data/tr.0.sqlite", "data/tr.1.sqlite"])
+        self.assertEqual(shard_paths(":memory:", 2), [":memory:", ":memory:"])
+
+    def test_shard(self):
+        shard = SqliteShard(":memory:", QUERIES)
+        ids = [str(ObjectId()) for _ in range(10)]
+        gevent.wait([shard.write("create", (_id,)) for _id in ids])
+        shard.write("complete", ('{"global": "DONE"}', ids[0])).get()
+        self.assertEqual(sorted(shard.ids().get()), sorted(ids))
+        self.assertEqual(shard.get(ids[0])["status"], '{"global": "DONE"}')
+        self.assertIsNone(shard.get(str(ObjectId())))
+
+        shard.abandon().get()
+        self.assertEqual(shard.get(ids[1])["fail"], 1)
+        self.assertEqual(shard.get(ids[0])["fail"], 0)
+        shard.close()
+
+
+class StorageTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        print("=-=")
+
+    def check(self, storage: AStorage):
+        ids = [str(ObjectId()) for _ in range(10)]
+        gevent.wait([storage.create(_id) for _id in ids])
+        storage.finish(ids[0], False, b'{"global": "DONE"}').get()
+        storage.finish(ids[1], True, b'{"global": "FAIL"}').get()
+        storage.finish(ids[1], False, b'{"global": "DONE"}').get()  # ignored, transaction is failed
+        self.assertEqual(sorted(storage.ids()), sorted(ids))
+        self.assertEqual(storage.get(ids[0])["status"], b'{"global": "DONE"}')
+        self.assertEqual(storage.get(ids[1])["status"], b'{"global": "FAIL"}')
+        self.assertFalse(storage.get(ids[2])["status"])
+        self.assertIsNone(storage.get(str(ObjectId())))
+
+        committed = str(ObjectId())  # commit isn't acknowledged by all participants yet
+        storage.commit(ids[3], b'{"global": "COMMIT"}').get()
+        storage.commit(committed, b'{"global": "COMMIT"}', 1510685742.5).get()
+        storage.abandon()
+        self.assertEqual(storage.get(ids[2])["fail"], 1)
+        self.assertEqual(storage.get(ids[0])["fail"], 0)
+        self.assertEqual(storage.get(ids[0])["complete"], 1)
+        for _id in (ids[3], committed):
+            row = storage.get(_id)
+            self.assertEqual((row["state"], row["fail"], row["complete"], row["status"]),
+                             ("COMMIT", 0, 0, b'{"global": "COMMIT"}'))
+        self.assertEqual(storage.get(committed)["created_at"], 1510685742.5)
+        storage.finish(committed, False, b'{"global": "DONE"}').get()
+        self.assertEqual((storage.get(committed)["state"], storage.get(committed)["complete"]), ("DONE", 1))
+
+        inserted = str(ObjectId())  # presumed abort: stored when finished
+        storage.insert(inserted, False, b'{"global": "DONE"}', 1510685742.5).get()
+        row = storage.get(inserted)
+        self.assertEqual((row["state"], row["complete"], row["created_at"]), ("DONE", 1, 1510685742.5))
+        self.assertIsNotNone(row["finished_at"])
+        self.assertIn(inserted, storage.ids())
+        return ids + [committed, inserted]
+
+    def test_memory(self):
+        self.check(MemoryStorage())
+
+    def test_sqlite(self):
+        storage = SqliteStorage(str(Path(self.tmp.name) / "tr.sqlite"), shards=3)
+        self.check(storage)
+        storage.close()
+
+    def test_shards_mismatch(self):
+        path = str(Path(self.tmp.name) / "tr.sqlite")
+        storage = SqliteStorage(path, shards=2)
+        _id = str(ObjectId())
+        storage.create(_id).get()
+        storage.close()
+        with self.assertRaises(ValueError):
+            SqliteStorage(path, shards=3)  # would route ids to other shards
+        storage = SqliteStorage(path, shards=2)
+        self.assertIsNotNone(storage.get(_id))
+        storage.close()
+
+    def test_mmap(self):
+        path = str(Path(self.tmp.name) / "tr.bin")
+        storage = MmapStorage(path)
+        storage.chunk = 1024
+        ids = self.check(storage)
+        more = [str(ObjectId()) for _ in range(50)]
+        gevent.wait([storage.create(_id) for _id in more])  # file grows over the first chunk
+        storage.close()
+
+        storage = MmapStorage(path)  # index is rebuilt from the file
+        self.assertEqual(sorted(storage.ids()), sorted(ids + more))
+        self.assertEqual(storage.get(ids[0])["status"], b'{"global": "DONE"}')
+        self.assertEqual(storage.get(ids[2])["fail"], 1)
+        storage.close()
+
+    def test_open_storage(self):
+        self.assertIsInstance(open_storage("memory://"), MemoryStorage)
+        for uri, shards in ((":memory:", 1), ("sqlite://", 1), ("sqlite://:memory:?shards=2", 2),
+                            (str(Path(self.tmp.name) / "a.sqlite"), 1),
+                            ("sqlite://" + str(Path(self.tmp.name) / "b.sqlite") + "?shards=2", 2)):
+            storage = open_storage(uri)
+            self.assertIsInstance(storage, SqliteStorage)
+            self.assertEqual(len(storage.shards), shards)
+            storage.close()
+        self.assertTrue((Path(self.tmp.name) / "b.1.sqlite").exists())
+        storage = open_storage("mmap://" + str(Path(self.tmp.name) / "c.bin"))
+        self.assertIsInstance(storage, MmapStorage)
+        storage.close()
+        with self.assertRaises(ValueError):
+            open_storage("redis://localhost")
+
+    def test_retention(self):
+        status = json.dumps({"global": "DONE", **{f"S{i}": {"status": "DONE", "service_response": {"data": "x" * 100}}
+                                                  for i in range(10)}}).encode("utf-8")
+        for storage in (MemoryStorage(), SqliteStorage(str(Path(self.tmp.name) / "tr.sqlite"), shards=2)):
+            ids = [str(ObjectId()) for _ in range(2000)]
+            gevent.wait([storage.create(_id) for _id in ids])
+            gevent.wait([storage.finish(_id, False, status) for _id in ids[:-1]])
+
+            self.assertEqual(storage.retain(3600)["archived"], 0)
+            report = storage.retain(0)
+            self.assertEqual(report["archived"], len(ids) - 1)
+            self.assertGreater(report["reclaimed"], 0)
+            self.assertEqual(storage.get(ids[0])["status"], status)
+            self.assertEqual(storage.get(ids[0])["complete"], 1)
+            self.assertEqual(storage.get(ids[-1])["complete"], 0)
+            self.assertEqual(sorted(storage.ids()), sorted(ids))
+            storage.close()
+
+    def test_select(self):
+        for storage in (MemoryStorage(), SqliteStorage(str(Path(self.tmp.name) / "tr.sqlite"), shards=3),
+                        MmapStorage(str(Path(self.tmp.name) / "tr.bin"))):
+            ids = [str(ObjectId()) for _ in range(50)]
+            for _id in ids:
+                storage.create(_id).get()
+            gevent.wait([storage.finish(_id, True, b"") for _id in ids[::3]])
+            rows = [row for row in storage.select(None, 0, float("inf"), None, 1000)]
+            self.assertEqual(len(rows), len(ids))
+            self.assertEqual(rows, sorted(rows, key=lambda row: (row["created_at"], row["id"])))
+
+            pages, after = [], None
+            while True:
+                page = storage.select("FAIL", 0, float("inf"), after, 7)
+                pages += page
+                if len(page) < 7:
+                    break
+                after = (page[-1]["created_at"], page[-1]["id"])
+            self.assertEqual([row["id"] for row in pages], [row["id"] for row in rows if row["id"] in ids[::3]])
+            self.assertTrue(all(row["state"] == "FAIL" and row["finished_at"] for row in pages))
+
+            since, until = rows[10]["created_at"], rows[20]["created_at"]
+            self.assertTrue(all(since <= row["created_at"] < until
+                                for row in storage.select("IN_PROGRESS", since, until, None, 1000)))
+            storage.close()
+
+    def test_migration(self):
+        path = str(Path(self.tmp.name) / "old.sqlite")
+        db = sqlite3.connect(path)
+        db.executescript("CREATE TABLE Transactions (id TEXT PRIMARY KEY NOT NULL, fail BOOLEAN NOT NULL DEFAULT 0, "
+                         "complete BOOLEAN NOT NULL DEFAULT 0, status TEXT NOT NULL DEFAULT '');"
+                         "INSERT INTO Transactions(id, complete, status) VALUES ('a', 1, '{}');")
+        db.commit()
+        db.close()
+
+        storage = SqliteStorage(path)
+        self.assertEqual(storage.get("a")["status"], "{}")
+        self.assertIsNone(storage.get("a")["finished_at"])
+        self.assertEqual(storage.get("a")["state"], "DONE")
+        self.assertEqual(storage.retain(0)["archived"], 0)
+        storage.close()
+
+    def test_vacuum_mode(self):
+        path = str(Path(self.tmp.name) / "tr.sqlite")
+        db = sqlite3.connect(path)
+        db.executescript("CREATE TABLE Other (id TEXT);")  # existing database isn't rebuilt without opt-in
+        db.close()
+        for convert, mode in ((False, 0), (True, 2)):
+            storage = SqliteStorage(path, convert_vacuum=convert)
+            storage.close()
+            db = sqlite3.connect(path)
+            self.assertEqual(db.execute("PRAGMA auto_vacuum").fetchone()[0], mode)
+            db.close()
+
+        storage = SqliteStorage(str(Path(self.tmp.name) / "new.sqlite"))
+        self.assertEqual(storage.shards[0].executor(storage.shards[0]._execute, "vacuum_mode", fetch="one"),
+                         {"auto_vacuum": 2})
+        storage.close()
+
+
+class ActionsTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+
+    def tearDown(self):
+        print("=-=")
+
+    @staticmethod
+    def action(_id, then=None, patterns=None, url="/item", data=None):
+        return {"_id": _id, "service": {"url": "http://localhost:5010/api", "timeout": 1000}, "url": url,
+                "method": "POST", "data": data or {}, "headers": {}, "then": then, "$patterns": patterns or {}}
+
+    def test_plan(self):
+        actions = plan([
+            self.action("a"),
+            self.action("b", then=self.action("c", then=self.action("d"))),
+            self.action("e", patterns={"url": {"$x": "$RESPONSE[a]/x"}, "data": {"$y": "$RESPONSE[c]"}}),
+        ])
+        self.assertEqual({action.id: action.requires for action in actions}, {
+            "a": set(), "b": set(), "c": {"b"}, "d": {"c"}, "e": {"a", "c"}
+        })
+
+    def test_plan_errors(self):
+        for actions in (
+                [self.action("a"), self.action("b", then=self.action("a"))],  # duplicated id
+                [self.action("a", patterns={"url": {"$x": "$RESPONSE[z]"}})],  # unknown action
+                [self.action("a", patterns={"url": {"$x": "$RESPONSE"}})],  # no previous action
+                [self.action("a", patterns={"url": {"$x": "$RESPONSE[b]"}}),
+                 self.action("b", patterns={"url": {"$x": "$RESPONSE[a]"}})],  # cycle
+                [self.action("a", patterns={"url": {"$x": "RESPONSE"}})],  # invalid pattern
+                [self.action("a", patterns={"method": {"$x": "$RESPONSE[a]"}})],  # not supported field
+        ):
+            with self.assertRaises(TemplateError):
+                plan(actions)
+
+    def test_render(self):
+        b = self.action("c", url="/item/{id}/{id}.json", data="{body}", patterns={
+            "url": {"$id": "$RESPONSE/key1._id"},
+            "data": {"$body": "$RESPONSE[a]/items(name, value)"}
+        })
+        c = self.action("d", data={"list": ["{n}", "n={n}", "{m}"]}, patterns={"data": {"$n": "$RESPONSE[b]/key1._id"}})
+        actions = {action.id: action for action in plan([self.action("a"), self.action("b", then=b), c])}
+        responses = {
+            "a": {"items": [{"name": "x", "value": 1, "other": 2}, {"name": "y", "value": 2}]},
+            "b": {"key1": {"_id": 5}}
+        }
+        self.assertEqual(actions["c"].render(responses), {
+            "url": "/item/5/5.json",
+            "data": [{"name": "x", "value": 1}, {"name": "y", "value": 2}]
+        })
+        self.assertEqual(actions["d"].render(responses), {"data": {"list": [5, "n=5", "{m}"]}})
+        with self.assertRaises(TemplateError):
+            actions["c"].render({"a": {}, "b": {"key1": {"_id": 5}}})
+
+
+class AdmissionTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+
+    def tearDown(self):
+        print("=-=")
+
+    def test_max_active(self):
+        admission = AdmissionController(max_active=2, queue_size=1)
+        self.assertIsNone(admission.enter(["a"], 1))
+        self.assertIsNone(admission.enter(["b"], 1))
+        queued = admission.enter(["c"], 1)
+        self.assertFalse(queued.ready())
+        with self.assertRaises(Overloaded) as e:
+            admission.enter(["d"], 1)
+        self.assertGreaterEqual(e.exception.retry_after, 1)
+
+        admission.leave(["a"], 0.1)
+        self.assertTrue(queued.get(timeout=0))
+        self.assertEqual(admission.stats["active"], 2)
+        self.assertEqual(admission.stats["queue"], 0)
+        self.assertEqual((admission.stats["queued"], admission.stats["rejected"]), (1, 1))
+
+    def test_max_per_service(self):
+        admission = AdmissionController(max_per_service=1)
+        self.assertIsNone(admission.enter(["a", "b"], 1))
+        queued = admission.enter(["a"], 1)
+        self.assertIsNone(admission.enter(["c"], 1))  # doesn't wait for "a"
+        admission.leave(["a", "b"], 0.1)
+        self.assertTrue(queued.get(timeout=0))
+        self.assertEqual(admission.services, {"a": 1, "c": 1})
+
+    def test_timeout(self):
+        admission = AdmissionController(max_active=1)
+        admission.enter(["a"], 1)
+        queued = admission.enter(["a"], 0.05)
+        with self.assertRaises(Overloaded):
+            queued.get(timeout=1)
+        self.assertEqual(admission.stats["timeouts"], 1)
+        self.assertEqual(admission.stats["queue"], 0)
+        admission.leave(["a"], 0.1)
+        self.assertEqual(admission.active, 0)
+
+    def test_cancel(self):
+        admission = AdmissionController(max_active=1)
+        admission.enter(["a"], 1)
+        queued = admission.enter(["a"], 1)
+        admission.cancel(queued)
+        admission.leave(["a"], 0.1)
+        self.assertFalse(queued.ready())
+        self.assertEqual((admission.active, admission.stats["queue"]), (0, 0))
+
+
+class LatencyTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+
+    def tearDown(self):
+        print("=-=")
+
+    def test_quantile(self):
+        samples = [(i * 7919) % 1000 / 1000 for i in range(10000)]  # uniform permutation
+        p50, p99 = P2Quantile(0.5), P2Quantile(0.99)
+        for x in samples:
+            p50.add(x)
+            p99.add(x)
+        self.assertAlmostEqual(p50.value, 0.5, delta=0.01)
+        self.assertAlmostEqual(p99.value, 0.99, delta=0.01)
+
+    def test_timeout(self):
+        latency = LatencyTracker(adaptive=True, min_samples=10, factor=2, min_timeout=0.01)
+        self.assertEqual(latency.timeout("a", "vote", 5), 5)  # no observations
+        for _ in range(10):
+            latency.observe("a", "vote", 0.1)
+        self.assertAlmostEqual(latency.timeout("a", "vote", 5), 0.2)
+        self.assertEqual(latency.timeout("a", "vote", 0.15), 0.15)  # clamped by requested
+        self.assertEqual(latency.timeout("a", "commit", 5), 5)
+        self.assertEqual(latency.timeout("b", "vote", 5), 5)
+        self.assertEqual(latency.stats["services"]["a"]["vote"]["count"], 10)
+        self.assertAlmostEqual(latency.stats["services"]["a"]["vote"]["ewma"], 0.1)
+
+        latency.adaptive = False
+        self.assertEqual(latency.timeout("a", "vote", 5), 5)
+
+    def test_reset(self):
+        latency = LatencyTracker(adaptive=True, min_samples=1, max_timeouts=2)
+        latency.observe("a", "prepare", 1)
+        latency.timed_out("a", "prepare")
+        latency.observe("a", "prepare", 1)  # timeouts in a row only
+        latency.timed_out("a", "prepare")
+        self.assertLess(latency.timeout("a", "prepare", 5), 5)
+        latency.timed_out("a", "prepare")
+        self.assertEqual(latency.timeout("a", "prepare", 5), 5)  # service slowed down, learned again
+        self.assertEqual((latency.stats["timeouts"], latency.stats["resets"]), (3, 1))
+
+
+class BreakerTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+
+    def tearDown(self):
+        print("=-=")
+
+    def test_open(self):
+        opened = []
+        breakers = CircuitBreakers(lambda service: False, failures=2, reset_timeout=10, on_open=opened.append)
+        breakers.failure("a")
+        breakers.success("a")  # failures in a row only
+        breakers.failure("a")
+        breakers.check(["a", "b"])
+        breakers.failure("a")
+        self.assertEqual(opened, ["a"])
+        with self.assertRaises(CircuitOpen) as e:
+            breakers.check(["b", "a"])
+        self.assertEqual(e.exception.service, "a")
+        self.assertEqual(e.exception.retry_after, 10)
+        breakers.check(["b"])
+        self.assertEqual(breakers.stats["open"], {"a": "open"})
+        breakers.close()
+
+    def test_probe(self):
+        alive = gevent.event.Event()
+        breakers = CircuitBreakers(lambda service: alive.is_set(), failures=1, reset_timeout=0.05)
+        breakers.failure("a")
+        gevent.sleep(0.1)  # probe failed, reset timeout is doubled
+        self.assertTrue(breakers.is_open("a"))
+        self.assertEqual(breakers.stats["opened"], 2)
+        alive.set()
+        gevent.sleep(0.3)
+        self.assertFalse(breakers.is_open("a"))
+        self.assertEqual(breakers.stats["closed"], 1)
+
+    def test_disabled(self):
+        breakers = CircuitBreakers(lambda service: True)
+        for _ in range(100):
+            breakers.failure("a")
+        breakers.check(["a"])
+
+
+class CodecTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+
+    def tearDown(self):
+        print("=-=")
+
+    def test_roundtrip(self):
+        status = {
+            "global": "FAIL",
+            "action_1": {"status": "DONE", "service_response": {"data": "ok", "n": [1, 2.5, None]}},
+            "действие": {"status": "FAIL", "service_response": None},
+            "a" * 130: {"status": "COMMIT", "service_response": ""},
+        }
+        data = encode_status(status)
+        self.assertEqual(data[0], PLAIN)
+        self.assertEqual(decode_status(data), status)
+        self.assertEqual(decode_status(encode_status({"global": "IN_PROGRESS"})), {"global": "IN_PROGRESS"})
+
+    def test_compression(self):
+        status = {"global": "DONE", **{
+            f"S{i}": {"status": "DONE", "service_response": {"data": "x" * 100}} for i in range(10)
+        }}
+        data = encode_status(status)
+        self.assertEqual(data[0], ZLIB)
+        self.assertLess(len(data), len(json.dumps(status)) / 5)
+        self.assertEqual(decode_status(data), status)
+        self.assertEqual(encode_status(status, threshold=10 ** 6)[0], PLAIN)
+
+    def test_legacy(self):
+        status = {"global": "DONE", "a": {"status": "DONE", "service_response": None}}
+        self.assertEqual(decode_status(json.dumps(status)), status)
+        self.assertEqual(decode_status(json.dumps(status).encode("utf-8")), status)
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.concurrent = self.max_concurrent = 0
+
+        def app(environ, start_response):
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            gevent.sleep(0.01)
+            self.concurrent -= 1
+            start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+            return [b"{}"]
+
+        self.server = WSGIServer(("localhost", 0), app, log=None)
+        self.server.start()
+        self.port = self.server.server_port
+
+    def tearDown(self):
+        self.server.stop()
+        print("=-=")
+
+    def test_reuse(self):
+        manager = ConnectionPoolManager()
+        for _ in range(3):  # 3 transactions one after another
+            pool = manager.connect("localhost", self.port)
+            for _ in range(5):
+                self.assertEqual(pool.request("GET", "/").status, 200)
+            manager.disconnect("localhost", self.port)
+        stats = manager.stats
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 2))
+        self.assertEqual((stats["requests"], stats["new_connections"], stats["reused"]), (15, 1, 14))
+        self.assertEqual((stats["pools"], stats["sockets"]), (1, 1))
+        manager.close()
+        self.assertEqual(manager.sockets, 0)
+
+    def test_no_keep_alive(self):
+        manager = ConnectionPoolManager(keep_alive=False)
+        for _ in range(2):
+            manager.connect("localhost", self.port).request("GET", "/")
+            manager.disconnect("localhost", self.port)
+        self.assertEqual(manager.stats["new_connections"], 2)
+        self.assertEqual((manager.stats["pools"], manager.sockets), (0, 0))
+
+    def test_idle_ttl(self):
+        manager = ConnectionPoolManager(idle_ttl=0.05)
+        pool = manager.connect("localhost", self.port)
+        gevent.joinall([gevent.spawn(pool.request, "GET", "/") for _ in range(3)])
+        self.assertEqual(manager.sockets, 3)
+        gevent.sleep(0.2)
+        self.assertEqual((manager.stats["pools"], manager.sockets), (1, 0))  # pool is used by transaction
+        manager.disconnect("localhost", self.port)
+        gevent.sleep(0.2)
+        self.assertEqual(manager.stats["pools"], 0)
+        self.assertEqual(manager.stats["evicted"], 3)
+        manager.close()
+
+    def test_max_sockets(self):
+        manager = ConnectionPoolManager(max_sockets=2)
+        pool = manager.connect("localhost", self.port)
+        threads = [gevent.spawn(pool.request, "GET", "/") for _ in range(10)]
+        gevent.joinall(threads)
+        self.assertTrue(all(th.value.status == 200 for th in threads))
+        self.assertLessEqual(self.max_concurrent, 2)
+        self.assertLessEqual(manager.sockets, 2)
+
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Length", "0")])
+            return [b""]
+
+        other = WSGIServer(("localhost", 0), app, log=None)
+        other.start()
+        manager.connect("localhost", other.server_port).request("GET", "/")  # idle socket is closed to make room
+        self.assertLessEqual(manager.sockets, 2)
+        self.assertEqual(manager.stats["evicted"], 1)
+        other.stop()
+        manager.close()
+
+    def test_priority(self):
+        order = []
+
+        def app(environ, start_response):
+            order.append(environ["PATH_INFO"])
+            gevent.sleep(0.01)
+            start_response("200 OK", [("Content-Length", "0")])
+            return [b""]
+
+        server = WSGIServer(("localhost", 0), app, log=None)
+        server.start()
+        manager = ConnectionPoolManager(max_requests=2)  # sockets aren't limited, requests are
+        pool = manager.connect("localhost", server.server_port)
+        self.assertEqual((pool.lanes.size, pool.pool.maxsize), (2, ConnectionPoolManager.pool_size))
+        threads = [gevent.spawn(pool.request, "POST", f"/prepare{i}", priority=PREPARE) for i in range(6)]
+        gevent.sleep(0)
+        threads += [gevent.spawn(pool.request, "POST", f"/commit{i}", priority=DECISION) for i in range(2)]
+        gevent.joinall(threads)
+        # 2 prepares were sent before commits arrived, the others wait behind commits
+        self.assertEqual(sorted(order[2:4]), ["/commit0", "/commit1"])
+        self.assertEqual(sorted(order[:2] + order[4:]), [f"/prepare{i}" for i in range(6)])
+        stats = manager.stats
+        self.assertEqual((stats["queued_prepare"], stats["queued_decision"], stats["waiting"]), (4, 2, 0))
+        server.stop()
+        manager.close()
+
+
+class HeartbeatTest(TestCase):
+    class Child:
+        def __init__(self, url, ping_timeout=0.3):
+            self.service = type("Service", (), {"url": urlparse(url)})
+            self.ping_timeout = ping_timeout
+            self.fail = gevent.event.Event()
+            self.alive = True
+            self.pings = 0
+
+        def ping(self):
+            self.pings += 1
+            gevent.sleep(0.01)
+            return self.alive
+
+    def setUp(self):
+        print(self._testMethodName)
+        self.scheduler = HeartbeatScheduler(tick=0.02)
+
+    def tearDown(self):
+        self.scheduler.close()
+        print("=-=")
+
+    def test_grouping(self):
+        childes = [self.Child(f"http://localhost:{5010 + i % 2}/api") for i in range(100)]
+        for ch in childes:
+            self.scheduler.add(ch)
+        self.assertEqual(self.scheduler.stats["services"], 2)
+        gevent.sleep(0.5)
+        stats = self.scheduler.stats
+        self.assertEqual(stats["children"], 100)
+        self.assertTrue(all(2 <= ch.pings <= 3 for ch in childes), [ch.pings for ch in childes])
+        self.assertLessEqual(stats["rounds"], 2 * 3)
+        self.assertEqual(stats["pings"], sum(ch.pings for ch in childes))
+
+        for ch in childes:
+            self.scheduler.remove(ch)
+        gevent.sleep(0.1)
+        self.assertEqual((self.scheduler.stats["services"], self.scheduler.stats["children"]), (0, 0))
+
+    def test_fail(self):
+        ok, dead = self.Child("http://localhost:5010/api"), self.Child("http://localhost:5010/api")
+        dead.alive = False
+        self.scheduler.add(ok)
+        self.scheduler.add(dead)
+        gevent.sleep(0.1)
+        self.assertTrue(dead.fail.ready())
+        self.assertFalse(ok.fail.ready())
+        self.assertEqual(self.scheduler.stats["failures"], 1)
+        self.assertEqual(self.scheduler.stats["children"], 1)
+
+    def test_batch(self):
+        class BatchChild(self.Child):
+            batches = []
+
+            @staticmethod
+            def ping_batch(childes):
+                BatchChild.batches.append(len(childes))
+                gevent.sleep(0.01)
+                return [ch.alive for ch in childes]
+
+        self.scheduler.batch_size = 40
+        childes = [BatchChild("http://localhost:5010/api") for _ in range(100)]
+        childes[0].alive = False
+        for ch in childes:
+            self.scheduler.add(ch)
+        gevent.sleep(0.1)
+        self.assertEqual(BatchChild.batches, [40, 40, 20])
+        self.assertTrue(childes[0].fail.ready())
+        self.assertEqual(sum(ch.pings for ch in childes), 0)
+        stats = self.scheduler.stats
+        self.assertEqual((stats["requests"], stats["pings"], stats["failures"], stats["children"]), (3, 100, 1, 99))
+
+    def test_batch_fallback(self):
+        class OldServiceChild(self.Child):
+            @staticmethod
+            def ping_batch(childes):
+                return None
+
+        childes = [OldServiceChild("http://localhost:5010/api") for _ in range(10)]
+        for ch in childes:
+            self.scheduler.add(ch)
+        gevent.sleep(0.1)
+        self.assertTrue(all(ch.pings == 1 for ch in childes))
+        self.assertEqual(self.scheduler.stats["requests"], 11)
+
+
+class DecisionBatcherTest(TestCase):
+    class Child:
+        requests = []
+
+        def __init__(self, url):
+            self.service = type("Service", (), {"url": urlparse(url)})
+
+        def send_decision(self, decision):
+            self.requests.append([decision])
+            return True
+
+        @classmethod
+        def send_decisions(cls, childes, decisions):
+            cls.requests.append(decisions)
+            return [True] * len(childes)
+
+    def setUp(self):
+        print(self._testMethodName)
+        self.Child.requests = []
+
+    def tearDown(self):
+        print("=-=")
+
+    def test_batch(self):
+        batcher = DecisionBatcher(window=0.02, batch_size=20)
+        childes = [self.Child(f"http://localhost:{5010 + i % 2}/api") for i in range(50)]
+        results = [batcher.send(ch, "commit") for ch in childes]
+        self.assertEqual(batcher.stats["pending"], 10)
+        gevent.wait(results, timeout=1)
+        self.assertTrue(all(r.get() for r in results))
+        # full batches (20 decisions per service) are sent at once, the rest - when the window closes
+        self.assertEqual(sorted(len(r) for r in self.Child.requests), [5, 5, 20, 20])
+        self.assertEqual(batcher.stats, {"pending": 0, "decisions": 50, "requests": 4, "batches": 4})
+
+    def test_no_window(self):
+        batcher = DecisionBatcher(window=0)
+        results = [batcher.send(self.Child("http://localhost:5010/api"), d) for d in ("commit", "finish")]
+        gevent.wait(results, timeout=1)
+        self.assertEqual(self.Child.requests, [["commit"], ["finish"]])
+
+    def test_fallback(self):
+        class OldServiceChild(self.Child):
+            @classmethod
+            def send_decisions(cls, childes, decisions):
+                cls.requests.append(decisions)
+                return None
+
+        batcher = DecisionBatcher(window=0.01)
+        for _ in range(2):
+            results = [batcher.send(OldServiceChild("http://localhost:5010/api"), "rollback") for _ in range(3)]
+            gevent.wait(results, timeout=1)
+            self.assertTrue(all(r.get() for r in results))
+        # the batch is tried once, then decisions are sent one by one
+        self.assertEqual(batcher.stats["requests"], 1 + 3 + 3)
+
+    def test_bad_reply(self):
+        class ShortReplyChild(self.Child):
+            @classmethod
+            def send_decisions(cls, childes, decisions):
+                return [True]
+
+        class BrokenChild(self.Child):
+            def send_decision(self, decision):
+                raise ValueError("bad JSON")
+
+            @classmethod
+            def send_decisions(cls, childes, decisions):
+                raise ValueError("bad JSON")
+
+        batcher = DecisionBatcher(window=0.01)
+        for child_class in (ShortReplyChild, BrokenChild):
+            results = [batcher.send(child_class("http://localhost:5010/api"), "commit") for _ in range(3)]
+            gevent.wait(results, timeout=1)
+            self.assertEqual([r.get(block=False) for r in results], [False] * 3)  # failed, not stuck
+
+        batcher = DecisionBatcher(window=0)
+        result = batcher.send(BrokenChild("http://localhost:5010/api"), "commit")
+        self.assertFalse(result.get(timeout=1))
+
+
+class Participant:
+    """
+    Participant service for coordinator tests (see service_example/api.raml) without work:
+    votes as soon as action is received (`auto_vote`), commits at once. Callbacks go to TransactionManager directly.
+    Rollback of committed one-phase transaction is answered with 409.
+    """
+
+    def __init__(self, port=0, one_phase=True):
+        """
+        :param one_phase: supports one-phase commit (False - older participant which doesn't know the flag)
+        """
+        self.one_phase = one_phase
+        self.auto_vote = True
+        self.lose_votes = False  # one-phase transaction is committed, but its vote doesn't reach the coordinator
+        self.action_status = "200 OK"
+        self.delete_status = "200 OK"
+        self.commit_status = "200 OK"
+        self.open_delay = 0  # s
+        self.requests = []  # (method, path)
+        self.transactions = {}
+        self.server = WSGIServer(("localhost", port), self.app, log=None)
+        self.server.start()
+        self.url = f"http://localhost:{self.server.server_port}/api"
+
+    def app(self, environ, start_response):
+        method, path = environ["REQUEST_METHOD"], environ["PATH_INFO"]
+        self.requests.append((method, path))
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        data = json.loads(environ["wsgi.input"].read(length)) if length else {}
+        status, body = "200 OK", {}
+        if path == "/api/transactions":
+            gevent.sleep(self.open_delay)
+            _id = str(len(self.transactions) + 1)
+            tr = self.transactions[_id] = {
+                "key": str(ObjectId()), "tr": ObjectId(data["callback-url"].rsplit("/", 1)[1]),
+                "one-phase": self.one_phase and data.get("one-phase", False), "committed": False
+            }
+            body = {"_id": _id, "transaction-key": tr["key"], "ping-timeout": 5000}
+            if self.one_phase:
+                body["one-phase"] = tr["one-phase"]
+        elif path == "/api/transactions/ping":
+            body = {"alive": {item["_id"]: True for item in data["transactions"]}}
+        elif path == "/api/transactions/decisions":
+            status = "404 Not Found"  # decisions are sent one by one
+        elif path.startswith("/api/transactions/"):
+            tr = self.transactions.get(path.rsplit("/", 1)[1])
+            if method == "POST" and tr:
+                status = self.commit_status
+                if status == "200 OK":
+                    tr["committed"] = True
+                    gevent.spawn(self.callback, tr, {"done": True})
+            elif method == "DELETE":
+                status = "409 Conflict" if tr and tr["one-phase"] and tr["committed"] else self.delete_status
+            elif method == "GET":
+                body = {"alive": True}
+        else:  # action
+            tr = next(tr for tr in self.transactions.values() if tr["key"] == environ["HTTP_X_TRANSACTION"])
+            status = self.action_status
+            if self.auto_vote and status == "200 OK":
+                tr["committed"] = tr["one-phase"]
+                if not self.lose_votes:
+                    gevent.spawn(self.callback, tr, {"response": {"data": path}, "done": tr["one-phase"]})
+        body = json.dumps(body).encode()
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    @staticmethod
+    def callback(tr: dict, data: dict):
+        """set_result / set_done of socket API"""
+        transaction = TransactionManager.instance[tr["tr"]]
+        if isinstance(transaction, Transaction):
+            ch = transaction.childes[tr["key"]]
+            if "response" in data:
+                ch.vote(data["response"], done=data["done"])
+            else:
+                ch.done.set()
+
+    def close(self):
+        self.server.stop()
+
+
+def new_manager(**options) -> TransactionManager:
+    """TransactionManager is a singleton, every test needs a new one"""
+    Singleton._instances.pop(TransactionManager, None)
+    return TransactionManager(**options)
+
+
+class AbortTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.manager = new_manager()
+        self.failing = Participant()
+        self.failing.action_status = "500 Internal Server Error"
+        self.slow = Participant()
+        self.slow.open_delay = 0.5
+
+    def tearDown(self):
+        self.failing.close()
+        self.slow.close()
+        print("=-=")
+
+    @staticmethod
+    def action(_id, participant: Participant, then=None):
+        return {"_id": _id, "service": {"url": participant.url, "timeout": 1000}, "url": f"/{_id}", "method": "POST",
+                "data": {}, "headers": {}, "then": then}
+
+    def test_cancel_prepare(self):
+        tr = self.manager.create({"timeout": 5000, "actions": [
+            self.action("a", self.failing, then=self.action("b", self.failing)),  # b waits for a, a fails
+            self.action("c", self.slow)  # parent fails while c is opened
+        ]})
+        gevent.wait([tr.fail], timeout=1)
+        gevent.sleep(1)  # the slow participant answers the cancelled open request
+        self.assertEqual(self.manager.status(tr.id)["global"], "FAIL")
+        # the dependent child was opened, it gets no action but is rolled back
+        requests = [request for request in self.failing.requests if request[1] != "/api/transactions/decisions"]
+        self.assertEqual(sorted(requests), sorted([
+            ("POST", "/api/transactions"), ("POST", "/api/transactions"), ("POST", "/api/a"),
+            ("DELETE", "/api/transactions/1"), ("DELETE", "/api/transactions/2")
+        ]))
+        # the late child has no remote id: no action and no rollback, the participant rolls back by ping timeout
+        self.assertEqual(self.slow.requests, [("POST", "/api/transactions")])
+        self.assertIsNone(tr.childes["c"].remote_id)
+
+    def test_commit_failure(self):
+        TransactionManager.def_recovery_retry = 0.05
+        self.addCleanup(setattr, TransactionManager, "def_recovery_retry", 1)
+        ok, refusing = Participant(), Participant()
+        self.addCleanup(ok.close)
+        self.addCleanup(refusing.close)
+        refusing.commit_status = "500 Internal Server Error"
+        tr = self.manager.create({"timeout": 5000, "actions": [self.action("a", ok), self.action("b", refusing)]})
+        gevent.wait([tr.fail], timeout=3)
+        gevent.sleep(0.1)
+        self.assertTrue(tr.commit.ready())
+        # commit decision is final: nobody is rolled back, the refused commit is retried
+        requests = ok.requests + refusing.requests
+        self.assertNotIn("DELETE", [method for method, path in requests])
+        status = self.manager.status(tr.id)
+        self.assertEqual((status["global"], status["a"]["status"], status["b"]["status"]), ("COMMIT", "DONE", "COMMIT"))
+        self.assertEqual(self.manager.storage.get(str(tr.id))["state"], "COMMIT")
+
+        refusing.commit_status = "200 OK"
+        self.manager.recovering[str(tr.id)].join(timeout=5)
+        self.assertEqual(refusing.requests[-2:], [("POST", "/api/transactions/1"), ("PUT", "/api/transactions/1")])
+        self.assertNotIn("DELETE", [method for method, path in refusing.requests])
+        status = self.manager.status(tr.id)
+        self.assertEqual((status["global"], status["b"]["status"]), ("DONE", "DONE"))
+        self.assertEqual(self.manager.stats["recovering"], 0)
+
+
+class AdmissionManagerTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.participant = Participant()
+        self.participant.auto_vote = False
+        self.manager = new_manager(max_active=1)
+
+    def tearDown(self):
+        self.participant.close()
+        print("=-=")
+
+    def transaction(self, timeout):
+        return self.manager.create({"timeout": timeout, "actions": [{
+            "_id": _id, "service": {"url": self.participant.url, "timeout": 5000}, "url": "/item",
+            "method": "POST", "data": {}, "headers": {}
+        } for _id in ("a", "b")]})
+
+    def test_deadline(self):
+        self.transaction(500)  # holds the only slot until its global timeout
+        start = time.monotonic()
+        queued = self.transaction(1000)
+        self.assertFalse(queued.admitted)
+        queued.fail.wait(timeout=3)
+        self.assertTrue(queued.admitted)
+        # deadline is counted from creation, not from admission (after 0.5 s in the queue)
+        self.assertLess(time.monotonic() - start, 1.3)
+
+    def test_storage_error(self):
+        error = AsyncResult()
+        error.set_exception(sqlite3.OperationalError("disk I/O error"))
+        with mock.patch.object(self.manager.storage, "create", return_value=error):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.transaction(1000)
+        self.assertEqual(self.manager.admission.active, 0)  # slot is released
+        tr = self.transaction(1000)
+        with mock.patch.object(self.manager.storage, "create", return_value=error):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.transaction(1000)  # queued
+        self.assertEqual(self.manager.admission.stats["queue"], 0)
+        self.assertEqual(list(self.manager._transactions), [tr.id])
+
+
+class OnePhaseTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.participant = Participant()
+        self.manager = new_manager()
+        Transaction.done_timeout = 0.5
+        ChildTransaction.resolve_retry = 0.05
+
+    def tearDown(self):
+        Transaction.done_timeout = 30
+        ChildTransaction.resolve_retry = 0.1
+        self.participant.close()
+        print("=-=")
+
+    def run_transaction(self, participant: Participant) -> dict:
+        """:return: final status"""
+        tr = self.manager.create({"timeout": 5000, "actions": [{
+            "_id": "a", "service": {"url": participant.url, "timeout": 200}, "url": "/item", "method": "POST",
+            "data": {}, "headers": {}
+        }]})
+        for _ in range(100):
+            if tr.id not in self.manager._transactions:
+                break
+            gevent.sleep(0.05)
+        return self.manager.status(tr.id)
+
+    def phase_2(self, participant: Participant):
+        return [(method, path) for method, path in participant.requests if path == "/api/transactions/1"]
+
+    def test_one_phase(self):
+        status = self.run_transaction(self.participant)
+        self.assertEqual((status["global"], status["a"]["status"]), ("DONE", "DONE"))
+        self.assertEqual(self.phase_2(self.participant), [])  # committed with the vote
+
+    def test_legacy_participant(self):
+        participant = Participant(one_phase=False)  # doesn't know the flag, 2PC goes on
+        status = self.run_transaction(participant)
+        self.assertEqual(status["global"], "DONE")
+        self.assertEqual(self.phase_2(participant), [("POST", "/api/transactions/1"), ("PUT", "/api/transactions/1")])
+        participant.close()
+
+    def test_lost_vote(self):
+        self.participant.lose_votes = True  # committed, but the vote times out
+        status = self.run_transaction(self.participant)
+        self.assertEqual((status["global"], status["a"]["status"]), ("DONE", "DONE"))  # not presumed aborted
+        self.assertEqual(self.phase_2(self.participant), [("DELETE", "/api/transactions/1")])  # answered with 409
+
+    def test_rolled_back(self):
+        self.participant.auto_vote = False  # didn't do the work, rollback succeeds
+        status = self.run_transaction(self.participant)
+        self.assertEqual((status["global"], status["a"]["status"]), ("FAIL", "FAIL"))
+        self.assertEqual(self.phase_2(self.participant), [("DELETE", "/api/transactions/1")])
+
+    def test_in_doubt(self):
+        self.participant.auto_vote = False
+        self.participant.delete_status = "503 Service Unavailable"
+        status = self.run_transaction(self.participant)
+        self.assertEqual((status["global"], status["a"]["status"]), ("IN_DOUBT", "IN_DOUBT"))
+        self.assertGreater(len(self.phase_2(self.participant)), 1)  # retried until done_timeout
+
+    def test_late_vote(self):
+        self.participant.auto_vote = False
+        self.participant.delete_status = "503 Service Unavailable"
+        tr = self.participant.transactions
+        gevent.spawn_later(0.4, lambda: Participant.callback(tr["1"], {"response": {}, "done": True}))
+        status = self.run_transaction(self.participant)
+        self.assertEqual((status["global"], status["a"]["status"]), ("DONE", "DONE"))
+
+
+class RecoveryTest(TestCase):
+    def setUp(self):
+        print(self._testMethodName)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tmp.name) / "decisions.log")
+        self.participant = Participant()
+        down = WSGIServer(("localhost", 0), self.participant.app, log=None)
+        down.start()
+        self.down_port = down.server_port  # nothing listens on it
+        down.stop()
+        TransactionManager.def_recovery_retry = 0.05
+
+    def tearDown(self):
+        TransactionManager.def_recovery_retry = 1
+        self.participant.close()
+        self.tmp.cleanup()
+        print("=-=")
+
+    def test_unreachable_participant(self):
+        _id = str(ObjectId())
+        log = DecisionLog(self.path)
+        log.write("commit", _id, created_at=time.time(), childes=[
+            {"ch": "a", "url": self.participant.url, "remote_id": "1", "key": "k1"},
+            {"ch": "b", "url": f"http://localhost:{self.down_port}/api", "remote_id": "2", "key": "k2"}
+        ]).get()
+        log.close()
+
+        manager = new_manager(log=self.path)
+        self.assertEqual(self.participant.requests, [("POST", "/api/transactions/1"), ("PUT", "/api/transactions/1")])
+        status = manager.status(ObjectId(_id))
+        self.assertEqual((status["global"], status["a"]["status"], status["b"]["status"]), ("COMMIT", "DONE", "COMMIT"))
+        # commit decision is kept for the participant which didn't acknowledge it
+        self.assertEqual([ch["ch"] for ch in manager.log.replay()[_id].childes], ["b"])
+        # not finished while commit is retried: abandon on start didn't fail it, retention doesn't archive it
+        row = manager.storage.get(_id)
+        self.assertEqual((row["state"], row["fail"], row["complete"], row["finished_at"]), ("COMMIT", 0, 0, None))
+        self.assertEqual([tr["id"] for tr in manager.list_transactions(state="COMMIT")["transactions"]], [_id])
+
+        participant = Participant(port=self.down_port)  # is up again
+        manager.recovering[_id].join(timeout=5)
+        self.assertEqual(participant.requests, [("POST", "/api/transactions/2"), ("PUT", "/api/transactions/2")])
+        status = manager.status(ObjectId(_id))
+        self.assertEqual((status["global"], status["b"]["status"]), ("DONE", "DONE"))
+        self.assertEqual(manager.storage.get(_id)["state"], "DONE")
+        self.assertEqual(manager.log.replay(), {})
+        self.assertEqual(manager.stats["recovering"], 0)
+        participant.close()
+        manager.log.close()